@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+イベントループ遅延ベンチマーク
+同時メンション時の notes/create 呼び出しで、イベントループがどれだけ止まるかを計測する
+
+- before: 同期HTTP (旧 Misskey.py 相当) を async 関数内で直接呼ぶ
+- after : MisskeyClient (aiohttp 共有セッション)
+
+ローカルにスタブのMisskeyサーバーを立てるので、実インスタンスへの接続は不要
+使い方: python benchmark_event_loop_lag.py [同時メンション数] [APIの遅延ms]
+"""
+
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+
+from aiohttp import web
+
+CONCURRENT_MENTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+API_DELAY_MS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+PROBE_INTERVAL = 0.01  # 遅延プローブの間隔 (秒)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub_server(port: int):
+    """別スレッドでスタブMisskeyサーバーを起動"""
+    async def handle(request):
+        await asyncio.sleep(API_DELAY_MS / 1000)
+        endpoint = request.match_info["endpoint"]
+        if endpoint == "i":
+            return web.json_response({"id": "bot", "username": "riina"})
+        return web.json_response({"createdNote": {"id": "note"}})
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_post("/api/{endpoint:.*}", handle)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    time.sleep(0.5)
+
+
+async def lag_probe(samples: list, stop: asyncio.Event):
+    """一定間隔で sleep し、予定より遅れた時間をイベントループ遅延として記録"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append((time.perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+
+async def measure(label: str, send_note):
+    samples = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(lag_probe(samples, stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send_note(f"reply {i}") for i in range(CONCURRENT_MENTIONS)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    print(f"[{label}]")
+    print(f"  総処理時間      : {elapsed * 1000:.0f}ms")
+    print(f"  ループ遅延 max  : {max(samples, default=0.0):.1f}ms")
+    print(f"  ループ遅延 p99  : {p99:.1f}ms")
+    print(f"  ループ遅延 mean : {statistics.fmean(samples) if samples else 0.0:.1f}ms")
+
+
+async def main(port: int):
+    from misskey_client import MisskeyClient
+
+    api_url = f"http://127.0.0.1:{port}/api"
+
+    async def blocking_send_note(text: str):
+        # 旧実装: 同期HTTPをコルーチン内で直接呼ぶ
+        req = urllib.request.Request(
+            f"{api_url}/notes/create",
+            data=json.dumps({"i": "token", "text": text}).encode(),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+
+    client = MisskeyClient()
+
+    print(f"同時メンション: {CONCURRENT_MENTIONS}件, API遅延: {API_DELAY_MS}ms")
+    await measure("before: 同期HTTP", blocking_send_note)
+    await measure("after : MisskeyClient (aiohttp)", client.send_note)
+    await client.close()
+
+
+if __name__ == "__main__":
+    port = _free_port()
+    os.environ["MISSKEY_INSTANCE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("MISSKEY_API_TOKEN", "token")
+    os.environ.setdefault("GEMINI_API_KEY", "dummy")
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    start_stub_server(port)
+    asyncio.run(main(port))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+NGワード照合ベンチマーク
+旧実装 (NGワードごとに lower() して部分一致) と KeywordMatcher (Aho-Corasick) を比較する
+
+タイムライン連動投稿の1回分 (ノート全体 + 単語ごとのチェック) を再現して計測
+使い方: python benchmark_ng_word_matcher.py [NGワードリストのファイル] [ノート数]
+        (ファイル省略時は合成したNGワード3000件を使用)
+"""
+
+import random
+import sys
+import time
+
+from keyword_matcher import KeywordMatcher
+
+NOTE_COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+HIRAGANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+KATAKANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワヲン"
+
+
+def load_ng_words() -> list:
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    rng = random.Random(0)
+    return [
+        "".join(rng.choice(KATAKANA) for _ in range(rng.randint(2, 6)))
+        for _ in range(3000)
+    ]
+
+
+def make_notes() -> list:
+    rng = random.Random(1)
+    notes = []
+    for _ in range(NOTE_COUNT):
+        words = [
+            "".join(rng.choice(HIRAGANA + KATAKANA) for _ in range(rng.randint(2, 8)))
+            for _ in range(rng.randint(5, 20))
+        ]
+        notes.append(" ".join(words))
+    return notes
+
+
+def old_contains_ng_word(ng_words, text: str) -> bool:
+    """旧実装そのまま"""
+    text_lower = text.lower()
+    for ng_word in ng_words:
+        if ng_word.lower() in text_lower:
+            return True
+    return False
+
+
+def timeline_pass(contains, notes) -> int:
+    """_extract_keywords と同じ呼び出しパターン (ノート全体 + 単語ごと)"""
+    hits = 0
+    for note in notes:
+        if contains(note):
+            hits += 1
+            continue
+        for word in note.split():
+            if contains(word):
+                hits += 1
+    return hits
+
+
+def measure(label: str, contains, notes, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hits = timeline_pass(contains, notes)
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label}: {best * 1000:.1f}ms (ヒット{hits}件)")
+    return best
+
+
+def main():
+    ng_words = set(load_ng_words())
+    notes = make_notes()
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(ng_words)
+    build_time = time.perf_counter() - start
+
+    print(f"NGワード: {len(ng_words)}件, ノート: {len(notes)}件")
+    print(f"  オートマトン構築: {build_time * 1000:.1f}ms (起動時・更新時に1回だけ)")
+    old = measure("旧実装 (ループ)", lambda text: old_contains_ng_word(ng_words, text), notes)
+    new = measure("KeywordMatcher", matcher.contains_any, notes)
+    print(f"  高速化: {old / new:.1f}倍")
+
+
+if __name__ == "__main__":
+    main()
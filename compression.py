@@ -0,0 +1,145 @@
+"""
+圧縮サービスモジュール
+バックアップ・ログローテーションのファイル圧縮をワーカープールで実行する
+- イベントループでは圧縮しない (スレッドプール、設定でプロセスプールも可)
+- チャンク単位のストリーム処理 (ファイル全体をメモリに載せない)
+- gzip / zstd (zstd は zstandard パッケージがある場合のみ、レベル・スレッド数を設定可能)
+- 1件ごとに圧縮率・スループットを返す
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from config import bot_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 10}
+
+
+def resolve_codec(codec: str, level: int = None) -> tuple:
+    """
+    設定の圧縮形式・レベルを実際に使うものに決める (圧縮サービス・投稿アーカイブ共通)
+    :param codec: "gzip" / "zstd" / "auto" (zstandard があれば zstd)
+    :param level: 圧縮レベル (省略時は gzip 6, zstd 10)
+    :return: (codec, level) (zstandard がなければ gzip)
+    """
+    if codec == "auto":
+        codec = "zstd" if zstandard else "gzip"
+    if codec == "zstd" and zstandard is None:
+        logger.warning("zstandard がインストールされていないため gzip で圧縮します")
+        codec = "gzip"
+    return codec, (level if level is not None else DEFAULT_LEVELS[codec])
+
+
+def _compress_file(src: str, dst: str, codec: str, level: int, threads: int, chunk_size: int) -> int:
+    """
+    ファイルを圧縮して dst に書く (ワーカーで実行、プロセスプールでも呼べるようモジュール関数にしている)
+    書き終えてから置き換えるので、途中で落ちても壊れた圧縮ファイルは残らない
+    :return: 圧縮後のサイズ (バイト)
+    """
+    tmp = dst + ".tmp"
+    try:
+        with open(src, "rb") as f_in, open(tmp, "wb") as f_out:
+            if codec == "zstd":
+                compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+                compressor.copy_stream(f_in, f_out, read_size=chunk_size, write_size=chunk_size)
+            else:
+                with gzip.GzipFile(fileobj=f_out, mode="wb", compresslevel=level) as gz:
+                    shutil.copyfileobj(f_in, gz, chunk_size)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(tmp, dst)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return os.path.getsize(dst)
+
+
+class CompressionService:
+    def __init__(self):
+        """圧縮サービス初期化 (設定は maintenance.compression)"""
+        self.codec, self.level = resolve_codec(
+            bot_config.get("maintenance.compression.codec", "gzip"),
+            bot_config.get("maintenance.compression.level")
+        )
+        # zstd のワーカースレッド数 (0: 単一スレッド, -1: CPUコア数)
+        self.threads = bot_config.get("maintenance.compression.threads", 0)
+        self.chunk_size = bot_config.get("maintenance.compression.chunk_size_kb", 1024) * 1024
+
+        self.executor_type = bot_config.get("maintenance.compression.executor", "thread")
+        self.max_workers = bot_config.get("maintenance.compression.max_workers", 1)
+        self._executor = None
+
+    @property
+    def extension(self) -> str:
+        """圧縮ファイルの拡張子 (.gz / .zst)"""
+        return EXTENSIONS[self.codec]
+
+    def _get_executor(self):
+        """ワーカープール (初回の圧縮時に作成)"""
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="compression"
+                )
+        return self._executor
+
+    async def compress_file(self, src: Path, dst: Path = None, remove_source: bool = False) -> dict:
+        """
+        ファイルをワーカープールで圧縮
+        :param src: 圧縮するファイル
+        :param dst: 圧縮後のファイル (省略時は src に拡張子を足したもの)
+        :param remove_source: 圧縮できたら元のファイルを削除するか
+        :return: {'path', 'codec', 'original_size', 'compressed_size', 'seconds', 'mb_per_sec'}
+        """
+        src = Path(src)
+        dst = Path(dst) if dst else src.with_name(src.name + self.extension)
+        original_size = src.stat().st_size
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        compressed_size = await loop.run_in_executor(
+            self._get_executor(), _compress_file,
+            str(src), str(dst), self.codec, self.level, self.threads, self.chunk_size
+        )
+        seconds = time.perf_counter() - started
+
+        if remove_source:
+            await asyncio.to_thread(src.unlink)
+
+        result = {
+            'path': dst,
+            'codec': self.codec,
+            'original_size': original_size,
+            'compressed_size': compressed_size,
+            'seconds': seconds,
+            'mb_per_sec': (original_size / (1024 * 1024)) / seconds if seconds > 0 else 0.0,
+        }
+        ratio = (1 - compressed_size / original_size) * 100 if original_size else 0.0
+        logger.info(
+            f"🗜️  圧縮完了 ({self.codec} レベル{self.level}): {dst.name} "
+            f"{original_size / (1024 * 1024):.2f}MB → {compressed_size / (1024 * 1024):.2f}MB "
+            f"(圧縮率{ratio:.1f}%, {seconds:.2f}秒, {result['mb_per_sec']:.1f}MB/秒)"
+        )
+        return result
+
+    async def close(self):
+        """ワーカープールを停止 (実行中の圧縮は完了を待つ)"""
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True)
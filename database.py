@@ -1,70 +1,257 @@
 """
 データベース管理モジュール
 フォロワー管理・投稿履歴・リプライレート制限
+- 書き込みはすぐ実行し、コミットは短い時間窓ごとにまとめて行う (グループコミット)
+- WALモード + 読み取り専用接続: 参照・統計・バックアップが書き込みを待たせない
+- フォロワー・相互フォロー状態はメモリ上の索引で判定し、更新はDBにも書き込む (ライトスルー)
 """
 
+import asyncio
 import aiosqlite
 import logging
-from datetime import datetime, timedelta
-from config import settings
+from datetime import datetime
+from config import settings, bot_config
+from migrations import ensure_post_search_index, run_migrations
 
 logger = logging.getLogger(__name__)
 
+
+def epoch_ms(dt: datetime = None) -> int:
+    """
+    日時をエポックミリ秒に変換 (DBのタイムスタンプ形式)
+    :param dt: 日時 (省略時は現在時刻)
+    """
+    return int((dt or datetime.now()).timestamp() * 1000)
+
+
+def from_epoch_ms(ms: int) -> datetime:
+    """エポックミリ秒をローカル時刻の datetime に変換"""
+    return datetime.fromtimestamp(ms / 1000)
+
+
 class Database:
     def __init__(self):
         self.db_path = settings.database_path
         self.db = None
+        self.read_db = None
+        
+        # フォロー関係の索引 (followers テーブルの写し)
+        self._follower_ids = set()
+        self._mutual_ids = set()
+        
+        # 投稿の全文検索インデックス (posts_fts) が使えるか (接続時に確認)
+        self.post_index_available = False
+        
+        # 接続チューニング (PRAGMA)
+        self.journal_mode = bot_config.get("database.journal_mode", "WAL")
+        self.synchronous = bot_config.get("database.synchronous", "NORMAL")
+        self.cache_size_kb = bot_config.get("database.cache_size_kb", 8192)
+        self.mmap_size_mb = bot_config.get("database.mmap_size_mb", 64)
+        self.busy_timeout_ms = bot_config.get("database.busy_timeout_ms", 5000)
+        
+        # グループコミット: window 内の書き込みを1トランザクションにまとめる
+        self.commit_window = bot_config.get("database.write_behind.window_ms", 100) / 1000
+        self.commit_batch_size = bot_config.get("database.write_behind.batch_size", 50)
+        self._pending_writes = 0
+        self._flush_task = None
+        self._write_stats = {'writes': 0, 'commits': 0, 'max_batch': 0}
     
     async def connect(self):
-        """データベース接続"""
+        """データベース接続 (書き込み用 + 読み取り専用)"""
         self.db = await aiosqlite.connect(self.db_path)
+        journal_mode = await self._apply_pragmas(self.db)
         await self._init_tables()
-        logger.info("✅ データベース接続成功")
+        await self._ensure_incremental_vacuum()
+        
+        # 読み取り専用接続: コミット済みのデータだけを見る (グループコミットの時間窓ぶん遅れることがある)
+        self.read_db = await aiosqlite.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        await self._apply_pragmas(self.read_db, read_only=True)
+        
+        await self.load_relationships()
+        logger.info(f"✅ データベース接続成功 (journal_mode={journal_mode}, synchronous={self.synchronous})")
+    
+    async def _apply_pragmas(self, conn: aiosqlite.Connection, read_only: bool = False) -> str:
+        """
+        接続ごとのPRAGMAを設定
+        :param read_only: 読み取り専用接続なら journal_mode / synchronous は設定しない
+        :return: 実際の journal_mode
+        """
+        await conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        # 負の値は KiB 単位
+        await conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        await conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size_mb) * 1024 * 1024}")
+        
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+            return ""
+        
+        async with conn.execute(f"PRAGMA journal_mode = {self.journal_mode}") as cursor:
+            result = await cursor.fetchone()
+        await conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return result[0] if result else ""
+    
+    async def _ensure_incremental_vacuum(self):
+        """
+        auto_vacuum を INCREMENTAL にする (削除で空いたページを少しずつ返せるようにする)
+        既存のDBは切り替えに VACUUM が1回だけ必要
+        """
+        async with self.db.execute("PRAGMA auto_vacuum") as cursor:
+            result = await cursor.fetchone()
+        if result and result[0] == 2:
+            return
+        
+        logger.info("🔧 auto_vacuum を INCREMENTAL に切り替え (初回のみ VACUUM)")
+        await self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await self.db.execute("VACUUM")
     
     async def close(self):
-        """データベース切断"""
+        """データベース切断 (未コミットの書き込みはコミットしてから閉じる)"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self.read_db:
+            await self.read_db.close()
         if self.db:
+            await self.flush()
             await self.db.close()
     
+    # ----- グループコミット -----
+    async def _execute_write(self, sql: str, params=(), durable: bool = False) -> int:
+        """
+        書き込みを実行 (コミットは後でまとめて行う)
+        :param durable: True なら即コミットし、ディスクに書かれてから戻る
+        :return: 影響を受けた行数
+        """
+        async with self.db.execute(sql, params) as cursor:
+            rowcount = cursor.rowcount
+        await self._written(durable)
+        return rowcount
+    
+    async def _written(self, durable: bool = False):
+        """書き込み1件を記録し、必要ならコミット・遅延コミットを予約"""
+        self._pending_writes += 1
+        self._write_stats['writes'] += 1
+        
+        if durable or self.commit_window <= 0 or self._pending_writes >= self.commit_batch_size:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        """時間窓の終わりにまとめてコミット"""
+        await asyncio.sleep(self.commit_window)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"グループコミットエラー: {e}")
+    
+    async def flush(self):
+        """未コミットの書き込みをすべてコミット"""
+        if not self._pending_writes or self.db is None:
+            return
+        
+        batch = self._pending_writes
+        self._pending_writes = 0
+        try:
+            await self.db.commit()
+        except Exception:
+            # トランザクションは開いたままなので、次回のコミットで再試行される
+            self._pending_writes += batch
+            raise
+        
+        self._write_stats['commits'] += 1
+        self._write_stats['max_batch'] = max(self._write_stats['max_batch'], batch)
+        logger.debug(f"グループコミット: {batch}件")
+    
+    def get_write_stats(self) -> dict:
+        """書き込み・コミット回数の統計"""
+        commits = self._write_stats['commits']
+        return {
+            'writes': self._write_stats['writes'],
+            'commits': commits,
+            'max_batch': self._write_stats['max_batch'],
+            'avg_batch': (self._write_stats['writes'] / commits) if commits else 0.0,
+            'pending': self._pending_writes,
+        }
+    
     async def _init_tables(self):
-        """テーブル初期化"""
-        # フォロワーテーブル
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS followers (
-                user_id TEXT PRIMARY KEY,
-                username TEXT NOT NULL,
-                followed_at TEXT NOT NULL,
-                is_following_back BOOLEAN DEFAULT 0
+        """テーブル初期化 (未適用のスキーマ移行を実行)"""
+        version = await run_migrations(self.db)
+        self.post_index_available = await ensure_post_search_index(self.db)
+        logger.info(f"✅ データベーステーブル初期化完了 (スキーマ v{version})")
+    
+    # ----- フォロワー管理 -----
+    async def load_relationships(self):
+        """
+        followers テーブルからフォロー関係の索引を読み込み直す
+        (書き込み用接続から読むので未コミットの書き込みも含まれる)
+        """
+        async with self.db.execute(
+            "SELECT user_id, is_following_back FROM followers"
+        ) as cursor:
+            rows = await cursor.fetchall()
+        
+        self._follower_ids = {row[0] for row in rows}
+        self._mutual_ids = {row[0] for row in rows if row[1]}
+        logger.debug(f"フォロー関係の索引を読み込み: フォロワー{len(self._follower_ids)}人, 相互{len(self._mutual_ids)}人")
+    
+    @property
+    def follower_ids(self) -> frozenset:
+        """フォロワーのユーザーID一覧 (索引のスナップショット)"""
+        return frozenset(self._follower_ids)
+    
+    @property
+    def mutual_ids(self) -> frozenset:
+        """相互フォローのユーザーID一覧 (索引のスナップショット)"""
+        return frozenset(self._mutual_ids)
+    
+    async def apply_follower_changes(self, added=(), removed=(), mutual_on=(), mutual_off=()):
+        """
+        フォロワーの差分を1トランザクションでまとめて反映し、即コミット
+        :param added: 追加するフォロワー [(user_id, username), ...]
+        :param removed: 削除するユーザーID
+        :param mutual_on: 相互フォローにするユーザーID
+        :param mutual_off: 相互フォローを解除するユーザーID
+        """
+        added, removed = list(added), list(removed)
+        mutual_on, mutual_off = list(mutual_on), list(mutual_off)
+        now = epoch_ms()
+        
+        # グループコミット待ちの書き込みを巻き込まないよう、失敗時はセーブポイントまでだけ戻す
+        await self.db.execute("SAVEPOINT follower_changes")
+        try:
+            await self.db.executemany(
+                "INSERT OR IGNORE INTO followers (user_id, username, followed_at) VALUES (?, ?, ?)",
+                [(user_id, username, now) for user_id, username in added]
             )
-        """)
-        
-        # 投稿履歴テーブル
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                note_id TEXT,
-                post_type TEXT,
-                content TEXT,
-                posted_at TEXT NOT NULL
+            await self.db.executemany(
+                "DELETE FROM followers WHERE user_id = ?", [(user_id,) for user_id in removed]
             )
-        """)
-        
-        # リプライレート制限テーブル
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS reply_rate_limits (
-                user_id TEXT NOT NULL,
-                replied_at TEXT NOT NULL,
-                PRIMARY KEY (user_id, replied_at)
+            await self.db.executemany(
+                "UPDATE followers SET is_following_back = ? WHERE user_id = ?",
+                [(1, user_id) for user_id in mutual_on] + [(0, user_id) for user_id in mutual_off]
             )
-        """)
+            await self.db.execute("RELEASE follower_changes")
+        except Exception:
+            await self.db.execute("ROLLBACK TO follower_changes")
+            await self.db.execute("RELEASE follower_changes")
+            raise
+        await self._written(durable=True)
         
-        await self.db.commit()
-        logger.info("✅ データベーステーブル初期化完了")
+        # コミットできたら索引にも反映
+        self._follower_ids.update(user_id for user_id, _ in added)
+        self._follower_ids.difference_update(removed)
+        self._mutual_ids.difference_update(removed)
+        self._mutual_ids.difference_update(mutual_off)
+        self._mutual_ids.update(user_id for user_id in mutual_on if user_id in self._follower_ids)
+        logger.info(
+            f"📝 フォロワー一括反映: 追加{len(added)}人, 削除{len(removed)}人, "
+            f"相互+{len(mutual_on)}/-{len(mutual_off)}人"
+        )
     
-    # ----- フォロワー管理 -----
     async def get_all_followers(self):
         """全フォロワー取得"""
-        async with self.db.execute(
+        async with self.read_db.execute(
             "SELECT user_id, username, is_following_back FROM followers"
         ) as cursor:
             rows = await cursor.fetchall()
@@ -77,117 +264,378 @@ class Database:
                 for row in rows
             ]
     
-    async def add_follower(self, user_id: str, username: str):
+    async def add_follower(self, user_id: str, username: str, durable: bool = False):
         """フォロワー追加"""
         try:
-            await self.db.execute(
+            await self._execute_write(
                 "INSERT OR IGNORE INTO followers (user_id, username, followed_at) VALUES (?, ?, ?)",
-                (user_id, username, datetime.now().isoformat())
+                (user_id, username, epoch_ms()),
+                durable=durable
             )
-            await self.db.commit()
+            self._follower_ids.add(user_id)
             logger.info(f"📝 フォロワー追加: @{username} ({user_id})")
         except Exception as e:
             logger.error(f"フォロワー追加エラー: {e}")
     
-    async def remove_follower(self, user_id: str):
+    async def remove_follower(self, user_id: str, durable: bool = False):
         """フォロワー削除"""
         try:
-            await self.db.execute("DELETE FROM followers WHERE user_id = ?", (user_id,))
-            await self.db.commit()
+            await self._execute_write(
+                "DELETE FROM followers WHERE user_id = ?", (user_id,), durable=durable
+            )
+            self._follower_ids.discard(user_id)
+            self._mutual_ids.discard(user_id)
             logger.info(f"🗑️  フォロワー削除: {user_id}")
         except Exception as e:
             logger.error(f"フォロワー削除エラー: {e}")
     
-    async def set_following_back(self, user_id: str, is_following: bool):
+    async def set_following_back(self, user_id: str, is_following: bool, durable: bool = False):
         """フォローバック状態更新"""
         try:
-            await self.db.execute(
+            await self._execute_write(
                 "UPDATE followers SET is_following_back = ? WHERE user_id = ?",
-                (int(is_following), user_id)
+                (int(is_following), user_id),
+                durable=durable
             )
-            await self.db.commit()
+            # 行があるのはフォロワーだけなので、索引も同じ条件で更新する
+            if is_following and user_id in self._follower_ids:
+                self._mutual_ids.add(user_id)
+            else:
+                self._mutual_ids.discard(user_id)
             logger.debug(f"フォローバック状態更新: {user_id} -> {is_following}")
         except Exception as e:
             logger.error(f"フォローバック状態更新エラー: {e}")
     
-    async def is_follower(self, user_id: str) -> bool:
-        """フォロワーかチェック"""
-        async with self.db.execute(
-            "SELECT 1 FROM followers WHERE user_id = ?", (user_id,)
-        ) as cursor:
-            result = await cursor.fetchone()
-            return result is not None
+    # ----- フォロワー同期のステージング -----
+    async def clear_follower_staging(self, run_id: str):
+        """
+        ステージング表から指定した同期の行を消す (途中で落ちた古い同期の行も一緒に消す)
+        :param run_id: 同期ごとのキー
+        """
+        stale_before = epoch_ms() - 24 * 60 * 60 * 1000
+        await self._execute_write(
+            "DELETE FROM follower_sync_staging WHERE run_id = ? OR staged_at < ?", (run_id, stale_before)
+        )
     
-    async def is_following_back(self, user_id: str) -> bool:
-        """既にフォローバック済みかチェック"""
-        async with self.db.execute(
-            "SELECT is_following_back FROM followers WHERE user_id = ?", (user_id,)
-        ) as cursor:
-            result = await cursor.fetchone()
-            return result is not None and bool(result[0])
+    async def stage_relations(self, run_id: str, kind: str, users: list):
+        """
+        APIのフォロワー / フォロー中1ページ分をステージング表に追加
+        :param run_id: 同期ごとのキー
+        :param kind: "followers" または "following"
+        :param users: ユーザー情報のリスト
+        """
+        now = epoch_ms()
+        await self.db.executemany(
+            "INSERT OR IGNORE INTO follower_sync_staging (run_id, kind, user_id, username, staged_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(run_id, kind, u['id'], u.get('username') or 'unknown', now) for u in users if u.get('id')]
+        )
+        await self._written()
+    
+    async def _iter_sorted_rows(self, sql: str, chunk_size: int, params=()):
+        """読み取り専用接続で user_id 順に chunk_size 行ずつ読みながら1行ずつyield"""
+        async with self.read_db.execute(sql, params) as cursor:
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row
+    
+    def iter_followers_sorted(self, chunk_size: int = 500):
+        """DBのフォロワー (user_id, username, is_following_back) を user_id 順にyield (コミット済みのみ)"""
+        return self._iter_sorted_rows(
+            "SELECT user_id, username, is_following_back FROM followers ORDER BY user_id", chunk_size
+        )
+    
+    def iter_staged_followers_sorted(self, run_id: str, chunk_size: int = 500):
+        """
+        ステージング表のフォロワー (user_id, username, 相互フォローか) を user_id 順にyield (コミット済みのみ)
+        相互フォローかどうかは、同じ同期でフォロー中としても取り込んだかで判定する
+        """
+        return self._iter_sorted_rows(
+            "SELECT f.user_id, f.username, EXISTS ("
+            "    SELECT 1 FROM follower_sync_staging g"
+            "    WHERE g.run_id = f.run_id AND g.kind = 'following' AND g.user_id = f.user_id"
+            ") FROM follower_sync_staging f "
+            "WHERE f.run_id = ? AND f.kind = 'followers' ORDER BY f.user_id",
+            chunk_size, (run_id,)
+        )
+    
+    def is_follower(self, user_id: str) -> bool:
+        """フォロワーかチェック (メモリ上の索引、DB問い合わせなし)"""
+        return user_id in self._follower_ids
+    
+    def is_following_back(self, user_id: str) -> bool:
+        """既にフォローバック済みかチェック (メモリ上の索引、DB問い合わせなし)"""
+        return user_id in self._mutual_ids
+    
+    def is_mutual(self, user_id: str) -> bool:
+        """相互フォロー (フォロワーかつフォローバック済み) かチェック"""
+        return user_id in self._mutual_ids
     
     # ----- 投稿履歴 -----
-    async def add_post(self, note_id: str, post_type: str, content: str):
+    async def add_post(self, note_id: str, post_type: str, content: str, durable: bool = False):
         """投稿履歴に追加"""
         try:
-            await self.db.execute(
+            await self._execute_write(
                 "INSERT INTO posts (note_id, post_type, content, posted_at) VALUES (?, ?, ?, ?)",
-                (note_id, post_type, content, datetime.now().isoformat())
+                (note_id, post_type, content, epoch_ms()),
+                durable=durable
             )
-            await self.db.commit()
             logger.debug(f"📝 投稿履歴追加: {post_type}")
         except Exception as e:
             logger.error(f"投稿履歴追加エラー: {e}")
     
-    # ----- リプライレート制限 -----
-    async def get_rate_limit_count(self, user_id: str, hours: int = 1) -> int:
+    async def has_replied(self, note_id: str) -> bool:
+        """指定ノートへのリプライ済みかチェック"""
+        async with self.read_db.execute(
+            "SELECT 1 FROM posts WHERE note_id = ? AND post_type = 'reply' LIMIT 1", (note_id,)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return result is not None
+    
+    async def get_last_posted_times(self, post_type: str) -> dict:
+        """
+        指定種別の投稿について、文面ごとの最終投稿時刻を取得
+        :param post_type: 投稿種別 (例: "scheduled_07:30")
+        :return: {文面: 最終投稿時刻 (エポックミリ秒)}
+        """
+        async with self.read_db.execute(
+            "SELECT content, MAX(posted_at) FROM posts WHERE post_type = ? GROUP BY content", (post_type,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return {row[0]: row[1] for row in rows}
+    
+    async def search_recent_posts(self, match_query: str, since: int, limit: int = 20) -> list:
+        """
+        自分の投稿 (リプライ以外) を全文検索インデックスで検索
+        :param match_query: FTS5 の MATCH 式
+        :param since: この時刻 (エポックミリ秒) 以降の投稿だけを対象にする
+        :param limit: 最大件数
+        :return: [(id, content), ...] (インデックスがなければ空)
         """
-        指定時間内のリプライ数を取得
-        :param user_id: ユーザーID
-        :param hours: 過去何時間分を集計するか
-        :return: リプライ数
+        if not self.post_index_available:
+            return []
+        
+        # id は投稿順なので、期間の先頭の id から後ろだけを検索させる (posted_at のインデックスで求める)
+        async with self.read_db.execute(
+            "SELECT id FROM posts WHERE posted_at >= ? ORDER BY posted_at LIMIT 1", (since,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return []
+        
+        # 一致した区切りが多い (似ている) 投稿から順に返す
+        async with self.read_db.execute(
+            "SELECT rowid, content FROM posts_fts WHERE posts_fts MATCH ? AND rowid >= ? ORDER BY rank LIMIT ?",
+            (match_query, row[0], limit)
+        ) as cursor:
+            return await cursor.fetchall()
+    
+    async def trim_post_index(self, since: int) -> int:
+        """
+        全文検索インデックスから since より前の投稿を外し、セグメントを1つにまとめる
+        (類似投稿チェックの期間外は検索しないので、インデックスを期間内の投稿だけに保つ)
+        :param since: この時刻 (エポックミリ秒) より前の投稿を外す
+        :return: 外した件数
+        """
+        if not self.post_index_available:
+            return 0
+        removed = await self._execute_write(
+            "DELETE FROM posts_fts WHERE rowid < "
+            "(SELECT id FROM posts WHERE posted_at >= ? ORDER BY posted_at LIMIT 1)",
+            (since,)
+        )
+        await self._execute_write("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')", durable=True)
+        return removed
+    
+    # ----- 投稿バッファ -----
+    async def add_buffered_post(self, post_type: str, content: str):
+        """事前生成した投稿文をバッファに追加"""
+        try:
+            await self._execute_write(
+                "INSERT INTO post_buffer (post_type, content, created_at) VALUES (?, ?, ?)",
+                (post_type, content, epoch_ms())
+            )
+        except Exception as e:
+            logger.error(f"投稿バッファ追加エラー: {e}")
+    
+    async def pop_buffered_post(self, post_type: str, min_created_at: int):
+        """
+        バッファから最も古い有効な投稿文を取り出す (取り出した行は削除)
+        :param min_created_at: これより古いもの (エポックミリ秒) は期限切れとして無視
+        :return: 投稿文 または None
         """
-        cutoff_time = (datetime.now() - timedelta(hours=hours)).isoformat()
         try:
             async with self.db.execute(
-                "SELECT COUNT(*) FROM reply_rate_limits WHERE user_id = ? AND replied_at >= ?",
-                (user_id, cutoff_time)
+                "DELETE FROM post_buffer WHERE id = ("
+                "SELECT id FROM post_buffer WHERE post_type = ? AND created_at >= ? "
+                "ORDER BY created_at LIMIT 1) RETURNING content",
+                (post_type, min_created_at)
             ) as cursor:
                 result = await cursor.fetchone()
-                count = result[0] if result else 0
-                logger.debug(f"レート制限チェック: @{user_id} = {count}回 (過去{hours}時間)")
-                return count
+            await self._written()
+            return result[0] if result else None
+        except Exception as e:
+            logger.error(f"投稿バッファ取り出しエラー: {e}")
+            return None
+    
+    async def count_buffered_posts(self, post_type: str) -> int:
+        """バッファ内の投稿文の件数"""
+        async with self.read_db.execute(
+            "SELECT COUNT(*) FROM post_buffer WHERE post_type = ?", (post_type,)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+    
+    async def delete_expired_buffered_posts(self, post_type: str, min_created_at: int) -> int:
+        """期限切れの投稿文を削除"""
+        try:
+            return await self._execute_write(
+                "DELETE FROM post_buffer WHERE post_type = ? AND created_at < ?",
+                (post_type, min_created_at)
+            )
         except Exception as e:
-            logger.error(f"レート制限取得エラー: {e}")
+            logger.error(f"投稿バッファ期限切れ削除エラー: {e}")
             return 0
     
-    async def record_reply(self, user_id: str):
+    # ----- 保持期間の管理 -----
+    async def delete_expired_rows(self, table: str, time_column: str, cutoff: int, limit: int) -> int:
+        """
+        期限切れの行を古い順に最大 limit 件削除して即コミット (短いトランザクションで少しずつ消す)
+        :param table: テーブル名 (コード内の固定値のみ)
+        :param time_column: 時刻カラム名 (インデックスがあること)
+        :param cutoff: これより古い (エポックミリ秒) 行を削除
+        :return: 削除した行数
+        """
+        return await self._execute_write(
+            f"DELETE FROM {table} WHERE rowid IN ("
+            f"SELECT rowid FROM {table} WHERE {time_column} < ? ORDER BY {time_column} LIMIT ?)",
+            (cutoff, limit),
+            durable=True
+        )
+    
+    async def fetch_expired_posts(self, cutoff: int, limit: int) -> list:
+        """
+        保持期間を過ぎた投稿履歴を id 順に最大 limit 件取得 (アーカイブ用)
+        :param cutoff: これより古い (エポックミリ秒) 行
+        :return: [(id, note_id, post_type, content, posted_at), ...]
+        """
+        async with self.db.execute(
+            "SELECT id, note_id, post_type, content, posted_at FROM posts "
+            "WHERE posted_at < ? ORDER BY id LIMIT ?",
+            (cutoff, limit)
+        ) as cursor:
+            return await cursor.fetchall()
+    
+    async def delete_posts(self, ids: list) -> int:
+        """
+        投稿履歴を id 指定でまとめて削除して即コミット
+        :return: 削除した行数
+        """
+        await self.db.executemany("DELETE FROM posts WHERE id = ?", [(post_id,) for post_id in ids])
+        await self._written(durable=True)
+        return len(ids)
+    
+    async def freelist_count(self) -> int:
+        """空きページ数"""
+        async with self.db.execute("PRAGMA freelist_count") as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+    
+    async def incremental_vacuum(self, pages: int) -> int:
+        """
+        空きページを最大 pages ページだけファイルから切り詰める
+        :return: 残りの空きページ数
+        """
+        await self.flush()
+        # 0 以下だと全ページ解放になるので、必ず1ページ以上を指定する
+        # (execute だと1ステップ = 1ページしか進まないため executescript で最後まで実行する)
+        await self.db.executescript(f"PRAGMA incremental_vacuum({max(int(pages), 1)});")
+        return await self.freelist_count()
+    
+    async def checkpoint(self):
+        """WALの内容を本体ファイルに書き戻す (PASSIVE: 読み書きを待たせない範囲で)"""
+        async with self.db.execute("PRAGMA wal_checkpoint(PASSIVE)") as cursor:
+            await cursor.fetchall()
+    
+    # ----- 統計 -----
+    async def get_stats_counters(self) -> dict:
         """
-        リプライ記録を追加
-        :param user_id: ユーザーID
+        トリガーで更新している集計表を読む (行数によらず一定時間)
+        :return: {name: {'count': 件数, 'first_at': 最古(エポックミリ秒), 'last_at': 最新}}
         """
+        async with self.read_db.execute(
+            "SELECT name, row_count, first_at, last_at FROM stats_counters"
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return {
+            row[0]: {'count': row[1], 'first_at': row[2], 'last_at': row[3]}
+            for row in rows
+        }
+    
+    # ----- bot状態 -----
+    async def get_state(self, key: str, default: str = None):
+        """bot状態の値を取得"""
+        async with self.read_db.execute(
+            "SELECT value FROM bot_state WHERE key = ?", (key,)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else default
+    
+    async def set_state(self, key: str, value: str, durable: bool = False):
+        """bot状態の値を保存"""
         try:
-            await self.db.execute(
-                "INSERT INTO reply_rate_limits (user_id, replied_at) VALUES (?, ?)",
-                (user_id, datetime.now().isoformat())
+            await self._execute_write(
+                "INSERT INTO bot_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+                durable=durable
             )
-            await self.db.commit()
-            logger.debug(f"📝 リプライ記録: @{user_id}")
+            logger.debug(f"bot状態更新: {key} = {value}")
         except Exception as e:
-            logger.error(f"リプライ記録エラー: {e}")
+            logger.error(f"bot状態更新エラー ({key}): {e}")
     
-    async def cleanup_old_rate_limits(self, days: int = 7):
+    # ----- リプライレート制限 -----
+    async def load_rate_limits(self, since: int) -> list:
         """
-        古いレート制限レコードを削除
-        :param days: 何日以前のレコードを削除するか
+        レート制限のスナップショットを読み込み
+        :param since: これ以降 (エポックミリ秒) の記録だけを返す
+        :return: [(user_id, replied_at), ...] (時刻順)
         """
-        cutoff_time = (datetime.now() - timedelta(days=days)).isoformat()
         try:
-            await self.db.execute(
-                "DELETE FROM reply_rate_limits WHERE replied_at < ?",
-                (cutoff_time,)
-            )
-            await self.db.commit()
-            logger.info(f"🗑️  古いレート制限レコード削除 (>{days}日前)")
+            async with self.read_db.execute(
+                "SELECT user_id, replied_at FROM reply_rate_limits WHERE replied_at >= ? ORDER BY replied_at",
+                (since,)
+            ) as cursor:
+                return await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"レート制限読み込みエラー: {e}")
+            return []
+    
+    async def save_rate_limits(self, rows: list) -> bool:
+        """
+        レート制限のスナップショットを保存 (テーブルを丸ごと置き換えて即コミット)
+        :param rows: [(user_id, replied_at), ...]
+        :return: 成功したら True
+        """
+        try:
+            # グループコミット待ちの書き込みを巻き込まないよう、失敗時はセーブポイントまでだけ戻す
+            # (DELETE だけがコミットされてテーブルが空になるのを防ぐ)
+            await self.db.execute("SAVEPOINT save_rate_limits")
+            try:
+                await self.db.execute("DELETE FROM reply_rate_limits")
+                await self.db.executemany(
+                    "INSERT OR IGNORE INTO reply_rate_limits (user_id, replied_at) VALUES (?, ?)", rows
+                )
+                await self.db.execute("RELEASE save_rate_limits")
+            except Exception:
+                await self.db.execute("ROLLBACK TO save_rate_limits")
+                await self.db.execute("RELEASE save_rate_limits")
+                raise
+            await self._written(durable=True)
+            return True
         except Exception as e:
-            logger.error(f"レート制限クリーンアップエラー: {e}")
+            logger.error(f"レート制限保存エラー: {e}")
+            return False
@@ -1,68 +1,151 @@
 """
 データベースメンテナンスモジュール
-古いレコードの削除・バックアップ機能
+古いレコードの削除 (投稿履歴は月別アーカイブへ移動)・バックアップ機能
 """
 
+import asyncio
 import logging
-import shutil
-import gzip
+import os
+import sqlite3
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from database import Database
-from config import settings
+from database import Database, epoch_ms, from_epoch_ms
+from post_archive import PostArchive
+from compression import CompressionService
+from config import settings, bot_config
 
 logger = logging.getLogger(__name__)
 
 class DatabaseMaintenance:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, compression: CompressionService = None):
         """
         :param db: データベースインスタンス
+        :param compression: 圧縮サービス (省略時は専用に作成)
         """
         self.db = db
+        self.compression = compression or CompressionService()
         self.backup_dir = Path("backups")
         self.backup_dir.mkdir(exist_ok=True)
+        
+        # 古いレコード削除: 1回あたりの削除件数・チャンク間の待ち・制限時間
+        self.cleanup_batch_size = bot_config.get("maintenance.cleanup_batch_size", 500)
+        self.cleanup_pause = bot_config.get("maintenance.cleanup_pause_ms", 10) / 1000
+        self.cleanup_time_budget = bot_config.get("maintenance.cleanup_time_budget_seconds", 120)
+        self.vacuum_pages_per_step = bot_config.get("maintenance.vacuum_pages_per_step", 256)
+        
+        # 投稿履歴のアーカイブ (無効時は削除のみ)
+        self.archive_enabled = bot_config.get("maintenance.archive.enabled", True)
+        self.archive = PostArchive(
+            bot_config.get("maintenance.archive.dir", "data/archive"),
+            codec=bot_config.get("maintenance.archive.codec", "auto"),
+            level=bot_config.get("maintenance.archive.level"),
+        )
     
     async def cleanup_old_records(self, days: int = 30):
         """
         古いレコードを削除
+        - 小さなチャンクごとに削除・コミットし、チャンクの間でイベントループに制御を返す
+        - 空いたページは incremental_vacuum で少しずつ返す (全体を書き直す VACUUM はしない)
+        - 制限時間を超えたら残りは次回に回す
         :param days: 何日以前のレコードを削除するか (デフォルト30日)
         """
         logger.info(f"🗑️  古いレコード削除開始 (>{days}日前)")
         
         try:
-            cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
-            
-            # 投稿履歴の削除
-            async with self.db.db.execute(
-                "DELETE FROM posts WHERE posted_at < ?",
-                (cutoff_date,)
-            ) as cursor:
-                await self.db.db.commit()
-                deleted_posts = cursor.rowcount if hasattr(cursor, 'rowcount') else 0
+            cutoff_date = epoch_ms(datetime.now() - timedelta(days=days))
+            deadline = time.monotonic() + self.cleanup_time_budget
+            started = time.monotonic()
+            
+            # 投稿履歴: アーカイブに移してから削除
+            if self.archive_enabled:
+                deleted_posts = await self._archive_in_batches(cutoff_date, deadline)
+                logger.info(f"  - 投稿履歴アーカイブ: {deleted_posts}件 ({self.archive.archive_dir})")
+            else:
+                deleted_posts = await self._delete_in_batches("posts", "posted_at", cutoff_date, deadline)
                 logger.info(f"  - 投稿履歴削除: {deleted_posts}件")
             
             # レート制限レコードの削除
-            async with self.db.db.execute(
-                "DELETE FROM reply_rate_limits WHERE replied_at < ?",
-                (cutoff_date,)
-            ) as cursor:
-                await self.db.db.commit()
-                deleted_rate_limits = cursor.rowcount if hasattr(cursor, 'rowcount') else 0
-                logger.info(f"  - レート制限レコード削除: {deleted_rate_limits}件")
+            deleted_rate_limits = await self._delete_in_batches(
+                "reply_rate_limits", "replied_at", cutoff_date, deadline
+            )
+            logger.info(f"  - レート制限レコード削除: {deleted_rate_limits}件")
             
-            # VACUUM実行 (データベースファイルを最適化)
-            await self.db.db.execute("VACUUM")
-            logger.info("  - データベース最適化完了 (VACUUM)")
+            # 空きページを少しずつファイルから返す
+            freed_pages, remaining_pages = await self._incremental_vacuum(deadline)
+            logger.info(f"  - 空きページ解放: {freed_pages}ページ (残り{remaining_pages}ページ)")
             
-            logger.info(f"✅ 古いレコード削除完了: 投稿{deleted_posts}件, レート制限{deleted_rate_limits}件")
+            elapsed = time.monotonic() - started
+            deleted = deleted_posts + deleted_rate_limits
+            rate = deleted / elapsed if elapsed > 0 else 0.0
+            if time.monotonic() >= deadline:
+                logger.warning(f"⏱️  制限時間 ({self.cleanup_time_budget}秒) に達したため残りは次回に削除します")
+            logger.info(
+                f"✅ 古いレコード削除完了: 投稿{deleted_posts}件, レート制限{deleted_rate_limits}件 "
+                f"({elapsed:.1f}秒, {rate:.0f}行/秒)"
+            )
             
         except Exception as e:
             logger.error(f"古いレコード削除エラー: {e}")
     
+    async def _delete_in_batches(self, table: str, time_column: str, cutoff: int, deadline: float) -> int:
+        """
+        期限切れの行をチャンクごとに削除
+        :return: 削除した行数
+        """
+        deleted = 0
+        while time.monotonic() < deadline:
+            count = await self.db.delete_expired_rows(table, time_column, cutoff, self.cleanup_batch_size)
+            deleted += count
+            if count < self.cleanup_batch_size:
+                break
+            # 他の処理 (メンション応答など) に書き込みを譲る
+            await asyncio.sleep(self.cleanup_pause)
+        return deleted
+    
+    async def _archive_in_batches(self, cutoff: int, deadline: float) -> int:
+        """
+        期限切れの投稿履歴をチャンクごとにアーカイブへ追記してから削除
+        :return: 移動した行数
+        """
+        moved = 0
+        while time.monotonic() < deadline:
+            rows = await self.db.fetch_expired_posts(cutoff, self.cleanup_batch_size)
+            if not rows:
+                break
+            # 圧縮・ファイル書き込みはワーカースレッドで
+            await asyncio.to_thread(self.archive.append, rows)
+            moved += await self.db.delete_posts([row[0] for row in rows])
+            if len(rows) < self.cleanup_batch_size:
+                break
+            await asyncio.sleep(self.cleanup_pause)
+        return moved
+    
+    async def _incremental_vacuum(self, deadline: float):
+        """
+        空きページを vacuum_pages_per_step ページずつ解放
+        :return: (解放したページ数, 残りの空きページ数)
+        """
+        initial = remaining = await self.db.freelist_count()
+        while remaining > 0 and time.monotonic() < deadline:
+            before = remaining
+            remaining = await self.db.incremental_vacuum(self.vacuum_pages_per_step)
+            if remaining >= before:
+                # auto_vacuum が無効なDBなど、これ以上減らない
+                break
+            await asyncio.sleep(self.cleanup_pause)
+        
+        if initial > remaining:
+            # 切り詰めたページが本体ファイルのサイズに反映されるのはチェックポイント後
+            await self.db.checkpoint()
+        return initial - remaining, remaining
+    
     async def backup_database(self, compress: bool = True):
         """
         データベースをバックアップ
-        :param compress: gzip圧縮するか (デフォルトTrue)
+        SQLite のオンラインバックアップAPIでスナップショットを取り、整合性チェック後に圧縮する
+        (スナップショットはワーカースレッド、圧縮は圧縮サービスのワーカーで実行するので、イベントループは止まらない)
+        :param compress: 圧縮するか (デフォルトTrue、形式は maintenance.compression)
         :return: バックアップファイルパス
         """
         logger.info("💾 データベースバックアップ開始")
@@ -73,45 +156,64 @@ class DatabaseMaintenance:
             backup_filename = f"bot_backup_{timestamp}.db"
             backup_path = self.backup_dir / backup_filename
             
-            # データベースファイルをコピー
             db_path = Path(settings.database_path)
             if not db_path.exists():
                 logger.error(f"データベースファイルが見つかりません: {db_path}")
                 return None
             
-            shutil.copy2(db_path, backup_path)
-            logger.info(f"  - バックアップ作成: {backup_path}")
+            # グループコミット待ちの書き込みもバックアップに含める
+            await self.db.flush()
+            
+            started = time.perf_counter()
+            snapshot_path = await asyncio.to_thread(self._snapshot_sync, db_path, backup_path)
+            if snapshot_path is None:
+                return None
             
-            # gzip圧縮
             if compress:
-                compressed_path = backup_path.with_suffix('.db.gz')
-                with open(backup_path, 'rb') as f_in:
-                    with gzip.open(compressed_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                
-                # 元のファイルを削除
-                backup_path.unlink()
-                
-                # ファイルサイズ取得
-                original_size = db_path.stat().st_size / 1024  # KB
-                compressed_size = compressed_path.stat().st_size / 1024  # KB
-                compression_ratio = (1 - compressed_size / original_size) * 100
-                
-                logger.info(f"  - 圧縮完了: {compressed_path}")
-                logger.info(f"  - 圧縮率: {compression_ratio:.1f}% ({original_size:.1f}KB → {compressed_size:.1f}KB)")
-                
-                backup_path = compressed_path
+                # スナップショットを圧縮して置き換える
+                result = await self.compression.compress_file(snapshot_path, remove_source=True)
+                backup_path = result['path']
             else:
-                size = backup_path.stat().st_size / 1024  # KB
-                logger.info(f"  - サイズ: {size:.1f}KB")
+                backup_path = snapshot_path
+                logger.info(f"  - サイズ: {backup_path.stat().st_size / 1024:.1f}KB")
             
-            logger.info(f"✅ データベースバックアップ完了: {backup_path}")
+            elapsed = time.perf_counter() - started
+            logger.info(f"✅ データベースバックアップ完了: {backup_path} ({elapsed:.2f}秒)")
             return str(backup_path)
             
         except Exception as e:
             logger.error(f"データベースバックアップエラー: {e}")
             return None
     
+    def _snapshot_sync(self, db_path: Path, backup_path: Path):
+        """
+        スナップショット作成 + 整合性チェック (ワーカースレッドで実行)
+        :return: バックアップファイルパス、整合性チェック失敗時は None
+        """
+        tmp_path = backup_path.with_name(backup_path.name + ".tmp")
+        
+        # 読み取り専用接続からオンラインバックアップ
+        # WALモードなので読み取りは書き込みを止めない (1ステップで一貫したスナップショットを取る)
+        src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            src.backup(dst)
+            # バックアップ単体で開けるよう -wal を使わないジャーナルに戻す
+            dst.execute("PRAGMA journal_mode = DELETE")
+            check = dst.execute("PRAGMA integrity_check").fetchone()
+        finally:
+            dst.close()
+            src.close()
+        
+        if not check or check[0] != "ok":
+            logger.error(f"バックアップの整合性チェック失敗: {check[0] if check else '結果なし'}")
+            tmp_path.unlink(missing_ok=True)
+            return None
+        
+        os.replace(tmp_path, backup_path)
+        logger.info(f"  - バックアップ作成・整合性チェックOK: {backup_path}")
+        return backup_path
+    
     async def cleanup_old_backups(self, keep_count: int = 7):
         """
         古いバックアップファイルを削除
@@ -144,26 +246,24 @@ class DatabaseMaintenance:
     
     async def get_database_stats(self) -> dict:
         """
-        データベース統計情報を取得
+        データベース統計情報を取得 (読み取り専用接続を使うので書き込みを待たせない)
         :return: 統計情報の辞書
         """
         try:
             stats = {}
             
-            # フォロワー数
-            async with self.db.db.execute("SELECT COUNT(*) FROM followers") as cursor:
-                result = await cursor.fetchone()
-                stats['followers_count'] = result[0] if result else 0
-            
-            # 投稿数
-            async with self.db.db.execute("SELECT COUNT(*) FROM posts") as cursor:
-                result = await cursor.fetchone()
-                stats['posts_count'] = result[0] if result else 0
-            
-            # レート制限レコード数
-            async with self.db.db.execute("SELECT COUNT(*) FROM reply_rate_limits") as cursor:
-                result = await cursor.fetchone()
-                stats['rate_limit_records'] = result[0] if result else 0
+            # 件数・最古・最新はトリガーで更新している集計表から読む (テーブルを走査しない)
+            counters = await self.db.get_stats_counters()
+            empty = {'count': 0, 'first_at': None, 'last_at': None}
+            posts = counters.get('posts', empty)
+            stats['followers_count'] = counters.get('followers', empty)['count']
+            stats['posts_count'] = posts['count']
+            stats['rate_limit_records'] = counters.get('reply_rate_limits', empty)['count']
+            stats['posts_by_type'] = {
+                name.split(':', 1)[1] or '(なし)': counter['count']
+                for name, counter in sorted(counters.items())
+                if name.startswith('posts:') and counter['count'] > 0
+            }
             
             # データベースファイルサイズ
             db_path = Path(settings.database_path)
@@ -173,16 +273,12 @@ class DatabaseMaintenance:
                 stats['db_size_kb'] = 0
             
             # 最古・最新の投稿日時
-            async with self.db.db.execute(
-                "SELECT MIN(posted_at), MAX(posted_at) FROM posts"
-            ) as cursor:
-                result = await cursor.fetchone()
-                if result and result[0]:
-                    stats['oldest_post'] = result[0]
-                    stats['newest_post'] = result[1]
-                else:
-                    stats['oldest_post'] = None
-                    stats['newest_post'] = None
+            if posts['first_at'] is not None:
+                stats['oldest_post'] = from_epoch_ms(posts['first_at']).isoformat()
+                stats['newest_post'] = from_epoch_ms(posts['last_at']).isoformat()
+            else:
+                stats['oldest_post'] = None
+                stats['newest_post'] = None
             
             return stats
             
@@ -201,9 +297,18 @@ class DatabaseMaintenance:
         logger.info("📊 データベース統計情報:")
         logger.info(f"  - フォロワー数: {stats.get('followers_count', 0)}人")
         logger.info(f"  - 投稿履歴: {stats.get('posts_count', 0)}件")
+        if stats.get('posts_by_type'):
+            breakdown = ", ".join(f"{post_type}: {count}" for post_type, count in stats['posts_by_type'].items())
+            logger.info(f"    ({breakdown})")
         logger.info(f"  - レート制限レコード: {stats.get('rate_limit_records', 0)}件")
         logger.info(f"  - データベースサイズ: {stats.get('db_size_kb', 0):.2f}KB")
         
+        write_stats = self.db.get_write_stats()
+        logger.info(
+            f"  - 書き込み: {write_stats['writes']}件 / コミット: {write_stats['commits']}回 "
+            f"(平均{write_stats['avg_batch']:.1f}件, 最大{write_stats['max_batch']}件/コミット)"
+        )
+        
         if stats.get('oldest_post'):
             logger.info(f"  - 最古の投稿: {stats['oldest_post'][:19]}")
             logger.info(f"  - 最新の投稿: {stats['newest_post'][:19]}")
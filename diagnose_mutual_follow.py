@@ -69,6 +69,7 @@ async def diagnose():
     else:
         print("  ✅ 問題なし")
     
+    await misskey.close()
     await db.close()
 
 if __name__ == "__main__":
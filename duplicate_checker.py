@@ -0,0 +1,134 @@
+"""
+類似投稿チェックモジュール
+直近の自分の投稿と文字 trigram の重なりを比べ、ほぼ同じ文面の投稿を防ぐ
+- 候補は全文検索インデックス (posts_fts) から、文面を区切った部分文字列のどれかを含む投稿だけを引く
+  (数文字の編集ならどれかの区切りはそのまま残る。一致した区切りが多い投稿から候補にする)
+- インデックスは比較する期間内の投稿だけに保つ (投稿履歴の件数によらず検索コストが一定)
+- 候補ごとに trigram 集合の Jaccard 係数を計算し、しきい値以上なら重複とみなす
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+from database import Database, epoch_ms
+from config import bot_config
+
+logger = logging.getLogger(__name__)
+
+
+def trigrams(text: str) -> set:
+    """文字 trigram の集合 (空白は詰める)"""
+    text = "".join(text.split())
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a: set, b: set) -> float:
+    """trigram 集合の Jaccard 係数 (0.0〜1.0)"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class DuplicateChecker:
+    def __init__(self, db: Database):
+        """
+        :param db: データベース (投稿の全文検索インデックス)
+        """
+        self.db = db
+        self.enabled = bot_config.get("posting.duplicate_check.enabled", True)
+        self.days = bot_config.get("posting.duplicate_check.days", 7)
+        self.threshold = bot_config.get("posting.duplicate_check.threshold", 0.6)
+        self.max_retries = bot_config.get("posting.duplicate_check.max_retries", 2)
+        self.segment_length = bot_config.get("posting.duplicate_check.segment_length", 10)
+        self.max_edits = bot_config.get("posting.duplicate_check.max_edits", 2)
+        self.candidate_limit = bot_config.get("posting.duplicate_check.candidate_limit", 20)
+
+        self._stats = {'checked': 0, 'duplicates': 0, 'total_ms': 0.0}
+
+    def _match_query(self, text: str) -> str:
+        """
+        文面を区切り、どれか1つを含む投稿を探す MATCH 式
+        空白区切りの語ごとに「segment_length 文字ずつの個数 + max_edits」個へ等分するので、
+        1語あたり max_edits 文字までの編集なら、編集されていない区切りが必ず1つは残る
+        """
+        segments = []
+        # 空白をまたぐと保存済みの本文と一致しないので、空白区切りの塊ごとに区切る
+        for word in text.split():
+            if len(word) < 3:
+                continue  # trigram 未満の文字列はどの行にも一致しない
+            # 1区切りは3文字以上 (trigram 未満の区切りは検索に使えない)
+            pieces = min(len(word) // 3, -(-len(word) // self.segment_length) + self.max_edits)
+            size = len(word) / pieces
+            segments.extend(word[round(i * size):round((i + 1) * size)] for i in range(pieces))
+        phrases = dict.fromkeys('"' + segment.replace('"', '""') + '"' for segment in segments)
+        return " OR ".join(phrases)
+
+    async def find_similar(self, content: str):
+        """
+        直近 days 日の自分の投稿から最も似ている投稿を探す
+        :param content: 投稿予定の文面
+        :return: (類似度, 投稿文) または None (しきい値未満・チェック無効)
+        """
+        if not self.enabled or not content or not self.db.post_index_available:
+            return None
+
+        grams = trigrams(content)
+        match_query = self._match_query(content)
+        if not grams or not match_query:
+            return None
+
+        started = time.perf_counter()
+        since = epoch_ms(datetime.now() - timedelta(days=self.days))
+        try:
+            candidates = await self.db.search_recent_posts(match_query, since, self.candidate_limit)
+        except Exception as e:
+            logger.error(f"類似投稿チェックエラー: {e}")
+            return None
+
+        best = None
+        for _, text in candidates:
+            score = similarity(grams, trigrams(text or ""))
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, text)
+
+        self._stats['checked'] += 1
+        self._stats['total_ms'] += (time.perf_counter() - started) * 1000
+        if best:
+            self._stats['duplicates'] += 1
+        return best
+
+    async def is_duplicate(self, content: str, post_type: str) -> bool:
+        """
+        直近の投稿とほぼ同じ文面か
+        :param content: 投稿予定の文面
+        :param post_type: ログ用の投稿種別
+        :return: 重複していたら True
+        """
+        match = await self.find_similar(content)
+        if match is None:
+            return False
+
+        score, text = match
+        logger.info(f"🔁 類似投稿を検出 ({post_type}, 類似度{score:.2f}): {content[:30]}... ≒ {text[:30]}...")
+        return True
+
+    async def trim_index(self):
+        """比較する期間より前の投稿を全文検索インデックスから外す (毎日のDB掃除で呼ぶ)"""
+        since = epoch_ms(datetime.now() - timedelta(days=self.days))
+        try:
+            removed = await self.db.trim_post_index(since)
+            if removed:
+                logger.info(f"🗑️  類似投稿チェックの対象外を索引から削除: {removed}件 (>{self.days}日前)")
+        except Exception as e:
+            logger.error(f"投稿の検索インデックス整理エラー: {e}")
+
+    def log_stats(self):
+        """チェック件数・重複件数・平均所要時間をログ出力"""
+        checked = self._stats['checked']
+        if not checked:
+            return
+        logger.info(
+            f"📊 類似投稿チェック: {checked}件中 {self._stats['duplicates']}件が重複 "
+            f"(平均{self._stats['total_ms'] / checked:.2f}ms)"
+        )
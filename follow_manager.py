@@ -3,9 +3,13 @@
 自動フォローバック・リムーブバック機能
 """
 
+import asyncio
 import logging
+import time
+import uuid
 from misskey_client import MisskeyClient
 from database import Database
+from follower_diff import diff_followers
 from config import bot_config
 
 logger = logging.getLogger(__name__)
@@ -20,6 +24,17 @@ class FollowManager:
         self.db = db
         self.auto_follow_back = bot_config.get("follow.auto_follow_back", False)
         self.auto_unfollow_back = bot_config.get("follow.auto_unfollow_back", True)
+        self.sync_chunk_size = bot_config.get("follow.sync_chunk_size", 500)
+        
+        # ストリームイベント後の整合性チェック (バースト時は1回にまとめる)
+        self.reconcile_debounce = bot_config.get("follow.reconcile_debounce_seconds", 60)
+        self.reconcile_max_wait = bot_config.get("follow.reconcile_max_wait_seconds", 300)
+        self._reconcile_task = None
+        self._first_event_at = 0.0
+        self._last_event_at = 0.0
+        # 最後に同期を始めてからイベントがあったか (同期中に届いたイベントはもう1回同期して拾う)
+        self._reconcile_dirty = False
+        self._sync_lock = asyncio.Lock()
     
     async def check_and_sync_followers(self):
         """
@@ -27,59 +42,189 @@ class FollowManager:
         - 新しいフォロワー → データベースに追加
         - フォロー解除されたユーザー → 自動リムーブバック
         """
+        if self._sync_lock.locked():
+            logger.debug("フォロー同期は実行中: スキップ")
+            return
+        
+        async with self._sync_lock:
+            await self._sync_followers()
+    
+    async def _sync_followers(self):
+        """フォロワー全件とDBの差分同期 (整合性スイープ)"""
         logger.info("フォロー状態の同期を開始")
         try:
-            current_followers = await self.misskey.get_followers()
-            current_follower_ids = {f['id'] for f in current_followers}
-            
-            db_followers = await self.db.get_all_followers()
-            db_follower_ids = {f['user_id'] for f in db_followers}
-            
-            new_follower_ids = current_follower_ids - db_follower_ids
-            unfollowed_ids = db_follower_ids - current_follower_ids
-            
-            for follower in current_followers:
-                if follower['id'] in new_follower_ids:
-                    await self.handle_new_follower(follower)
-            
-            for user_id in unfollowed_ids:
-                await self.handle_unfollower(user_id)
-            
-            logger.info(f"フォロー同期完了: 新規{len(new_follower_ids)}人, 解除{len(unfollowed_ids)}人")
+            # 全ページ取得 (途中で失敗した場合は例外で同期自体を中止する)
+            # フォロー中一覧も読み、ストリームの follow / unfollow を取りこぼした相互フォロー状態も直す
+            await self.reconcile(
+                self.misskey.iter_relation_pages("followers"),
+                self.misskey.iter_relation_pages("following")
+            )
         except Exception as e:
             logger.error(f"フォロー同期エラー: {e}")
     
-    async def handle_new_follower(self, follower):
+    async def reconcile(self, follower_pages, following_pages=None, unfollow_back: bool = None) -> dict:
         """
-        新しいフォロワーへの対応
-        - データベースに追加
-        - 自動フォローバックは無効化 (キーワード検出時のみフォローバック)
+        APIのフォロワー一覧にDBを合わせる
+        - APIの一覧はページごとにステージング表へ入れ、DBとは user_id 順のマージジョインで比較
+        - 差分はチャンクごとに1トランザクションで反映 (フォロワー数によらず一定のメモリ)
+        - 新しいフォロワー → 追加 (自動フォローバックは無効化、キーワード検出時のみ)
+        - フォロー解除されたユーザー → 削除 (相互だった場合は自動リムーブバック)
+        :param follower_pages: APIのフォロワー一覧 (iter_relation_pages と同じく (ユーザーのリスト, カーソル) をyield)
+        :param following_pages: APIのフォロー中一覧 (指定時は相互フォロー状態も合わせる)
+        :param unfollow_back: 自動リムーブバックするか (省略時は設定値)
+        :return: 反映した件数 {'added': n, 'removed': n, 'mutual_on': n, 'mutual_off': n}
         """
-        user_id = follower['id']
-        username = follower['username']
-        logger.info(f"新しいフォロワー: @{username} ({user_id})")
-        await self.db.add_follower(user_id, username)
+        if unfollow_back is None:
+            unfollow_back = self.auto_unfollow_back
         
-        # 自動フォローバックは無効化済み
-        if self.auto_follow_back:
+        # 同期ごとのキー (sync_followers.py と同時に動いても互いのステージング行に触れない)
+        run_id = uuid.uuid4().hex
+        try:
+            # 1. APIの一覧をステージング (フォロワーとフォロー中は並行して取り込む、取得が途中で失敗したら何も反映しない)
+            tasks = [asyncio.create_task(self._stage_pages(run_id, "followers", follower_pages))]
+            if following_pages is not None:
+                tasks.append(asyncio.create_task(self._stage_pages(run_id, "following", following_pages)))
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            # 差分は読み取り専用接続で読むので、ここまでの書き込みをコミットしておく
+            await self.db.flush()
+            
+            # 2. マージジョインで差分を求め、チャンクごとに反映
+            totals = {'added': 0, 'removed': 0, 'mutual_on': 0, 'mutual_off': 0}
+            deltas = diff_followers(
+                self.db.iter_followers_sorted(self.sync_chunk_size),
+                self.db.iter_staged_followers_sorted(run_id, self.sync_chunk_size),
+                compare_mutual=following_pages is not None,
+                chunk_size=self.sync_chunk_size
+            )
+            async for delta in deltas:
+                if unfollow_back:
+                    for user_id in delta['removed_mutual']:
+                        await self._unfollow_back(user_id)
+                
+                await self.db.apply_follower_changes(
+                    delta['added'], delta['removed'], delta['mutual_on'], delta['mutual_off']
+                )
+                for key in totals:
+                    totals[key] += len(delta[key])
+        finally:
+            await self.db.clear_follower_staging(run_id)
+            await self.db.flush()
+        
+        # 外部 (sync_followers.py 等) でDBが更新されていても追従できるよう索引を読み直す
+        await self.db.load_relationships()
+        
+        if totals['added'] and self.auto_follow_back:
             logger.warning("自動フォローバックは無効化されています (キーワード検出時のみ)")
+        logger.info(f"フォロー同期完了: 新規{totals['added']}人, 解除{totals['removed']}人")
+        return totals
     
-    async def handle_unfollower(self, user_id: str):
+    async def _stage_pages(self, run_id: str, kind: str, pages):
+        """
+        APIの一覧をページごとにステージング表へ入れる
+        :param kind: "followers" または "following"
+        :param pages: (ユーザーのリスト, カーソル) をyieldする非同期イテレータ
         """
-        フォロー解除されたユーザーへの対応
-        - 自動リムーブバック (設定で有効な場合)
-        - データベースから削除
+        async for users, _ in pages:
+            await self.db.stage_relations(run_id, kind, users)
+    
+    async def _unfollow_back(self, user_id: str):
+        """フォロー解除されたユーザーを自動リムーブバック"""
+        try:
+            await self.misskey.unfollow_user(user_id)
+            logger.info(f"✅ 自動リムーブバック: {user_id}")
+        except Exception as e:
+            logger.error(f"リムーブバック失敗: {user_id} - {e}")
+    
+    # ----- ストリームイベントによる差分更新 -----
+    async def on_followed(self, user: dict):
         """
-        logger.info(f"フォロー解除検出: {user_id}")
+        フォローされた (mainストリーム followed)
+        - フォロワー一覧を取り直さず、該当ユーザーだけDBに追加
+        """
+        user_id = user.get('id')
+        if not user_id:
+            return
+        
+        await self.db.add_follower(user_id, user.get('username') or 'unknown')
+        if user.get('isFollowing'):
+            await self.db.set_following_back(user_id, True)
+        self.schedule_reconcile()
+    
+    async def on_follow(self, user: dict):
+        """
+        bot がフォローした (mainストリーム follow)
+        - フォロワーであれば相互フォロー状態に更新
+        """
+        user_id = user.get('id')
+        if not user_id:
+            return
+        
+        await self.db.set_following_back(user_id, True)
+        logger.debug(f"相互フォロー状態更新 (ストリーム): @{user.get('username', 'unknown')}")
+    
+    async def on_unfollow(self, user: dict):
+        """
+        bot がフォロー解除した (mainストリーム unfollow)
+        - 相互フォロー状態を解除
+        """
+        user_id = user.get('id')
+        if not user_id:
+            return
+        
+        await self.db.set_following_back(user_id, False)
+        logger.debug(f"相互フォロー状態解除 (ストリーム): @{user.get('username', 'unknown')}")
+    
+    def schedule_reconcile(self):
+        """
+        整合性チェックを予約
+        - 最後のイベントから reconcile_debounce 秒静かになったら1回だけ実行
+        - イベントが続いても reconcile_max_wait 秒で必ず実行
+        - 同期中に届いたイベントは、同期が終わったあとにもう1回実行して拾う
+        """
+        now = time.monotonic()
+        if not self._reconcile_dirty:
+            self._first_event_at = now
+        self._reconcile_dirty = True
+        self._last_event_at = now
         
-        if self.auto_unfollow_back:
-            # フォローバック済みかチェック
-            is_following = await self.db.is_following_back(user_id)
-            if is_following:
-                try:
-                    await self.misskey.unfollow_user(user_id)
-                    logger.info(f"✅ 自動リムーブバック: {user_id}")
-                except Exception as e:
-                    logger.error(f"リムーブバック失敗: {user_id} - {e}")
+        if self._reconcile_task and not self._reconcile_task.done():
+            return
         
-        await self.db.remove_follower(user_id)
+        self._reconcile_task = asyncio.create_task(self._debounced_reconcile())
+    
+    async def _debounced_reconcile(self):
+        """デバウンス後に整合性チェックを実行 (同期中にイベントが届いていれば、終わったあとにもう1回)"""
+        try:
+            while self._reconcile_dirty:
+                while True:
+                    now = time.monotonic()
+                    quiet_until = self._last_event_at + self.reconcile_debounce
+                    deadline = self._first_event_at + self.reconcile_max_wait
+                    wake_at = min(quiet_until, deadline)
+                    if now >= wake_at:
+                        break
+                    await asyncio.sleep(wake_at - now)
+                
+                # 定期スイープが実行中でもスキップせず、終わるのを待ってから同期する
+                # (実行中のスイープはこのイベントより前に一覧を読み始めているかもしれない)
+                async with self._sync_lock:
+                    logger.info("フォローイベント後の整合性チェックを実行")
+                    self._reconcile_dirty = False
+                    await self._sync_followers()
+        except asyncio.CancelledError:
+            pass
+    
+    async def close(self):
+        """予約中の整合性チェックを取り消す"""
+        if self._reconcile_task and not self._reconcile_task.done():
+            self._reconcile_task.cancel()
+            try:
+                await self._reconcile_task
+            except asyncio.CancelledError:
+                pass
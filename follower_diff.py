@@ -0,0 +1,79 @@
+"""
+フォロワー差分モジュール
+DB のフォロワー行と API のフォロワー一覧を、どちらも user_id 順のストリームとして
+マージジョインし、差分 (追加・削除・相互フォロー状態の変更) をチャンク単位で返す
+- 保持するのは現在の1行ずつと、未返却のチャンク1つ分だけ (フォロワー数によらず一定のメモリ)
+- API はフォロー日時順に返すため、呼び出し側で一度DBのステージング表に入れて user_id 順に読み直す
+"""
+
+from typing import AsyncIterator, Optional, Tuple
+
+# (user_id, username, 相互フォローか)
+Row = Tuple[str, str, bool]
+
+
+def empty_delta() -> dict:
+    """空の差分チャンク"""
+    return {
+        'added': [],           # [(user_id, username), ...]
+        'removed': [],         # [user_id, ...]
+        'removed_mutual': [],  # removed のうち相互フォローだったもの (リムーブバック対象)
+        'mutual_on': [],       # [user_id, ...]
+        'mutual_off': [],      # [user_id, ...]
+    }
+
+
+def delta_size(delta: dict) -> int:
+    """差分チャンクに含まれる変更件数"""
+    return len(delta['added']) + len(delta['removed']) + len(delta['mutual_on']) + len(delta['mutual_off'])
+
+
+async def _next_row(rows: AsyncIterator[Row]) -> Optional[Row]:
+    """次の行 (末尾なら None)"""
+    try:
+        return await rows.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def diff_followers(db_rows: AsyncIterator[Row], api_rows: AsyncIterator[Row],
+                         compare_mutual: bool = True, chunk_size: int = 500):
+    """
+    DBとAPIのフォロワーをマージジョインして差分をチャンク単位でyield
+    :param db_rows: DBのフォロワー (user_id 昇順)
+    :param api_rows: APIのフォロワー (user_id 昇順)
+    :param compare_mutual: 相互フォロー状態も比較するか (API側にフォロー中一覧がない場合は False)
+    :param chunk_size: 1チャンクあたりの変更件数の目安
+    """
+    db_row = await _next_row(db_rows)
+    api_row = await _next_row(api_rows)
+    delta = empty_delta()
+
+    while db_row is not None or api_row is not None:
+        if api_row is None or (db_row is not None and db_row[0] < api_row[0]):
+            # DBにだけある → フォロー解除された
+            delta['removed'].append(db_row[0])
+            if db_row[2]:
+                delta['removed_mutual'].append(db_row[0])
+            db_row = await _next_row(db_rows)
+
+        elif db_row is None or api_row[0] < db_row[0]:
+            # APIにだけある → 新しいフォロワー
+            delta['added'].append((api_row[0], api_row[1]))
+            if compare_mutual and api_row[2]:
+                delta['mutual_on'].append(api_row[0])
+            api_row = await _next_row(api_rows)
+
+        else:
+            # 両方にある → 相互フォロー状態だけ比較
+            if compare_mutual and bool(db_row[2]) != bool(api_row[2]):
+                delta['mutual_on' if api_row[2] else 'mutual_off'].append(api_row[0])
+            db_row = await _next_row(db_rows)
+            api_row = await _next_row(api_rows)
+
+        if delta_size(delta) >= chunk_size:
+            yield delta
+            delta = empty_delta()
+
+    if delta_size(delta):
+        yield delta
@@ -3,13 +3,29 @@ Gemini APIクライアント (新ライブラリ版 - MAX_TOKENS 問題修正版
 google.genai を使用 (google.generativeai からの移行)
 """
 
+import asyncio
 import logging
+import time
 from google import genai
-from google.genai import types
-from config import settings
+from google.genai import errors, types
+from config import settings, bot_config
+from prompt_cache import PromptCacheManager
 
 logger = logging.getLogger(__name__)
 
+# Misskey 投稿の上限文字数
+MAX_NOTE_LENGTH = 140
+
+# ストリーム打ち切りに使う文末記号
+SENTENCE_ENDINGS = "。！？!?♪…〜～"
+
+# 生成プロファイルの既定値 (config.yaml の gemini.profiles.* で種別ごとに上書き)
+DEFAULT_PROFILE = {
+    'temperature': 1.0,
+    'max_output_tokens': 1024,  # 日本語は1文字=4〜5トークン程度
+    'thinking_budget': -1,      # -1: モデルに任せる (動的), 0: 思考なし
+}
+
 class GeminiClient:
     def __init__(self):
         """Gemini API クライアント初期化"""
@@ -19,22 +35,255 @@ class GeminiClient:
         # モデル名
         self.model_name = "gemini-2.5-flash"
         
-        # キャラクタープロンプトを読み込み
-        self.character_prompt = self._load_character_prompt()
+        # キャラクタープロンプト (コンテキストキャッシュ経由で送る)
+        self.prompt_cache = PromptCacheManager(self.client, self.model_name)
+        
+        # 同時実行数の上限 (全呼び出し種別で共有) と種別ごとの締め切り (秒)
+        self.max_concurrency = bot_config.get("gemini.max_concurrency", 2)
+        self.default_deadline = bot_config.get("gemini.deadline_seconds.default", 60)
+        self.deadlines = bot_config.get("gemini.deadline_seconds", {}) or {}
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        # ストリーミング生成: この文字数を超えた最初の文末で打ち切る
+        self.default_target_length = bot_config.get("gemini.target_length.default", 100)
+        self.target_lengths = bot_config.get("gemini.target_length", {}) or {}
+        
+        # 呼び出し種別ごとの統計
+        self._stats = {}
         
         logger.info(f"✅ Gemini APIクライアント初期化完了 ({self.model_name})")
         logger.info(f"📝 キャラクタープロンプト: {len(self.character_prompt)} 文字読み込み")
+        logger.info(f"🚦 Gemini同時実行数: {self.max_concurrency}")
+    
+    @property
+    def character_prompt(self) -> str:
+        """現在のキャラクタープロンプト"""
+        return self.prompt_cache.prompt
+    
+    async def start(self):
+        """非同期初期化 (コンテキストキャッシュ作成)"""
+        await self.prompt_cache.start()
+    
+    async def close(self):
+        """終了処理 (コンテキストキャッシュ削除)"""
+        await self.prompt_cache.close()
+    
+    def build_config(self, call_type: str, **overrides) -> types.GenerateContentConfig:
+        """
+        呼び出し種別のプロファイル (gemini.profiles.*) から GenerateContentConfig を作る
+        キャラクタープロンプトはキャッシュがあれば cached_content、なければ system_instruction
+        :param call_type: 呼び出し種別 (reply / random / timeline)
+        :param overrides: プロファイルを上書きする設定
+        """
+        profile = {**DEFAULT_PROFILE, **(bot_config.get(f"gemini.profiles.{call_type}", {}) or {})}
+        config_kwargs = {
+            'temperature': profile['temperature'],
+            'max_output_tokens': profile['max_output_tokens'],
+            'thinking_config': types.ThinkingConfig(thinking_budget=profile['thinking_budget']),
+        }
+        config_kwargs.update(overrides)
+        return self.prompt_cache.apply(**config_kwargs)
+    
+    async def generate_text(self, call_type: str, contents, config: types.GenerateContentConfig) -> str:
+        """
+        Gemini ストリーミング生成 (共有セマフォ + 締め切り付き)
+        - 目安文字数を超えた文末、または140文字上限に達した時点でストリームを打ち切る
+        - 空き枠待ちも含めて締め切りを超えたらキャンセルして asyncio.TimeoutError
+        :param call_type: 呼び出し種別 (reply / random / timeline)
+        :param contents: ユーザープロンプト
+        :param config: GenerateContentConfig
+        :return: 整形済みテキスト (改行除去・140文字以内)
+        """
+        deadline = self.deadlines.get(call_type, self.default_deadline)
+        stats = self._stats_for(call_type)
+        stats['calls'] += 1
+        started = time.perf_counter()
+        
+        try:
+            async with asyncio.timeout(deadline):
+                async with self._semaphore:
+                    try:
+                        text, usage = await self._stream_text(call_type, contents, config, started)
+                    except errors.ClientError as e:
+                        if not config.cached_content or e.code not in (400, 403, 404):
+                            raise
+                        # キャッシュが失効・削除されていた → インラインプロンプトで再試行
+                        logger.warning(f"⚠️ キャッシュ付き呼び出し失敗 ({e.code}): インラインで再試行")
+                        self.prompt_cache.invalidate()
+                        config = config.model_copy(update={
+                            "cached_content": None,
+                            "system_instruction": self.character_prompt
+                        })
+                        text, usage = await self._stream_text(call_type, contents, config, started)
+        except TimeoutError:
+            stats['timeouts'] += 1
+            logger.warning(f"⏱️  Gemini 締め切り超過 ({call_type}: {deadline}秒)")
+            raise
+        except Exception:
+            stats['errors'] += 1
+            raise
+        
+        latency = time.perf_counter() - started
+        stats['total_latency'] += latency
+        stats['max_latency'] = max(stats['max_latency'], latency)
+        self._record_usage(call_type, usage, latency)
+        return text
     
-    def _load_character_prompt(self) -> str:
-        """キャラクタープロンプトをファイルから読み込み"""
+    def _record_usage(self, call_type: str, usage, latency: float):
+        """1回分のトークン数 (プロンプト・キャッシュ・思考・出力) とレイテンシを記録"""
+        stats = self._stats_for(call_type)
+        prompt_tokens = (usage.prompt_token_count or 0) if usage else 0
+        cached_tokens = (usage.cached_content_token_count or 0) if usage else 0
+        thinking_tokens = (usage.thoughts_token_count or 0) if usage else 0
+        output_tokens = (usage.candidates_token_count or 0) if usage else 0
+        
+        if usage:
+            stats['usage_calls'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['cached_tokens'] += cached_tokens
+            stats['thinking_tokens'] += thinking_tokens
+            stats['output_tokens'] += output_tokens
+        
+        logger.info(
+            f"📈 Gemini使用量 ({call_type}): prompt={prompt_tokens} (cached={cached_tokens}) "
+            f"thinking={thinking_tokens} output={output_tokens} latency={latency * 1000:.0f}ms"
+        )
+    
+    async def _stream_text(self, call_type: str, contents, config, started: float):
+        """
+        ストリームを受信しながら組み立て、十分な長さになったら打ち切る
+        :return: (整形済みテキスト, 最後に受信した usage_metadata)
+        """
+        target_length = self.target_lengths.get(call_type, self.default_target_length)
+        stats = self._stats_for(call_type)
+        
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model_name,
+            contents=contents,
+            config=config
+        )
+        
+        text = ""
+        first_chunk = True
+        finish_reason = None
+        usage = None
         try:
-            with open("katariina_prompt.md", "r", encoding="utf-8") as f:
-                prompt = f.read()
-            logger.debug("キャラクタープロンプト読み込み成功")
-            return prompt
-        except Exception as e:
-            logger.error(f"キャラクタープロンプト読み込みエラー: {e}")
-            return "あなたは親しみやすいキャラクターです。"
+            async for chunk in stream:
+                if first_chunk:
+                    stats['total_ttft'] += time.perf_counter() - started
+                    first_chunk = False
+                
+                if chunk.candidates and chunk.candidates[0].finish_reason:
+                    finish_reason = chunk.candidates[0].finish_reason
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+                
+                text += chunk.text or ""
+                cut = self._find_cut(self._normalize(text), target_length)
+                if cut is not None:
+                    stats['early_stops'] += 1
+                    logger.debug(f"✂️  ストリーム打ち切り ({call_type}): {cut}文字")
+                    return self._normalize(text)[:cut], usage
+        finally:
+            # 打ち切り時は残りの受信を止める
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        
+        if finish_reason and finish_reason != types.FinishReason.STOP:
+            logger.warning(f"⚠️ finish_reason: {finish_reason}")
+        
+        content = self._normalize(text)
+        if not content:
+            raise ValueError(f"Gemini の応答が空です (finish_reason: {finish_reason})")
+        if len(content) > MAX_NOTE_LENGTH:
+            logger.info(f"📏 {len(content)}文字を{MAX_NOTE_LENGTH}文字に切り詰め")
+            content = content[:MAX_NOTE_LENGTH]
+        return content, usage
+    
+    @staticmethod
+    def _normalize(text: str) -> str:
+        """前後の空白と改行を除去"""
+        content = text.strip()
+        if '\n' in content:
+            content = content.replace('\n', ' ').replace('  ', ' ')
+        return content
+    
+    @staticmethod
+    def _find_cut(text: str, target_length: int):
+        """
+        打ち切り位置を決める
+        - 目安文字数以降に文末記号が現れたら、その直後
+        - 140文字に達したら、目安文字数の半分以降にある最後の文末記号 (なければ140文字ちょうど)
+        :return: 切り出す文字数 (まだ続きを待つ場合は None)
+        """
+        for i in range(max(target_length - 1, 0), min(len(text), MAX_NOTE_LENGTH)):
+            if text[i] in SENTENCE_ENDINGS:
+                return i + 1
+        
+        if len(text) >= MAX_NOTE_LENGTH:
+            for i in range(MAX_NOTE_LENGTH - 1, max(target_length // 2 - 1, 0) - 1, -1):
+                if text[i] in SENTENCE_ENDINGS:
+                    return i + 1
+            return MAX_NOTE_LENGTH
+        
+        return None
+    
+    def _stats_for(self, call_type: str) -> dict:
+        """呼び出し種別ごとの統計"""
+        if call_type not in self._stats:
+            self._stats[call_type] = {
+                'calls': 0,
+                'errors': 0,
+                'timeouts': 0,
+                'early_stops': 0,
+                'total_ttft': 0.0,
+                'total_latency': 0.0,
+                'max_latency': 0.0,
+                'usage_calls': 0,
+                'prompt_tokens': 0,
+                'cached_tokens': 0,
+                'thinking_tokens': 0,
+                'output_tokens': 0,
+            }
+        return self._stats[call_type]
+    
+    def get_stats(self) -> dict:
+        """呼び出し種別ごとの統計情報を取得"""
+        result = {}
+        for call_type, stats in self._stats.items():
+            succeeded = stats['calls'] - stats['errors'] - stats['timeouts']
+            result[call_type] = {
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'timeouts': stats['timeouts'],
+                'early_stops': stats['early_stops'],
+                'avg_ttft_ms': stats['total_ttft'] / succeeded * 1000 if succeeded else 0.0,
+                'avg_latency_ms': stats['total_latency'] / succeeded * 1000 if succeeded else 0.0,
+                'max_latency_ms': stats['max_latency'] * 1000,
+                'avg_prompt_tokens': stats['prompt_tokens'] / stats['usage_calls'] if stats['usage_calls'] else 0.0,
+                'avg_cached_tokens': stats['cached_tokens'] / stats['usage_calls'] if stats['usage_calls'] else 0.0,
+                'avg_thinking_tokens': stats['thinking_tokens'] / stats['usage_calls'] if stats['usage_calls'] else 0.0,
+                'avg_output_tokens': stats['output_tokens'] / stats['usage_calls'] if stats['usage_calls'] else 0.0,
+            }
+        return result
+    
+    def log_stats(self):
+        """統計情報をログ出力"""
+        stats = self.get_stats()
+        if not stats:
+            return
+        
+        logger.info("📊 Gemini生成統計:")
+        for call_type, s in stats.items():
+            logger.info(
+                f"  - {call_type}: {s['calls']}回 (エラー{s['errors']}, タイムアウト{s['timeouts']}, 打ち切り{s['early_stops']}) "
+                f"初回応答 平均{s['avg_ttft_ms']:.0f}ms / 完了 平均{s['avg_latency_ms']:.0f}ms・最大{s['max_latency_ms']:.0f}ms"
+            )
+            logger.info(
+                f"    平均トークン: prompt {s['avg_prompt_tokens']:.0f} (cached {s['avg_cached_tokens']:.0f}) / "
+                f"thinking {s['avg_thinking_tokens']:.0f} / output {s['avg_output_tokens']:.0f}"
+            )
     
     async def generate_random_post(self) -> str:
         """
@@ -52,35 +301,11 @@ class GeminiClient:
 
 投稿内容のみを出力してください（説明や前置きは不要）:"""
 
-            # GenerateContentConfig を使用 (system_instruction として設定)
-            config = types.GenerateContentConfig(
-                system_instruction=self.character_prompt,
-                temperature=1.0,
-                max_output_tokens=1024  # ← 512→1024 に増量（日本語は1文字=4〜5トークン）
-            )
-            
-            # generate_content を使用
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=user_prompt,
-                config=config
-            )
-            
-            # finish_reason チェック
-            if response.candidates and response.candidates[0].finish_reason != types.FinishReason.STOP:
-                logger.warning(f"⚠️ finish_reason: {response.candidates[0].finish_reason}")
-            
-            # テキスト取得
-            content = response.text.strip()
-            
-            # 改行削除
-            if '\n' in content:
-                content = content.replace('\n', ' ').replace('  ', ' ')
+            # 生成プロファイル (gemini.profiles.random) + キャラクタープロンプト
+            config = self.build_config("random")
             
-            # 140文字超過チェック
-            if len(content) > 140:
-                logger.info(f"📏 {len(content)}文字を140文字に切り詰め")
-                content = content[:140]
+            # ストリーミング生成 (140文字以内に整形済み)
+            content = await self.generate_text("random", user_prompt, config)
             
             logger.info(f"✅ ランダム投稿生成成功 ({len(content)}文字): {content}")
             return content
@@ -111,38 +336,11 @@ class GeminiClient:
 
 返信内容のみを出力してください（説明や前置きは不要）:"""
 
-            # GenerateContentConfig を使用 (system_instruction として設定)
-            config = types.GenerateContentConfig(
-                system_instruction=self.character_prompt,
-                temperature=1.0,
-                max_output_tokens=1024,  # ← 512→1024 に増量
-                candidate_count=1
-            )
-            
-            # generate_content を使用
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=user_prompt,
-                config=config
-            )
-            
-            # finish_reason チェック
-            if response.candidates:
-                finish_reason = response.candidates[0].finish_reason
-                if finish_reason != types.FinishReason.STOP:
-                    logger.warning(f"⚠️ finish_reason: {finish_reason} (MAX_TOKENSの可能性)")
-            
-            # テキスト取得
-            content = response.text.strip()
-            
-            # 改行削除
-            if '\n' in content:
-                content = content.replace('\n', ' ').replace('  ', ' ')
+            # 生成プロファイル (gemini.profiles.reply) + キャラクタープロンプト
+            config = self.build_config("reply", candidate_count=1)
             
-            # 140文字超過チェック
-            if len(content) > 140:
-                logger.info(f"📏 {len(content)}文字を140文字に切り詰め")
-                content = content[:140]
+            # ストリーミング生成 (140文字以内に整形済み)
+            content = await self.generate_text("reply", user_prompt, config)
             
             logger.info(f"✅ リプライ生成成功 ({len(content)}文字): {content}")
             return content
@@ -0,0 +1,118 @@
+"""
+キーワード照合モジュール
+Aho-Corasick 法による複数キーワードの一括照合
+- 読み込み時に一度だけオートマトンを構築
+- 照合はテキスト長に比例する時間 (キーワード数に依存しない)
+- 全角/半角・大文字/小文字の揺れは NFKC + lower で正規化して吸収
+"""
+
+import unicodedata
+from typing import Iterable, List
+
+
+def normalize(text: str) -> str:
+    """照合用にテキストを正規化 (NFKC + 小文字化)"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str] = ()):
+        """
+        :param keywords: 照合するキーワード (正規化は内部で行う)
+        """
+        # ノードごとの遷移表・失敗リンク・そのノードで終わるキーワード
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._count = 0
+
+        for keyword in keywords:
+            self._add(keyword)
+        self._build()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _add(self, keyword: str):
+        """トライにキーワードを追加"""
+        word = normalize(keyword.strip()) if keyword else ""
+        if not word:
+            return
+
+        node = 0
+        for char in word:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            node = next_node
+
+        if self._output[node] is None:
+            self._output[node] = word
+            self._count += 1
+
+    def _build(self):
+        """幅優先で失敗リンクを張る"""
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                # 失敗先で終わるキーワードも、このノードで一致したことにする
+                if self._output[child] is None and self._output[self._fail[child]] is not None:
+                    self._output[child] = self._output[self._fail[child]]
+
+    def contains_any(self, text: str) -> bool:
+        """
+        いずれかのキーワードが含まれているか
+        :param text: チェック対象テキスト
+        """
+        if not text or not self._count:
+            return False
+
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for char in normalize(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node] is not None:
+                return True
+        return False
+
+    def find_all(self, text: str) -> List[str]:
+        """
+        含まれているキーワードを全て返す (正規化後の表記、重複なし)
+        :param text: チェック対象テキスト
+        """
+        if not text or not self._count:
+            return []
+
+        goto, fail, output = self._goto, self._fail, self._output
+        found = []
+        node = 0
+        for char in normalize(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            # 失敗リンクをたどって、このノードで終わる全キーワードを集める
+            match = node
+            while match:
+                word = output[match]
+                if word is None:
+                    break
+                if word not in found:
+                    found.append(word)
+                match = fail[match]
+        return found
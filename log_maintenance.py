@@ -1,25 +1,30 @@
 """
 ログメンテナンスモジュール
 ログファイルのローテーション・圧縮・削除
+- 圧縮は圧縮サービスのワーカーで実行 (イベントループを止めない)
 """
 
+import asyncio
 import logging
-import gzip
 import shutil
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from compression import CompressionService, EXTENSIONS
+
 logger = logging.getLogger(__name__)
 
 class LogMaintenance:
-    def __init__(self, log_dir: str = "logs"):
+    def __init__(self, log_dir: str = "logs", compression: CompressionService = None):
         """
         :param log_dir: ログディレクトリパス
+        :param compression: 圧縮サービス (省略時は専用に作成)
         """
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(exist_ok=True)
+        self.compression = compression or CompressionService()
     
-    def rotate_log(self, log_filename: str = "bot.log"):
+    async def rotate_log(self, log_filename: str = "bot.log"):
         """
         ログファイルをローテーション (リネーム + 圧縮)
         :param log_filename: ローテーション対象のログファイル名
@@ -43,33 +48,27 @@ class LogMaintenance:
             rotated_path = self.log_dir / rotated_filename
             
             # リネーム
-            shutil.move(log_file, rotated_path)
+            await asyncio.to_thread(shutil.move, log_file, rotated_path)
             logger.info(f"  - ローテーション: {rotated_filename}")
             
-            # gzip圧縮
-            compressed_path = rotated_path.with_suffix(f"{rotated_path.suffix}.gz")
-            with open(rotated_path, 'rb') as f_in:
-                with gzip.open(compressed_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            
-            # 元のファイルを削除
-            rotated_path.unlink()
+            # 圧縮 (圧縮できたら元のファイルを削除)
+            result = await self.compression.compress_file(rotated_path, remove_source=True)
             
-            compressed_size_mb = compressed_path.stat().st_size / (1024 * 1024)
-            compression_ratio = (1 - compressed_size_mb / size_mb) * 100
+            compressed_size_mb = result['compressed_size'] / (1024 * 1024)
+            compression_ratio = (1 - compressed_size_mb / size_mb) * 100 if size_mb else 0.0
             
-            logger.info(f"  - 圧縮完了: {compressed_path.name}")
+            logger.info(f"  - 圧縮完了: {result['path'].name}")
             logger.info(f"  - 圧縮率: {compression_ratio:.1f}% ({size_mb:.2f}MB → {compressed_size_mb:.2f}MB)")
             logger.info(f"✅ ログローテーション完了")
             
         except Exception as e:
             logger.error(f"ログローテーションエラー: {e}")
     
-    def cleanup_old_logs(self, days: int = 30, pattern: str = "bot_*.log.gz"):
+    def cleanup_old_logs(self, days: int = 30, pattern: str = "bot_*.log.*"):
         """
         古いログファイルを削除
         :param days: 何日以前のログを削除するか
-        :param pattern: 削除対象ファイルのパターン
+        :param pattern: 削除対象ファイルのパターン (圧縮済み: .gz / .zst)
         """
         logger.info(f"🗑️  古いログ削除開始 (>{days}日前)")
         
@@ -125,7 +124,7 @@ class LogMaintenance:
                     stats['active_log_size_mb'] = size_mb
                 
                 # アーカイブログ
-                if log_file.suffix == ".gz":
+                if log_file.suffix in EXTENSIONS.values():
                     stats['archived_count'] += 1
                     stats['archived_size_mb'] += size_mb
             
@@ -22,9 +22,13 @@ from scheduled_post_manager import ScheduledPostManager
 from follow_manager import FollowManager
 from reply_manager import ReplyManager
 from streaming_manager import StreamingManager
+from mention_dispatcher import MentionDispatcher
 from database_maintenance import DatabaseMaintenance
 from log_maintenance import LogMaintenance
+from compression import CompressionService
 from timeline_post_manager import TimelinePostManager
+from post_buffer import PostBuffer
+from duplicate_checker import DuplicateChecker
 
 # ログ設定
 Path("logs").mkdir(exist_ok=True)
@@ -45,22 +49,46 @@ class RiinaBot:
         self.misskey = MisskeyClient()
         self.gemini = GeminiClient()
         
-        self.post_manager = PostManager(self.misskey, self.gemini, self.db)
-        self.scheduled_post_manager = ScheduledPostManager(self.misskey, self.gemini, self.db)
         self.follow_manager = FollowManager(self.misskey, self.db)
         self.reply_manager = ReplyManager(self.misskey, self.gemini, self.db)
-        self.timeline_post_manager = TimelinePostManager(self.misskey, self.gemini, self.db)
+        
+        # メンション並行処理 (WebSocket受信ループ → ReplyManager)
+        self.mention_dispatcher = MentionDispatcher(self.reply_manager)
+        
+        # 投稿文の事前生成バッファ (メンション処理中は補充しない)
+        self.post_buffer = PostBuffer(
+            self.db,
+            is_idle=lambda: self.mention_dispatcher.queue_depth == 0
+        )
+        
+        # 類似投稿チェック (直近の自分の投稿とほぼ同じ文面を避ける)
+        self.duplicate_checker = DuplicateChecker(self.db)
+        
+        self.post_manager = PostManager(
+            self.misskey, self.gemini, self.db,
+            post_buffer=self.post_buffer, duplicate_checker=self.duplicate_checker
+        )
+        self.scheduled_post_manager = ScheduledPostManager(
+            self.misskey, self.gemini, self.db, duplicate_checker=self.duplicate_checker
+        )
+        self.timeline_post_manager = TimelinePostManager(
+            self.misskey, self.gemini, self.db,
+            post_buffer=self.post_buffer, duplicate_checker=self.duplicate_checker
+        )
         
         # WebSocketストリーミング
         self.streaming_manager = StreamingManager(
             self.misskey,
             reply_manager=self.reply_manager,
-            follow_manager=self.follow_manager
+            follow_manager=self.follow_manager,
+            mention_dispatcher=self.mention_dispatcher
         )
         
         # メンテナンス
-        self.db_maintenance = DatabaseMaintenance(self.db)
-        self.log_maintenance = LogMaintenance()
+        # (バックアップ・ログの圧縮は共通の圧縮サービスのワーカーで実行)
+        self.compression = CompressionService()
+        self.db_maintenance = DatabaseMaintenance(self.db, compression=self.compression)
+        self.log_maintenance = LogMaintenance(compression=self.compression)
         
         self.scheduler = AsyncIOScheduler()
         self.running = False
@@ -68,7 +96,9 @@ class RiinaBot:
     async def initialize(self):
         """非同期初期化"""
         await self.db.connect()
+        await self.reply_manager.rate_limiter.restore()
         await self.misskey.connect()
+        await self.gemini.start()
         
         # ★ タイムライン連動投稿の初期化（外部NGワード読み込み）
         await self.timeline_post_manager.initialize()
@@ -106,15 +136,50 @@ class RiinaBot:
         else:
             logger.info("⏸️  タイムライン連動投稿: 無効")
         
+        # 取りこぼしメンション回収 (WebSocket再接続時の回収を補完)
+        recovery_interval = bot_config.get("reply.recovery.interval_minutes", 10)
+        
+        async def _recover_mentions():
+            await self.reply_manager.check_mentions(dispatch=self.mention_dispatcher.submit)
+        
+        self.scheduler.add_job(
+            _recover_mentions,
+            trigger=IntervalTrigger(minutes=recovery_interval),
+            id='mention_recovery',
+            name='取りこぼしメンション回収'
+        )
+        logger.info(f"✅ 取りこぼしメンション回収: {recovery_interval}分ごと")
+        
+        # リプライレート制限のスナップショット保存
+        snapshot_interval = bot_config.get("reply.rate_limit.snapshot_interval_minutes", 5)
+        self.scheduler.add_job(
+            self.reply_manager.rate_limiter.snapshot,
+            trigger=IntervalTrigger(minutes=snapshot_interval),
+            id='rate_limit_snapshot',
+            name='レート制限スナップショット保存'
+        )
+        logger.info(f"✅ レート制限スナップショット保存: {snapshot_interval}分ごと")
+        
+        # 外部NGワードリスト更新 (条件付きGET)
+        if timeline_post_enabled:
+            ng_refresh_hours = bot_config.get("posting.timeline_post.ng_word_refresh_hours", 24)
+            self.scheduler.add_job(
+                self.timeline_post_manager.ng_word_manager.refresh_external_ng_words,
+                trigger=IntervalTrigger(hours=ng_refresh_hours),
+                id='ng_word_refresh',
+                name='外部NGワードリスト更新'
+            )
+            logger.info(f"✅ 外部NGワードリスト更新: {ng_refresh_hours}時間ごと")
+        
         # フォロー状態チェック
         follow_check_interval = bot_config.get("follow.check_interval_minutes", 30)
         self.scheduler.add_job(
             self.follow_manager.check_and_sync_followers,
             trigger=IntervalTrigger(minutes=follow_check_interval),
             id='follow_check',
-            name='フォロー状態チェック (定期同期)'
+            name='フォロー状態チェック (整合性スイープ)'
         )
-        logger.info(f"✅ フォロー状態チェック: {follow_check_interval}分ごと (定期同期)")
+        logger.info(f"✅ フォロー状態チェック: {follow_check_interval}分ごと (整合性スイープ)")
         
         # 定時投稿
         scheduled_posts_enabled = bot_config.get("posting.scheduled_posts.enabled", True)
@@ -163,6 +228,7 @@ class RiinaBot:
             hour, minute = cleanup_time.split(":")
             async def _cleanup_old_records():
                 await self.db_maintenance.cleanup_old_records(cleanup_days)
+                await self.duplicate_checker.trim_index()
             
             self.scheduler.add_job(
                 _cleanup_old_records,
@@ -193,8 +259,8 @@ class RiinaBot:
             log_cleanup_days = bot_config.get("maintenance.log_cleanup_days", 30)
             hour, minute = log_rotate_time.split(":")
             
-            def log_rotate_and_cleanup():
-                self.log_maintenance.rotate_log("bot.log")
+            async def log_rotate_and_cleanup():
+                await self.log_maintenance.rotate_log("bot.log")
                 self.log_maintenance.cleanup_old_logs(days=log_cleanup_days)
             
             self.scheduler.add_job(
@@ -211,6 +277,9 @@ class RiinaBot:
             async def log_all_stats():
                 await self.db_maintenance.log_database_stats()
                 self.log_maintenance.log_stats()
+                self.mention_dispatcher.log_stats()
+                self.gemini.log_stats()
+                self.duplicate_checker.log_stats()
             
             self.scheduler.add_job(
                 log_all_stats,
@@ -234,7 +303,9 @@ class RiinaBot:
         await self.db_maintenance.log_database_stats()
         self.log_maintenance.log_stats()
         
+        await self.mention_dispatcher.start()
         await self.streaming_manager.start()
+        await self.post_buffer.start()
         logger.info("✅ WebSocketリアルタイム監視: メンション・フォロー通知")
         logger.info("=== Bot起動完了 ===")
         
@@ -256,13 +327,20 @@ class RiinaBot:
         logger.info("停止時バックアップを作成中...")
         await self.db_maintenance.backup_database(compress=True)
         
+        await self.post_buffer.stop()
+        await self.timeline_post_manager.ng_word_manager.close()
         await self.streaming_manager.stop()
+        await self.mention_dispatcher.stop()
+        await self.follow_manager.close()
         
         if self.scheduler.running:
             self.scheduler.shutdown()
         
+        await self.gemini.close()
         await self.misskey.close()
+        await self.reply_manager.rate_limiter.snapshot()
         await self.db.close()
+        await self.compression.close()
         logger.info("Bot停止完了")
 
 async def main():
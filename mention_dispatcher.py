@@ -0,0 +1,157 @@
+"""
+メンションディスパッチャーモジュール
+WebSocket受信ループと ReplyManager の間に入り、メンションを並行処理する
+- 上限付きキュー (満杯なら受信側を待たせる)
+- N個のワーカーで並行処理
+- 同一ユーザーのメンションは受信順に1件ずつ処理
+- キュー深さ・待ち時間の統計
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from config import bot_config
+
+logger = logging.getLogger(__name__)
+
+
+class MentionDispatcher:
+    def __init__(self, reply_manager):
+        """
+        :param reply_manager: ReplyManagerインスタンス
+        """
+        self.reply_manager = reply_manager
+        self.worker_count = bot_config.get("reply.dispatcher.workers", 4)
+        self.max_queue_size = bot_config.get("reply.dispatcher.max_queue_size", 100)
+
+        # ユーザーごとの待ち行列と、処理可能になったユーザーのキュー
+        self._pending = {}
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_queue_size)
+        self._workers = []
+        self._depth = 0
+
+        # 統計
+        self._stats = {
+            'dispatched': 0,
+            'processed': 0,
+            'failed': 0,
+            'max_depth': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+        }
+
+    async def start(self):
+        """ワーカー起動"""
+        if self._workers:
+            return
+
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.worker_count)
+        ]
+        logger.info(f"✅ メンションディスパッチャー起動: ワーカー{self.worker_count}個, キュー上限{self.max_queue_size}件")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """
+        ワーカー停止
+        :param drain_timeout: キューに残ったメンションを処理し切るまで待つ秒数
+        """
+        if not self._workers:
+            return
+
+        deadline = time.monotonic() + drain_timeout
+        while self._depth > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._depth > 0:
+            logger.warning(f"⚠️ 未処理メンション{self._depth}件を残して停止します")
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("メンションディスパッチャー停止")
+
+    async def submit(self, mention: dict):
+        """
+        メンションをキューに投入
+        キューが満杯の場合は空きが出るまで待つ (WebSocket受信側へのバックプレッシャー)
+        """
+        if not isinstance(mention, dict):
+            logger.warning(f"⚠️ メンションデータが不正 (type={type(mention).__name__}): {mention}")
+            return
+
+        user = mention.get('user') or {}
+        user_key = user.get('id') if isinstance(user, dict) else None
+        user_key = user_key or mention.get('id')
+
+        if self._slots.locked():
+            logger.warning(f"⚠️ メンションキュー満杯 ({self.max_queue_size}件): 空き待ち")
+        await self._slots.acquire()
+
+        queue = self._pending.get(user_key)
+        if queue is None:
+            # このユーザーの処理中・待ち行列がない → すぐ処理可能
+            queue = self._pending[user_key] = deque()
+            self._ready.put_nowait(user_key)
+        queue.append((mention, time.monotonic()))
+
+        self._depth += 1
+        self._stats['dispatched'] += 1
+        self._stats['max_depth'] = max(self._stats['max_depth'], self._depth)
+        logger.debug(f"メンション投入: キュー深さ{self._depth}件")
+
+    async def _worker(self, worker_id: int):
+        """ワーカー: 処理可能なユーザーの先頭メンションを1件ずつ処理"""
+        while True:
+            user_key = await self._ready.get()
+            queue = self._pending[user_key]
+            mention, enqueued_at = queue.popleft()
+
+            wait = time.monotonic() - enqueued_at
+            self._stats['total_wait'] += wait
+            self._stats['max_wait'] = max(self._stats['max_wait'], wait)
+
+            try:
+                await self.reply_manager.handle_mention(mention)
+                self._stats['processed'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats['failed'] += 1
+                logger.exception(f"メンション処理エラー (worker {worker_id}): {e}")
+            finally:
+                self._depth -= 1
+                self._slots.release()
+                # 同じユーザーの続きがあれば再びキューへ (順序を保つため処理後に戻す)
+                if queue:
+                    self._ready.put_nowait(user_key)
+                else:
+                    del self._pending[user_key]
+
+    @property
+    def queue_depth(self) -> int:
+        """処理待ち・処理中のメンション数"""
+        return self._depth
+
+    def get_stats(self) -> dict:
+        """統計情報を取得"""
+        handled = self._stats['processed'] + self._stats['failed']
+        return {
+            'queue_depth': self._depth,
+            'max_queue_depth': self._stats['max_depth'],
+            'dispatched': self._stats['dispatched'],
+            'processed': self._stats['processed'],
+            'failed': self._stats['failed'],
+            'avg_wait_ms': (self._stats['total_wait'] / handled * 1000) if handled else 0.0,
+            'max_wait_ms': self._stats['max_wait'] * 1000,
+        }
+
+    def log_stats(self):
+        """統計情報をログ出力"""
+        stats = self.get_stats()
+        logger.info("📊 メンションディスパッチャー統計:")
+        logger.info(f"  - キュー深さ: {stats['queue_depth']}件 (最大{stats['max_queue_depth']}件)")
+        logger.info(f"  - 処理: {stats['processed']}件 / 失敗: {stats['failed']}件 (受付{stats['dispatched']}件)")
+        logger.info(f"  - 待ち時間: 平均{stats['avg_wait_ms']:.1f}ms, 最大{stats['max_wait_ms']:.1f}ms")
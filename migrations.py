@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+データベーススキーマのマイグレーションモジュール
+PRAGMA user_version でスキーマのバージョンを管理し、未適用のマイグレーションだけを順に実行する
+- 起動時に Database.connect から自動実行 (何度実行しても同じ結果)
+- 1バージョンごとに1トランザクション (途中で落ちてもそのバージョンの変更は残らない)
+
+手動実行: python migrations.py
+"""
+
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+def iso_to_epoch_ms(value):
+    """
+    旧形式のタイムスタンプ (datetime.now().isoformat() のローカル時刻文字列) をエポックミリ秒に変換
+    :return: エポックミリ秒 (変換できなければ None)
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _column_names(conn: aiosqlite.Connection, table: str) -> list:
+    """テーブルのカラム名一覧"""
+    async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+        return [row[1] for row in await cursor.fetchall()]
+
+
+async def _migrate_v1_initial_schema(conn: aiosqlite.Connection):
+    """v1: 初期スキーマ (旧 _init_tables と migrate_database.py 相当)"""
+    # フォロワーテーブル
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS followers (
+            user_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            followed_at TEXT NOT NULL,
+            is_following_back BOOLEAN DEFAULT 0
+        )
+    """)
+
+    # 投稿履歴テーブル
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            note_id TEXT,
+            post_type TEXT,
+            content TEXT,
+            posted_at TEXT NOT NULL
+        )
+    """)
+
+    # リプライレート制限テーブル
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS reply_rate_limits (
+            user_id TEXT NOT NULL,
+            replied_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, replied_at)
+        )
+    """)
+
+    # 事前生成した投稿文のバッファ
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS post_buffer (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+    # bot状態テーブル (通知カーソル等のキー・バリュー)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+    # 旧 migrate_database.py で追加していたカラム (診断スクリプトが参照)
+    if "is_follower" not in await _column_names(conn, "followers"):
+        await conn.execute("ALTER TABLE followers ADD COLUMN is_follower BOOLEAN DEFAULT 1")
+
+
+async def _migrate_v2_epoch_ms_timestamps(conn: aiosqlite.Connection):
+    """
+    v2: タイムスタンプを ISO 文字列から INTEGER (エポックミリ秒) に変換
+    TEXT 型のカラムには整数を入れても文字列に変換されるため、テーブルを作り直して移す
+    """
+    await conn.create_function("iso_to_epoch_ms", 1, iso_to_epoch_ms, deterministic=True)
+
+    await conn.execute("""
+        CREATE TABLE followers_new (
+            user_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            followed_at INTEGER NOT NULL,
+            is_following_back BOOLEAN DEFAULT 0,
+            is_follower BOOLEAN DEFAULT 1
+        )
+    """)
+    await conn.execute("""
+        INSERT INTO followers_new (user_id, username, followed_at, is_following_back, is_follower)
+        SELECT user_id, username, COALESCE(iso_to_epoch_ms(followed_at), 0), is_following_back, is_follower
+        FROM followers
+    """)
+
+    await conn.execute("""
+        CREATE TABLE posts_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            note_id TEXT,
+            post_type TEXT,
+            content TEXT,
+            posted_at INTEGER NOT NULL
+        )
+    """)
+    await conn.execute("""
+        INSERT INTO posts_new (id, note_id, post_type, content, posted_at)
+        SELECT id, note_id, post_type, content, COALESCE(iso_to_epoch_ms(posted_at), 0)
+        FROM posts
+    """)
+
+    await conn.execute("""
+        CREATE TABLE reply_rate_limits_new (
+            user_id TEXT NOT NULL,
+            replied_at INTEGER NOT NULL,
+            PRIMARY KEY (user_id, replied_at)
+        )
+    """)
+    await conn.execute("""
+        INSERT OR IGNORE INTO reply_rate_limits_new (user_id, replied_at)
+        SELECT user_id, COALESCE(iso_to_epoch_ms(replied_at), 0)
+        FROM reply_rate_limits
+    """)
+
+    await conn.execute("""
+        CREATE TABLE post_buffer_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+    """)
+    await conn.execute("""
+        INSERT INTO post_buffer_new (id, post_type, content, created_at)
+        SELECT id, post_type, content, COALESCE(iso_to_epoch_ms(created_at), 0)
+        FROM post_buffer
+    """)
+
+    for table in ("followers", "posts", "reply_rate_limits", "post_buffer"):
+        await conn.execute(f"DROP TABLE {table}")
+        await conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+async def _migrate_v3_indexes(conn: aiosqlite.Connection):
+    """v3: 範囲削除・統計・リプライ判定で使うインデックス"""
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_posted_at ON posts (posted_at)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_note_id ON posts (note_id)")
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reply_rate_limits_replied_at ON reply_rate_limits (replied_at)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_followers_following_back ON followers (is_following_back)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_post_buffer_type ON post_buffer (post_type, created_at)"
+    )
+
+
+async def _migrate_v4_follower_sync_staging(conn: aiosqlite.Connection):
+    """v4: フォロワー同期用のステージング表 (APIの一覧を user_id 順に読み直すため)"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS follower_sync_staging (
+            user_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            is_mutual BOOLEAN DEFAULT 0
+        )
+    """)
+
+
+async def _migrate_v5_stats_counters(conn: aiosqlite.Connection):
+    """
+    v5: 統計用の集計表をトリガーで更新する (統計の取得で COUNT(*) / MIN / MAX を走らせない)
+    name は "followers" / "posts" / "reply_rate_limits" / "posts:<post_type>"
+    """
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            first_at INTEGER,
+            last_at INTEGER
+        )
+    """)
+    # 種別ごとの最古・最新を削除時にインデックスの端だけで求め直すため
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_posts_type_posted_at ON posts (post_type, posted_at)"
+    )
+
+    # 既存の行から初期値を作る (この1回だけは全件を数える)
+    await conn.execute("DELETE FROM stats_counters")
+    await conn.execute("INSERT INTO stats_counters (name, row_count) SELECT 'followers', COUNT(*) FROM followers")
+    await conn.execute(
+        "INSERT INTO stats_counters (name, row_count) SELECT 'reply_rate_limits', COUNT(*) FROM reply_rate_limits"
+    )
+    await conn.execute("""
+        INSERT INTO stats_counters (name, row_count, first_at, last_at)
+        SELECT 'posts', COUNT(*), MIN(posted_at), MAX(posted_at) FROM posts
+    """)
+    await conn.execute("""
+        INSERT INTO stats_counters (name, row_count, first_at, last_at)
+        SELECT 'posts:' || COALESCE(post_type, ''), COUNT(*), MIN(posted_at), MAX(posted_at)
+        FROM posts GROUP BY post_type
+    """)
+
+    # 件数だけのテーブル (INSERT OR IGNORE で無視された行ではトリガーは動かない)
+    for table in ("followers", "reply_rate_limits"):
+        await conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS stats_{table}_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE stats_counters SET row_count = row_count + 1 WHERE name = '{table}';
+            END
+        """)
+        await conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS stats_{table}_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE stats_counters SET row_count = row_count - 1 WHERE name = '{table}';
+            END
+        """)
+
+    # 投稿履歴: 全体と種別ごとの件数・最古・最新
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS stats_posts_insert AFTER INSERT ON posts
+        BEGIN
+            UPDATE stats_counters SET
+                row_count = row_count + 1,
+                first_at = MIN(COALESCE(first_at, NEW.posted_at), NEW.posted_at),
+                last_at = MAX(COALESCE(last_at, NEW.posted_at), NEW.posted_at)
+            WHERE name = 'posts';
+            INSERT INTO stats_counters (name, row_count, first_at, last_at)
+            VALUES ('posts:' || COALESCE(NEW.post_type, ''), 1, NEW.posted_at, NEW.posted_at)
+            ON CONFLICT (name) DO UPDATE SET
+                row_count = row_count + 1,
+                first_at = MIN(COALESCE(first_at, excluded.first_at), excluded.first_at),
+                last_at = MAX(COALESCE(last_at, excluded.last_at), excluded.last_at);
+        END
+    """)
+    # 削除した行が最古・最新だったときだけ、インデックスの端を読んで求め直す (空になれば NULL)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS stats_posts_delete AFTER DELETE ON posts
+        BEGIN
+            UPDATE stats_counters SET
+                row_count = row_count - 1,
+                first_at = CASE WHEN OLD.posted_at <= first_at
+                    THEN (SELECT MIN(posted_at) FROM posts) ELSE first_at END,
+                last_at = CASE WHEN OLD.posted_at >= last_at
+                    THEN (SELECT MAX(posted_at) FROM posts) ELSE last_at END
+            WHERE name = 'posts';
+            UPDATE stats_counters SET
+                row_count = row_count - 1,
+                first_at = CASE WHEN OLD.posted_at <= first_at
+                    THEN (SELECT MIN(posted_at) FROM posts WHERE post_type IS OLD.post_type) ELSE first_at END,
+                last_at = CASE WHEN OLD.posted_at >= last_at
+                    THEN (SELECT MAX(posted_at) FROM posts WHERE post_type IS OLD.post_type) ELSE last_at END
+            WHERE name = 'posts:' || COALESCE(OLD.post_type, '');
+        END
+    """)
+
+
+async def _create_post_search_index(conn: aiosqlite.Connection) -> bool:
+    """
+    自分の投稿 (リプライ以外) の全文検索インデックス (FTS5 trigram, 類似投稿の検出用) を作って既存の投稿を入れる
+    本文も FTS 側に持つ (期間外の行を FTS からだけ外せるようにするため。対象は自分の投稿だけなので小さい)
+    :return: 作成できたか (FTS5 の trigram トークナイザがない SQLite 3.34 未満では False)
+    """
+    try:
+        await conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(content, tokenize='trigram')"
+        )
+    except sqlite3.OperationalError as e:
+        logger.warning(f"⚠️  FTS5 (trigram) が使えないため投稿の検索インデックスを作成しません (類似投稿チェック無効): {e}")
+        return False
+
+    await conn.execute("""
+        INSERT INTO posts_fts (rowid, content)
+        SELECT id, content FROM posts
+        WHERE post_type IS NOT 'reply' AND content IS NOT NULL
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts
+        WHEN NEW.post_type IS NOT 'reply' AND NEW.content IS NOT NULL
+        BEGIN
+            INSERT INTO posts_fts (rowid, content) VALUES (NEW.id, NEW.content);
+        END
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts
+        WHEN OLD.post_type IS NOT 'reply'
+        BEGIN
+            DELETE FROM posts_fts WHERE rowid = OLD.id;
+        END
+    """)
+    return True
+
+
+async def _migrate_v6_post_search_index(conn: aiosqlite.Connection):
+    """
+    v6: 投稿の全文検索インデックス
+    trigram が使えない SQLite では作らずに進める (SQLite の更新後、接続時に ensure_post_search_index が作る)
+    """
+    await _create_post_search_index(conn)
+
+
+async def _migrate_v7_follower_sync_staging_per_run(conn: aiosqlite.Connection):
+    """
+    v7: フォロワー同期のステージング表を実行ごとのキー付きに作り直す
+    - bot の整合性スイープと sync_followers.py が同時に動いても、互いの行を消さない
+    - フォロワーとフォロー中を別々の行で持ち、2つの一覧を並行して取り込めるようにする
+    (中身は同期中だけの一時データなので、作り直しで捨ててよい)
+    """
+    await conn.execute("DROP TABLE IF EXISTS follower_sync_staging")
+    await conn.execute("""
+        CREATE TABLE follower_sync_staging (
+            run_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            username TEXT,
+            staged_at INTEGER NOT NULL,
+            PRIMARY KEY (run_id, kind, user_id)
+        )
+    """)
+
+
+# (バージョン, 説明, 関数) — 追加は末尾に。既存のものは変更しないこと
+MIGRATIONS = [
+    (1, "初期スキーマ", _migrate_v1_initial_schema),
+    (2, "タイムスタンプをエポックミリ秒に変換", _migrate_v2_epoch_ms_timestamps),
+    (3, "インデックス追加", _migrate_v3_indexes),
+    (4, "フォロワー同期のステージング表", _migrate_v4_follower_sync_staging),
+    (5, "統計用の集計表とトリガー", _migrate_v5_stats_counters),
+    (6, "投稿の全文検索インデックス", _migrate_v6_post_search_index),
+    (7, "フォロワー同期のステージング表を実行ごとに分離", _migrate_v7_follower_sync_staging_per_run),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    """現在のスキーマバージョン (PRAGMA user_version)"""
+    async with conn.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+
+async def run_migrations(conn: aiosqlite.Connection) -> int:
+    """
+    未適用のマイグレーションを順に実行
+    :param conn: 書き込み用の接続 (未コミットの書き込みがないこと)
+    :return: 実行後のスキーマバージョン
+    """
+    current = await get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"データベースのスキーマ (v{current}) がこのバージョンのbot (v{SCHEMA_VERSION}) より新しいです"
+        )
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info(f"🔧 スキーマ移行: v{version} {description}")
+        await conn.execute("BEGIN")
+        try:
+            await migrate(conn)
+            await conn.execute(f"PRAGMA user_version = {version}")
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            logger.error(f"❌ スキーマ移行失敗: v{version} {description}")
+            raise
+        current = version
+
+    return current
+
+
+async def ensure_post_search_index(conn: aiosqlite.Connection) -> bool:
+    """
+    投稿の全文検索インデックスがなければ作成する (接続のたびに確認)
+    v6 の時点で trigram が使えなかったDBでも、SQLite を更新すればここで作られる
+    :param conn: 書き込み用の接続 (未コミットの書き込みがないこと)
+    :return: インデックスが使えるか
+    """
+    async with conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+    ) as cursor:
+        if await cursor.fetchone() is not None:
+            return True
+
+    await conn.execute("BEGIN")
+    try:
+        created = await _create_post_search_index(conn)
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        raise
+    if created:
+        logger.info("🔧 投稿の全文検索インデックスを作成 (既存の投稿も登録)")
+    return created
+
+
+async def main():
+    """手動実行: 設定のデータベースにマイグレーションを適用"""
+    from config import settings
+
+    print("🔧 データベースマイグレーション開始")
+    async with aiosqlite.connect(settings.database_path) as conn:
+        before = await get_schema_version(conn)
+        after = await run_migrations(conn)
+        await ensure_post_search_index(conn)
+    if before == after:
+        print(f"✅ スキーマは最新です (v{after})")
+    else:
+        print(f"✅ マイグレーション完了: v{before} → v{after}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,98 +1,222 @@
+"""
+Misskey APIクライアント
+aiohttp + 公式API による非同期トランスポート
+(keep-alive セッションを1本共有し、イベントループをブロックしない)
+"""
+
+import asyncio
 import logging
-from misskey import Misskey
+import aiohttp
 from config import settings, bot_config
 
 logger = logging.getLogger(__name__)
 
+
+class MisskeyAPIError(Exception):
+    """Misskey API がエラーレスポンスを返した"""
+    def __init__(self, endpoint: str, status: int, body=None):
+        self.endpoint = endpoint
+        self.status = status
+        self.body = body
+        super().__init__(f"{endpoint}: HTTP {status} {body}")
+
+
 class MisskeyClient:
     def __init__(self):
-        self.client = Misskey(settings.misskey_instance_url, i=settings.misskey_api_token)
+        self.instance_url = settings.misskey_instance_url.rstrip("/")
+        self.api_url = f"{self.instance_url}/api"
+        self.api_token = settings.misskey_api_token
         self.default_visibility = bot_config.get("posting.default_visibility", "home")
         self.bot_user_id = None
-        logger.info(f"Misskey APIクライアント初期化: {settings.misskey_instance_url}")
+
+        # 接続プール・タイムアウト設定
+        self.pool_size = bot_config.get("misskey.pool_size", 10)
+        self.default_timeout = bot_config.get("misskey.timeout_seconds", 30)
+        self.endpoint_timeouts = bot_config.get("misskey.endpoint_timeouts", {}) or {}
+
+        # セッションはイベントループ上で遅延生成する
+        self._session = None
+        self._session_lock = asyncio.Lock()
+
+        logger.info(f"Misskey APIクライアント初期化: {self.instance_url}")
         logger.info(f"デフォルト投稿先: {self.default_visibility}")
-    
+        logger.info(f"接続プール: {self.pool_size}本, タイムアウト: {self.default_timeout}秒")
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """共有 keep-alive セッションを取得 (初回のみ生成)"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    keepalive_timeout=60
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=self.default_timeout)
+                )
+                logger.debug("Misskey HTTPセッション生成")
+        return self._session
+
+    async def request(self, endpoint: str, params: dict = None, timeout: float = None):
+        """
+        Misskey API 呼び出し
+        :param endpoint: エンドポイント名 (例: "notes/create")
+        :param params: リクエストボディ (camelCase)
+        :param timeout: この呼び出しのタイムアウト秒 (省略時は設定値)
+        :return: レスポンスJSON (204 の場合は True)
+        """
+        payload = dict(params or {})
+        payload["i"] = self.api_token
+
+        if timeout is None:
+            timeout = self.endpoint_timeouts.get(endpoint, self.default_timeout)
+
+        session = await self._get_session()
+        async with session.post(
+            f"{self.api_url}/{endpoint}",
+            json=payload,
+            allow_redirects=False,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            if response.status == 204:
+                return True
+
+            try:
+                body = await response.json(content_type=None)
+            except (aiohttp.ContentTypeError, ValueError):
+                body = await response.text()
+
+            if response.status >= 400:
+                raise MisskeyAPIError(endpoint, response.status, body)
+            return body
+
     async def connect(self):
         """Misskey接続確認とユーザー情報取得"""
         try:
-            user_info = self.client.i()
+            user_info = await self.request("i")
             self.bot_user_id = user_info.get("id")
             logger.info(f"Misskey接続成功: @{user_info.get('username', 'unknown')}")
             return user_info
         except Exception as e:
             logger.error(f"Misskey接続エラー: {e}")
             raise
-    
-    async def get_followers(self, limit: int = 100):
-        """フォロワー一覧取得"""
+
+    async def _ensure_bot_user_id(self):
+        """bot自身のユーザーIDを確定させる"""
+        if not self.bot_user_id:
+            user_info = await self.request("i")
+            self.bot_user_id = user_info.get("id")
+        return self.bot_user_id
+
+    async def iter_relation_pages(self, kind: str, page_size: int = 100, until_id: str = None):
+        """
+        フォロワー / フォロー中を untilId カーソルで末尾まで走査する非同期ジェネレータ
+        :param kind: "followers" または "following"
+        :param page_size: 1ページの件数 (Misskey の上限は100)
+        :param until_id: 再開用カーソル (前回yieldされた next_cursor)
+        :return: (ユーザーのリスト, 次ページのカーソル) を1ページごとにyield
+        """
+        if kind == "followers":
+            endpoint, user_key = "users/followers", "follower"
+        elif kind == "following":
+            endpoint, user_key = "users/following", "followee"
+        else:
+            raise ValueError(f"不正なリレーション種別: {kind}")
+
+        await self._ensure_bot_user_id()
+
+        cursor = until_id
+        while True:
+            params = {"userId": self.bot_user_id, "limit": page_size}
+            if cursor:
+                params["untilId"] = cursor
+
+            response = await self.request(endpoint, params)
+            if not isinstance(response, list):
+                raise MisskeyAPIError(endpoint, 200, f"予期しないレスポンス形式: {type(response)}")
+            if not response:
+                return
+
+            users = [
+                item[user_key] for item in response
+                if isinstance(item, dict) and item.get(user_key)
+            ]
+            # カーソルはユーザーIDではなくフォロー関係のID
+            cursor = response[-1].get("id")
+            yield users, cursor
+
+            if len(response) < page_size or not cursor:
+                return
+
+    async def iter_followers(self, page_size: int = 100, until_id: str = None):
+        """フォロワーを1人ずつyield (全ページ)"""
+        async for users, _ in self.iter_relation_pages("followers", page_size, until_id):
+            for user in users:
+                yield user
+
+    async def iter_following(self, page_size: int = 100, until_id: str = None):
+        """フォロー中を1人ずつyield (全ページ)"""
+        async for users, _ in self.iter_relation_pages("following", page_size, until_id):
+            for user in users:
+                yield user
+
+    async def get_followers(self, limit: int = None):
+        """
+        フォロワー一覧取得
+        :param limit: 最大取得人数 (省略時は全件)
+        """
         try:
-            if not self.bot_user_id:
-                user_info = self.client.i()
-                self.bot_user_id = user_info.get("id")
-            
-            response = self.client.users_followers(user_id=self.bot_user_id, limit=limit)
-            
-            if isinstance(response, list):
-                follower_list = []
-                for item in response:
-                    if isinstance(item, dict):
-                        user = item.get("follower")
-                        if user:
-                            follower_list.append(user)
-                
-                logger.debug(f"フォロワー取得: {len(follower_list)}人")
-                return follower_list
-            else:
-                logger.warning(f"予期しないフォロワーレスポンス形式: {type(response)}")
-                return []
+            follower_list = []
+            async for user in self.iter_followers(min(limit or 100, 100)):
+                follower_list.append(user)
+                if limit and len(follower_list) >= limit:
+                    break
+
+            logger.debug(f"フォロワー取得: {len(follower_list)}人")
+            return follower_list
         except Exception as e:
             logger.error(f"フォロワー取得エラー: {e}")
             return []
-    
-    async def get_following(self, limit: int = 100):
-        """フォロー中一覧取得"""
+
+    async def get_following(self, limit: int = None):
+        """
+        フォロー中一覧取得
+        :param limit: 最大取得人数 (省略時は全件)
+        """
         try:
-            if not self.bot_user_id:
-                user_info = self.client.i()
-                self.bot_user_id = user_info.get("id")
-            
-            response = self.client.users_following(user_id=self.bot_user_id, limit=limit)
-            
-            if isinstance(response, list):
-                following_list = []
-                for item in response:
-                    if isinstance(item, dict):
-                        user = item.get("followee")
-                        if user:
-                            following_list.append(user)
-                
-                logger.debug(f"フォロー中取得: {len(following_list)}人")
-                return following_list
-            else:
-                logger.warning(f"予期しないフォロー中レスポンス形式: {type(response)}")
-                return []
+            following_list = []
+            async for user in self.iter_following(min(limit or 100, 100)):
+                following_list.append(user)
+                if limit and len(following_list) >= limit:
+                    break
+
+            logger.debug(f"フォロー中取得: {len(following_list)}人")
+            return following_list
         except Exception as e:
             logger.error(f"フォロー中取得エラー: {e}")
             return []
-    
+
     async def follow_user(self, user_id: str):
         """ユーザーをフォロー"""
         try:
-            self.client.following_create(user_id)
+            await self.request("following/create", {"userId": user_id})
             logger.info(f"フォロー成功: {user_id}")
         except Exception as e:
             logger.error(f"フォローエラー ({user_id}): {e}")
             raise
-    
+
     async def unfollow_user(self, user_id: str):
         """ユーザーのフォローを解除"""
         try:
-            self.client.following_delete(user_id)
+            await self.request("following/delete", {"userId": user_id})
             logger.info(f"フォロー解除成功: {user_id}")
         except Exception as e:
             logger.error(f"フォロー解除エラー ({user_id}): {e}")
             raise
-    
+
     async def send_note(self, text: str, visibility: str = None, reply_id: str = None):
         """ノート投稿"""
         try:
@@ -100,25 +224,25 @@ class MisskeyClient:
                 "text": text,
                 "visibility": visibility or self.default_visibility
             }
-            
+
             if reply_id:
-                params["reply_id"] = reply_id
-            
-            response = self.client.notes_create(**params)
+                params["replyId"] = reply_id
+
+            response = await self.request("notes/create", params)
             logger.info(f"ノート投稿成功: {text[:30]}...")
             return response
         except Exception as e:
             logger.error(f"ノート投稿エラー: {e}")
             raise
-    
+
     async def get_mentions(self, limit: int = 10):
         """メンション取得"""
         try:
-            response = self.client.i_notifications(
-                limit=limit,
-                include_types=["mention", "reply"]
+            response = await self.request(
+                "i/notifications",
+                {"limit": limit, "includeTypes": ["mention", "reply"]}
             )
-            
+
             mentions = []
             if isinstance(response, list):
                 for notification in response:
@@ -128,13 +252,64 @@ class MisskeyClient:
                             note = notification.get("note")
                             if note:
                                 mentions.append(note)
-            
+
             logger.debug(f"メンション取得: {len(mentions)}件")
             return mentions
         except Exception as e:
             logger.error(f"メンション取得エラー: {e}")
             return []
-    
+
+    async def fetch_mention_notifications(self, since_id: str = None, page_size: int = 100):
+        """
+        sinceId より新しいメンション・リプライ通知を全件取得
+        新しい順に返ってくるページを untilId で遡り、最後に古い順へ並べ替える
+        :param since_id: この通知IDより新しいものを取得 (省略時は最新1ページのみ)
+        :return: 通知のリスト (古い順)
+        """
+        notifications = {}
+        until_id = None
+        while True:
+            params = {"limit": page_size, "includeTypes": ["mention", "reply"]}
+            if since_id:
+                params["sinceId"] = since_id
+            if until_id:
+                params["untilId"] = until_id
+
+            response = await self.request("i/notifications", params)
+            if not isinstance(response, list):
+                raise MisskeyAPIError("i/notifications", 200, f"予期しないレスポンス形式: {type(response)}")
+
+            page = [n for n in response if isinstance(n, dict) and n.get("id")]
+            for notification in page:
+                notifications[notification["id"]] = notification
+
+            if not since_id or len(response) < page_size or not page:
+                break
+            until_id = min(n["id"] for n in page)
+
+        result = sorted(notifications.values(), key=lambda n: n["id"])
+        logger.debug(f"メンション通知取得: {len(result)}件 (sinceId={since_id})")
+        return result
+
+    async def get_timeline(self, source: str = "home", limit: int = 20):
+        """
+        タイムライン取得
+        :param source: home / local / global
+        :param limit: 取得件数
+        """
+        endpoints = {
+            "home": "notes/timeline",
+            "local": "notes/local-timeline",
+            "global": "notes/global-timeline",
+        }
+        endpoint = endpoints.get(source)
+        if endpoint is None:
+            raise ValueError(f"不正なタイムラインソース: {source}")
+
+        return await self.request(endpoint, {"limit": limit})
+
     async def close(self):
         """クライアント終了処理"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
         logger.debug("Misskey クライアント終了")
@@ -1,82 +1,208 @@
 """
 NGワード管理モジュール
 config.yaml と 外部URLからNGワードを読み込む
+- 外部リストはディスクにキャッシュし、起動時はキャッシュから即座に読み込む (オフラインでも動作)
+- 更新はバックグラウンドで ETag / Last-Modified による条件付きGETを並行実行
+- 更新後は照合オートマトンを作り直して一括で差し替える
 """
 
+import asyncio
+import hashlib
+import json
 import logging
-import aiohttp
+import os
+from datetime import datetime
+from pathlib import Path
 from typing import List, Set
+
+import aiohttp
+
 from config import bot_config
+from keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
 class NGWordManager:
     def __init__(self):
         """NGワードマネージャー初期化"""
+        self.external_urls: List[str] = bot_config.get("posting.timeline_post.ng_word_urls", []) or []
+        self.cache_dir = Path(bot_config.get("posting.timeline_post.ng_word_cache_dir", "data/ng_words"))
+        self.index_path = self.cache_dir / "index.json"
+
         self.ng_words: Set[str] = set()
+        self.matcher = KeywordMatcher()
+        self._refresh_task = None
         self._load_ng_words()
-    
+
+    def _swap(self, ng_words: Set[str]):
+        """NGワード集合と照合オートマトンをまとめて差し替える"""
+        matcher = KeywordMatcher(ng_words)
+        # 参照の代入だけなので、照合中の呼び出しから見ても常に整合した組になる
+        self.ng_words, self.matcher = ng_words, matcher
+        logger.debug(f"NGワード照合器を構築: {len(matcher)}件 (正規化後)")
+
     def _load_ng_words(self):
-        """NGワードを読み込み（config.yaml + 外部URL）"""
+        """NGワードを読み込み（config.yaml + 外部リストのディスクキャッシュ）"""
         # config.yaml から読み込み
-        config_ng_words = bot_config.get("posting.timeline_post.ng_words", [])
-        self.ng_words.update(config_ng_words)
+        config_ng_words = bot_config.get("posting.timeline_post.ng_words", []) or []
         logger.info(f"📋 config.yaml から NGワード読み込み: {len(config_ng_words)}件")
-        
-        # 外部URLリストを取得
-        external_urls = bot_config.get("posting.timeline_post.ng_word_urls", [])
-        if external_urls:
-            logger.info(f"🌐 外部NGワードリスト: {len(external_urls)}個のURL")
-    
-    async def load_external_ng_words(self):
-        """外部URLからNGワードを非同期で読み込み"""
-        external_urls = bot_config.get("posting.timeline_post.ng_word_urls", [])
-        
-        if not external_urls:
-            logger.info("外部NGワードURLが設定されていません")
-            return
-        
-        for url in external_urls:
+
+        # 外部URLリストはキャッシュから読み込み (ネットワークは使わない)
+        if self.external_urls:
+            logger.info(f"🌐 外部NGワードリスト: {len(self.external_urls)}個のURL")
+
+        self._swap(self._collect_words(self._read_index()))
+        logger.info(f"📊 NGワード総数: {len(self.ng_words)}件 (キャッシュから読み込み)")
+
+    # ----- ディスクキャッシュ -----
+    def _cache_file(self, url: str) -> Path:
+        """URLごとのキャッシュファイル"""
+        return self.cache_dir / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}.txt"
+
+    def _read_index(self) -> dict:
+        """キャッシュのインデックス (URL → ETag / Last-Modified / 取得日時)"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"NGワードキャッシュのインデックス読み込みエラー: {e}")
+            return {}
+
+    def _write_atomic(self, path: Path, content: str):
+        """一時ファイルに書いてから置き換える (途中で落ちても壊れたファイルを残さない)"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _collect_words(self, index: dict) -> Set[str]:
+        """config.yaml のNGワードとキャッシュ済み外部リストを合わせた集合"""
+        words = set(bot_config.get("posting.timeline_post.ng_words", []) or [])
+        for url in self.external_urls:
+            if url not in index:
+                continue
             try:
-                logger.info(f"🌐 外部NGワードリスト取得中: {url}")
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                        if response.status == 200:
-                            content = await response.text()
-                            # 改行区切りでNGワードを取得
-                            words = [line.strip() for line in content.splitlines() if line.strip()]
-                            
-                            # 空行やコメント行を除外
-                            words = [w for w in words if w and not w.startswith('#')]
-                            
-                            before_count = len(self.ng_words)
-                            self.ng_words.update(words)
-                            after_count = len(self.ng_words)
-                            added_count = after_count - before_count
-                            
-                            logger.info(f"✅ 外部NGワード追加: {added_count}件 (合計: {after_count}件)")
-                        else:
-                            logger.warning(f"外部NGワードリスト取得失敗: HTTP {response.status}")
-            
-            except asyncio.TimeoutError:
-                logger.error(f"外部NGワードリスト取得タイムアウト: {url}")
+                content = self._cache_file(url).read_text(encoding="utf-8")
             except Exception as e:
-                logger.error(f"外部NGワードリスト取得エラー: {url} - {e}")
-        
-        logger.info(f"📊 NGワード総数: {len(self.ng_words)}件")
-    
+                logger.warning(f"NGワードキャッシュ読み込みエラー: {url} - {e}")
+                continue
+            words.update(self._parse(content))
+        return words
+
+    @staticmethod
+    def _parse(content: str) -> List[str]:
+        """改行区切りのリストからNGワードを取り出す (空行・コメント行は除外)"""
+        return [
+            line.strip() for line in content.splitlines()
+            if line.strip() and not line.strip().startswith('#')
+        ]
+
+    # ----- バックグラウンド更新 -----
+    def start_background_refresh(self):
+        """外部リストの更新をバックグラウンドで開始 (起動を待たせない)"""
+        if not self.external_urls:
+            return
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self.refresh_external_ng_words())
+
+    async def close(self):
+        """バックグラウンド更新を停止 (取り消して終わるのを待つ。キャッシュは一時ファイル経由で置き換えるので壊れない)"""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+        self._refresh_task = None
+
+    async def refresh_external_ng_words(self):
+        """外部URLからNGワードを条件付きGETで並行取得し、変更があれば差し替える"""
+        if not self.external_urls:
+            logger.info("外部NGワードURLが設定されていません")
+            return
+
+        index = self._read_index()
+        timeout = aiohttp.ClientTimeout(total=bot_config.get("posting.timeline_post.ng_word_timeout_seconds", 10))
+
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            results = await asyncio.gather(
+                *(self._fetch(session, url, index.get(url)) for url in self.external_urls)
+            )
+
+        changed = False
+        for url, entry in zip(self.external_urls, results):
+            if entry is None:
+                continue
+            content, meta = entry
+            if content is not None:
+                await asyncio.to_thread(self._write_atomic, self._cache_file(url), content)
+                changed = True
+            index[url] = meta
+
+        await asyncio.to_thread(
+            self._write_atomic, self.index_path, json.dumps(index, ensure_ascii=False, indent=2)
+        )
+
+        if changed:
+            ng_words = await asyncio.to_thread(self._collect_words, index)
+            before_count = len(self.ng_words)
+            await asyncio.to_thread(self._swap, ng_words)
+            logger.info(f"✅ 外部NGワード更新: {before_count}件 → {len(self.ng_words)}件")
+        else:
+            logger.info(f"📊 外部NGワード: 変更なし (合計: {len(self.ng_words)}件)")
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str, meta: dict):
+        """
+        1つのURLを条件付きGETで取得
+        :return: (本文 または 変更なしなら None, 新しいメタ情報)、失敗時は None
+        """
+        meta = dict(meta or {})
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            logger.info(f"🌐 外部NGワードリスト確認中: {url}")
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    logger.debug(f"外部NGワードリスト変更なし (304): {url}")
+                    meta["checked_at"] = datetime.now().isoformat()
+                    return None, meta
+
+                if response.status != 200:
+                    logger.warning(f"外部NGワードリスト取得失敗: HTTP {response.status} ({url})")
+                    return None
+
+                content = await response.text()
+                meta.update({
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "fetched_at": datetime.now().isoformat(),
+                    "checked_at": datetime.now().isoformat(),
+                })
+                logger.info(f"✅ 外部NGワードリスト取得: {len(self._parse(content))}件 ({url})")
+                return content, meta
+
+        except asyncio.TimeoutError:
+            logger.error(f"外部NGワードリスト取得タイムアウト: {url}")
+        except Exception as e:
+            logger.error(f"外部NGワードリスト取得エラー: {url} - {e}")
+        return None
+
     def contains_ng_word(self, text: str) -> bool:
         """
         テキストにNGワードが含まれているかチェック
         :param text: チェック対象テキスト
         :return: NGワードが含まれていたら True
         """
-        text_lower = text.lower()
-        for ng_word in self.ng_words:
-            if ng_word.lower() in text_lower:
-                return True
-        return False
-    
+        return self.matcher.contains_any(text)
+
     def get_ng_word_count(self) -> int:
         """NGワードの総数を取得"""
         return len(self.ng_words)
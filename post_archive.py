@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+投稿履歴アーカイブモジュール
+保持期間を過ぎた posts の行を、月ごとの圧縮 JSONL ファイルに追記してからDBから削除する
+- ファイルは追記のみ (gzip / zstd とも、追記ごとに独立したフレームを足していく)
+- index.json に月ごとの件数・期間を記録し、検索時は対象期間のファイルだけを読む
+- 検索はファイルを展開せずにストリームで1行ずつ読む
+- zstd は zstandard パッケージがある場合のみ (なければ gzip)
+
+検索コマンド:
+  python post_archive.py list
+  python post_archive.py query [--since 2025-01-01] [--until 2025-02-01] [--type random] [--grep 文字列] [--limit N]
+"""
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from compression import resolve_codec, zstandard
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+
+class PostArchive:
+    def __init__(self, archive_dir: str = "data/archive", codec: str = "auto", level: int = None):
+        """
+        :param archive_dir: アーカイブの保存先
+        :param codec: "gzip" / "zstd" / "auto" (zstandard があれば zstd)
+        :param level: 圧縮レベル (省略時は gzip 6, zstd 10)
+        """
+        self.archive_dir = Path(archive_dir)
+        self.index_path = self.archive_dir / "index.json"
+        self.codec, self.level = resolve_codec(codec, level)
+
+    # ----- インデックス -----
+    def read_index(self) -> dict:
+        """アーカイブのインデックス (ファイル名 → 月・形式・件数・期間)"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"last_batch_ids": [], "files": {}}
+
+    def _write_index(self, index: dict):
+        """一時ファイルに書いてから置き換える"""
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    # ----- 書き込み -----
+    def append(self, rows: List[tuple]) -> int:
+        """
+        投稿履歴の行を月ごとのファイルに追記 (ワーカースレッドから呼ぶ)
+        :param rows: [(id, note_id, post_type, content, posted_at), ...] (id 昇順)
+        :return: 追記した件数 (前回追記したのにDBから削除される前に落ちた行は飛ばす)
+        """
+        index = self.read_index()
+        # 重複しうるのは「追記後、DBから削除する前に落ちた」直前の1回分だけ
+        # (期限切れは posted_at で選ぶので id の大小では判定できない)
+        last_batch_ids = set(index.get("last_batch_ids", []))
+        batch_ids = [row[0] for row in rows]
+        rows = [row for row in rows if row[0] not in last_batch_ids]
+        if not rows:
+            return 0
+
+        # 月ごとにまとめる (posted_at はエポックミリ秒、月の区切りはローカル時刻)
+        by_month = {}
+        for row in rows:
+            month = datetime.fromtimestamp(row[4] / 1000).strftime("%Y-%m")
+            by_month.setdefault(month, []).append(row)
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        files = index.setdefault("files", {})
+        for month, month_rows in by_month.items():
+            filename = f"posts_{month}{EXTENSIONS[self.codec]}"
+            payload = "".join(
+                json.dumps({
+                    "id": row[0],
+                    "note_id": row[1],
+                    "post_type": row[2],
+                    "content": row[3],
+                    "posted_at": row[4],
+                }, ensure_ascii=False) + "\n"
+                for row in month_rows
+            ).encode("utf-8")
+            self._append_frame(self.archive_dir / filename, payload)
+
+            entry = files.setdefault(filename, {
+                "month": month, "codec": self.codec, "rows": 0,
+                "first_posted_at": month_rows[0][4], "last_posted_at": month_rows[0][4],
+            })
+            entry["rows"] += len(month_rows)
+            entry["first_posted_at"] = min(entry["first_posted_at"], min(row[4] for row in month_rows))
+            entry["last_posted_at"] = max(entry["last_posted_at"], max(row[4] for row in month_rows))
+
+        # DBから削除する前に記録する (削除前に落ちても、次回は同じ行を重複して追記しない)
+        index["last_batch_ids"] = batch_ids
+        index.pop("last_archived_id", None)
+        self._write_index(index)
+        return len(rows)
+
+    def _append_frame(self, path: Path, payload: bytes):
+        """圧縮フレームを1つファイル末尾に追記"""
+        with open(path, "ab") as raw:
+            if self.codec == "zstd":
+                compressor = zstandard.ZstdCompressor(level=self.level)
+                raw.write(compressor.compress(payload))
+            else:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.level) as f:
+                    f.write(payload)
+            raw.flush()
+            os.fsync(raw.fileno())
+
+    # ----- 読み出し -----
+    def _open_lines(self, path: Path, codec: str):
+        """圧縮ファイルを展開せずにテキストとして1行ずつ読むストリーム"""
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError(f"zstd のアーカイブを読むには zstandard が必要です: {path}")
+            raw = open(path, "rb")
+            reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+            return io.TextIOWrapper(reader, encoding="utf-8")
+        return gzip.open(path, "rt", encoding="utf-8")
+
+    def iter_posts(self, since: Optional[int] = None, until: Optional[int] = None,
+                   post_type: Optional[str] = None, contains: Optional[str] = None) -> Iterator[dict]:
+        """
+        アーカイブ済みの投稿を古い順にストリームで返す
+        :param since: この時刻 (エポックミリ秒) 以降
+        :param until: この時刻 (エポックミリ秒) より前
+        :param post_type: 投稿種別で絞り込み
+        :param contains: 本文に含まれる文字列で絞り込み
+        """
+        files = self.read_index().get("files", {})
+        for filename, entry in sorted(files.items(), key=lambda item: item[1]["first_posted_at"]):
+            # インデックスの期間で対象外のファイルは開かない
+            if since is not None and entry["last_posted_at"] < since:
+                continue
+            if until is not None and entry["first_posted_at"] >= until:
+                continue
+
+            path = self.archive_dir / filename
+            if not path.exists():
+                logger.warning(f"アーカイブファイルが見つかりません: {path}")
+                continue
+
+            with self._open_lines(path, entry.get("codec", "gzip")) as lines:
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    post = json.loads(line)
+                    if since is not None and post["posted_at"] < since:
+                        continue
+                    if until is not None and post["posted_at"] >= until:
+                        continue
+                    if post_type and post["post_type"] != post_type:
+                        continue
+                    if contains and contains not in (post["content"] or ""):
+                        continue
+                    yield post
+
+
+def _parse_date(value: str) -> int:
+    """YYYY-MM または YYYY-MM-DD[THH:MM] をエポックミリ秒に"""
+    if len(value) == 7:
+        value += "-01"
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def main():
+    """検索コマンド"""
+    from config import bot_config
+
+    parser = argparse.ArgumentParser(description="投稿履歴アーカイブの一覧・検索")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="アーカイブファイルの一覧")
+    query = subparsers.add_parser("query", help="アーカイブを検索して JSONL で出力")
+    query.add_argument("--since", help="この日時以降 (YYYY-MM / YYYY-MM-DD)")
+    query.add_argument("--until", help="この日時より前 (YYYY-MM / YYYY-MM-DD)")
+    query.add_argument("--type", dest="post_type", help="投稿種別 (random / reply / timeline / scheduled ...)")
+    query.add_argument("--grep", help="本文に含まれる文字列")
+    query.add_argument("--limit", type=int, help="最大件数")
+    args = parser.parse_args()
+
+    archive = PostArchive(bot_config.get("maintenance.archive.dir", "data/archive"))
+
+    if args.command == "list":
+        index = archive.read_index()
+        total = 0
+        for filename, entry in sorted(index.get("files", {}).items()):
+            size_kb = (archive.archive_dir / filename).stat().st_size / 1024
+            first = datetime.fromtimestamp(entry["first_posted_at"] / 1000).isoformat(timespec="seconds")
+            last = datetime.fromtimestamp(entry["last_posted_at"] / 1000).isoformat(timespec="seconds")
+            print(f"{filename}: {entry['rows']}件 {size_kb:.1f}KB ({first} 〜 {last})")
+            total += entry["rows"]
+        print(f"合計: {total}件")
+        return
+
+    posts = archive.iter_posts(
+        since=_parse_date(args.since) if args.since else None,
+        until=_parse_date(args.until) if args.until else None,
+        post_type=args.post_type,
+        contains=args.grep,
+    )
+    for count, post in enumerate(posts):
+        if args.limit is not None and count >= args.limit:
+            break
+        post["posted_at"] = datetime.fromtimestamp(post["posted_at"] / 1000).isoformat()
+        sys.stdout.write(json.dumps(post, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
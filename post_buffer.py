@@ -0,0 +1,124 @@
+"""
+投稿バッファモジュール
+ランダム投稿・タイムライン連動投稿の文面を事前生成して SQLite に貯めておく
+- 投稿時はバッファから取り出すだけ (Gemini の遅延・エラーで投稿枠を落とさない)
+- 残数が下限を下回ったら、アイドル時に上限まで補充
+- 生成から一定時間経った文面は破棄
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from database import Database, epoch_ms
+from config import bot_config
+
+logger = logging.getLogger(__name__)
+
+
+class PostBuffer:
+    def __init__(self, db: Database, is_idle=None):
+        """
+        :param db: データベース
+        :param is_idle: アイドル判定関数 (True を返す間だけ補充する、省略時は常にアイドル扱い)
+        """
+        self.db = db
+        self.is_idle = is_idle or (lambda: True)
+        self.enabled = bot_config.get("posting.post_buffer.enabled", True)
+        self.check_interval = bot_config.get("posting.post_buffer.check_interval_seconds", 300)
+
+        # 投稿種別ごとの生成関数と補充設定
+        self._generators = {}
+        self._task = None
+
+    def register(self, post_type: str, generator):
+        """
+        投稿種別を登録
+        :param post_type: 投稿種別 (random / timeline)
+        :param generator: 文面を返す async 関数 (失敗時は None)
+        """
+        self._generators[post_type] = {
+            'generator': generator,
+            'low': bot_config.get(f"posting.post_buffer.{post_type}.low_watermark", 2),
+            'high': bot_config.get(f"posting.post_buffer.{post_type}.high_watermark", 5),
+            'max_age': timedelta(hours=bot_config.get(f"posting.post_buffer.{post_type}.max_age_hours", 24)),
+        }
+        logger.debug(f"投稿バッファ登録: {post_type}")
+
+    async def start(self):
+        """補充ループ開始"""
+        if not self.enabled or not self._generators or self._task:
+            return
+
+        self._task = asyncio.create_task(self._refill_loop())
+        types_str = ", ".join(
+            f"{t}({g['low']}〜{g['high']}件)" for t, g in self._generators.items()
+        )
+        logger.info(f"✅ 投稿バッファ: {types_str}, {self.check_interval}秒ごとに確認")
+
+    async def stop(self):
+        """補充ループ停止"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def take(self, post_type: str):
+        """
+        バッファから文面を1件取り出す
+        :return: 文面 (空・無効時は None)
+        """
+        if not self.enabled or post_type not in self._generators:
+            return None
+
+        cutoff = datetime.now() - self._generators[post_type]['max_age']
+        content = await self.db.pop_buffered_post(post_type, epoch_ms(cutoff))
+        if content is None:
+            logger.info(f"📭 投稿バッファが空: {post_type}")
+        else:
+            logger.debug(f"📬 投稿バッファから取り出し: {post_type}")
+        return content
+
+    async def _refill_loop(self):
+        """定期的に残数を確認して補充"""
+        while True:
+            try:
+                await self.refill()
+            except Exception as e:
+                logger.error(f"投稿バッファ補充エラー: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    async def refill(self):
+        """全種別について、期限切れを破棄し、下限を下回っていれば上限まで補充"""
+        for post_type, spec in self._generators.items():
+            cutoff = datetime.now() - spec['max_age']
+            expired = await self.db.delete_expired_buffered_posts(post_type, epoch_ms(cutoff))
+            if expired:
+                logger.info(f"🗑️  投稿バッファ期限切れ破棄: {post_type} {expired}件")
+
+            # 件数は読み取り専用接続で数えるので、直前の削除をコミットしてから
+            await self.db.flush()
+            count = await self.db.count_buffered_posts(post_type)
+            if count >= spec['low']:
+                continue
+
+            added = 0
+            while count < spec['high']:
+                if not self.is_idle():
+                    logger.debug("投稿バッファ補充: ビジーのため中断")
+                    return
+
+                content = await spec['generator']()
+                if not content:
+                    logger.warning(f"投稿バッファ補充: 生成失敗 ({post_type})")
+                    break
+
+                await self.db.add_buffered_post(post_type, content)
+                count += 1
+                added += 1
+
+            if added:
+                logger.info(f"📦 投稿バッファ補充: {post_type} +{added}件 (残{count}件)")
@@ -14,15 +14,23 @@ from config import bot_config
 logger = logging.getLogger(__name__)
 
 class PostManager:
-    def __init__(self, misskey: MisskeyClient, gemini: GeminiClient, db: Database):
+    def __init__(self, misskey: MisskeyClient, gemini: GeminiClient, db: Database, post_buffer=None,
+                 duplicate_checker=None):
         """
         :param misskey: Misskeyクライアント
         :param gemini: Geminiクライアント
         :param db: データベース
+        :param post_buffer: PostBufferインスタンス (オプション、指定時は事前生成した文面を使う)
+        :param duplicate_checker: DuplicateCheckerインスタンス (オプション、指定時は類似投稿を作り直す)
         """
         self.misskey = misskey
         self.gemini = gemini
         self.db = db
+        self.post_buffer = post_buffer
+        self.duplicate_checker = duplicate_checker
+        
+        if self.post_buffer and bot_config.get("posting.random_post.enabled", True):
+            self.post_buffer.register("random", self.gemini.generate_random_post)
         
         # 夜間モード設定
         self.night_mode_enabled = bot_config.get("posting.night_mode.enabled", True)
@@ -53,11 +61,24 @@ class PostManager:
             return
         
         try:
-            # Geminiでランダム投稿生成
-            content = await self.gemini.generate_random_post()
-            
-            if content is None:
-                logger.warning("⏸️  Gemini APIエラー: 投稿スキップ")
+            # 直近の投稿とほぼ同じ文面なら、捨てて取り直す (最大 max_retries 回)
+            attempts = 1 + (self.duplicate_checker.max_retries if self.duplicate_checker else 0)
+            for _ in range(attempts):
+                # 事前生成バッファから取り出し (空ならその場でGeminiで生成)
+                content = None
+                if self.post_buffer:
+                    content = await self.post_buffer.take("random")
+                if content is None:
+                    content = await self.gemini.generate_random_post()
+                
+                if content is None:
+                    logger.warning("⏸️  Gemini APIエラー: 投稿スキップ")
+                    return
+                
+                if not self.duplicate_checker or not await self.duplicate_checker.is_duplicate(content, "random"):
+                    break
+            else:
+                logger.warning("🔁 類似投稿が続いたため投稿スキップ")
                 return
             
             # Misskeyに投稿
@@ -0,0 +1,211 @@
+"""
+キャラクタープロンプトのコンテキストキャッシュ管理モジュール
+katariina_prompt.md を Gemini のキャッシュ (CachedContent) として1回だけアップロードし、
+毎回の呼び出しでは cached_content 名だけを送る
+- 期限切れ前に TTL を延長
+- プロンプトファイルが変わったらキャッシュを作り直す
+- キャッシュが使えない場合は system_instruction (インライン) にフォールバック
+- 作成に失敗したら間隔を倍々に空けて再試行 (プロンプトが小さすぎてキャッシュできない場合は、ファイルが変わるまで再試行しない)
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from google.genai import errors, types
+
+from config import bot_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT = "あなたは親しみやすいキャラクターです。"
+
+
+class PromptCacheManager:
+    def __init__(self, client, model_name: str):
+        """
+        :param client: google.genai.Client
+        :param model_name: キャッシュを紐付けるモデル名
+        """
+        self.client = client
+        self.model_name = model_name
+        self.prompt_path = Path(bot_config.get("character_prompt_file", "katariina_prompt.md"))
+
+        self.enabled = bot_config.get("gemini.context_cache.enabled", True)
+        self.ttl_seconds = bot_config.get("gemini.context_cache.ttl_seconds", 3600)
+        self.refresh_margin = bot_config.get("gemini.context_cache.refresh_margin_seconds", 600)
+        self.check_interval = bot_config.get("gemini.context_cache.check_interval_seconds", 300)
+        self.max_retry_interval = bot_config.get("gemini.context_cache.max_retry_interval_seconds", 3600)
+
+        self.prompt = DEFAULT_PROMPT
+        self._prompt_hash = None
+        self.cache_name = None
+        self._expire_time = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+        # 作成失敗時の再試行 (連続失敗回数・次に試す時刻・キャッシュできないと分かったプロンプト)
+        self._create_failures = 0
+        self._retry_at = 0.0
+        self._uncacheable_hash = None
+
+        self._load_prompt()
+
+    def _load_prompt(self) -> bool:
+        """
+        キャラクタープロンプトをファイルから読み込み
+        :return: 内容が変わっていたら True
+        """
+        try:
+            prompt = self.prompt_path.read_text(encoding="utf-8")
+            logger.debug("キャラクタープロンプト読み込み成功")
+        except Exception as e:
+            logger.error(f"キャラクタープロンプト読み込みエラー: {e}")
+            return False
+
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if prompt_hash == self._prompt_hash:
+            return False
+
+        self.prompt = prompt
+        self._prompt_hash = prompt_hash
+        return True
+
+    async def start(self):
+        """キャッシュ作成と定期メンテナンス開始"""
+        if not self.enabled:
+            logger.info("⏸️  コンテキストキャッシュ: 無効 (インラインプロンプト)")
+            return
+
+        await self._create_cache()
+        self._task = asyncio.create_task(self._maintain_loop())
+
+    async def close(self):
+        """定期メンテナンス停止・キャッシュ削除"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self._delete_cache(self.cache_name)
+        self.cache_name = None
+
+    def invalidate(self):
+        """呼び出し時にキャッシュが見つからなかった → 次回メンテナンスまでインラインで送る"""
+        if self.cache_name:
+            logger.warning(f"⚠️ コンテキストキャッシュ無効化: {self.cache_name}")
+        self.cache_name = None
+        self._expire_time = None
+
+    def apply(self, **config_kwargs) -> types.GenerateContentConfig:
+        """
+        キャッシュ (またはインラインプロンプト) を設定した GenerateContentConfig を作る
+        :param config_kwargs: temperature などその他の設定
+        """
+        if self.cache_name:
+            return types.GenerateContentConfig(cached_content=self.cache_name, **config_kwargs)
+        return types.GenerateContentConfig(system_instruction=self.prompt, **config_kwargs)
+
+    async def _create_cache(self):
+        """現在のプロンプトでキャッシュを作成 (古いキャッシュは削除)"""
+        async with self._lock:
+            old_name = self.cache_name
+            try:
+                cache = await self.client.aio.caches.create(
+                    model=self.model_name,
+                    config=types.CreateCachedContentConfig(
+                        display_name="riina-character-prompt",
+                        system_instruction=self.prompt,
+                        ttl=f"{self.ttl_seconds}s"
+                    )
+                )
+                self.cache_name = cache.name
+                self._expire_time = cache.expire_time
+                self._create_failures = 0
+                logger.info(f"✅ コンテキストキャッシュ作成: {cache.name} (TTL {self.ttl_seconds}秒)")
+            except Exception as e:
+                self.cache_name = None
+                self._expire_time = None
+                self._on_create_failed(e)
+
+            if old_name and old_name != self.cache_name:
+                await self._delete_cache(old_name)
+
+    def _on_create_failed(self, error: Exception):
+        """キャッシュ作成失敗: 小さすぎるプロンプトは諦め、それ以外は間隔を倍々に空けて再試行"""
+        if isinstance(error, errors.ClientError) and error.code == 400 and "too small" in str(error.message):
+            self._uncacheable_hash = self._prompt_hash
+            logger.warning(
+                f"⚠️ キャラクタープロンプトがキャッシュできる最小サイズ未満のため、"
+                f"ファイルが変わるまでインラインプロンプトで送ります: {error.message}"
+            )
+            return
+
+        delay = min(self.check_interval * 2 ** self._create_failures, self.max_retry_interval)
+        self._create_failures += 1
+        self._retry_at = time.monotonic() + delay
+        logger.warning(f"⚠️ コンテキストキャッシュ作成失敗 (インラインプロンプトで続行、{delay:.0f}秒後に再試行): {error}")
+
+    def _should_create(self) -> bool:
+        """キャッシュがなく、作成を試してよいか (キャッシュできないプロンプト・再試行待ちでない)"""
+        return (
+            self.cache_name is None
+            and self._prompt_hash != self._uncacheable_hash
+            and time.monotonic() >= self._retry_at
+        )
+
+    async def _refresh_ttl(self):
+        """キャッシュの TTL を延長"""
+        async with self._lock:
+            try:
+                cache = await self.client.aio.caches.update(
+                    name=self.cache_name,
+                    config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+                )
+                self._expire_time = cache.expire_time
+                logger.debug(f"コンテキストキャッシュTTL延長: {self.cache_name}")
+            except Exception as e:
+                logger.warning(f"⚠️ コンテキストキャッシュTTL延長失敗: {e}")
+                self.cache_name = None
+                self._expire_time = None
+
+    async def _delete_cache(self, name: str):
+        """キャッシュ削除 (失敗しても TTL で自然に消えるので無視)"""
+        if not name:
+            return
+        try:
+            await self.client.aio.caches.delete(name=name)
+            logger.debug(f"コンテキストキャッシュ削除: {name}")
+        except Exception as e:
+            logger.debug(f"コンテキストキャッシュ削除失敗: {name} - {e}")
+
+    async def _maintain_loop(self):
+        """プロンプト変更の検出・TTL延長・失効したキャッシュの再作成"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                if self._load_prompt():
+                    logger.info("📝 キャラクタープロンプトの変更を検出: キャッシュを再作成")
+                    self._create_failures = 0
+                    self._retry_at = 0.0
+                    await self._create_cache()
+                elif self.cache_name is None:
+                    if self._should_create():
+                        await self._create_cache()
+                elif self._expires_within(self.refresh_margin + self.check_interval):
+                    await self._refresh_ttl()
+            except Exception as e:
+                logger.error(f"コンテキストキャッシュ管理エラー: {e}")
+
+    def _expires_within(self, seconds: float) -> bool:
+        """キャッシュが指定秒数以内に失効するか"""
+        if self._expire_time is None:
+            return True
+        remaining = (self._expire_time - datetime.now(timezone.utc)).total_seconds()
+        return remaining <= seconds
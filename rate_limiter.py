@@ -1,41 +1,126 @@
 """
 リプライレート制限モジュール
 1時間あたりのリプライ回数を制限
+- ユーザーごとの直近リプライ時刻をメモリ上のリングバッファで管理 (判定・記録でDBを使わない)
+- 1時間以上リプライのないユーザーは自動で破棄
+- 定期的にSQLiteへスナップショットを保存し、起動時に復元
 """
 
 import logging
-from database import Database
+import time
+from collections import deque
+from typing import Dict
+
+from database import Database, epoch_ms
 
 logger = logging.getLogger(__name__)
 
 class RateLimiter:
-    def __init__(self, db: Database, max_per_user_per_hour: int = 3):
+    def __init__(self, db: Database, max_per_user_per_hour: int = 3, window_seconds: int = 3600):
         """
-        :param db: データベースインスタンス
+        :param db: データベースインスタンス (スナップショットの保存先)
         :param max_per_user_per_hour: 1ユーザーあたり1時間の最大リプライ数
+        :param window_seconds: スライディングウィンドウの幅 (秒)
         """
         self.db = db
         self.max_per_hour = max_per_user_per_hour
-    
+        self.window = window_seconds
+
+        # ユーザーID → 直近のリプライ時刻 (エポック秒, 古い順, 最大 max_per_hour 件)
+        self._history: Dict[str, deque] = {}
+        self._dirty = False
+
+    def _recent(self, user_id: str, now: float):
+        """
+        ウィンドウ内のリプライ時刻を返す (期限切れは捨て、空になったユーザーは破棄)
+        :return: deque または None
+        """
+        history = self._history.get(user_id)
+        if history is None:
+            return None
+
+        cutoff = now - self.window
+        while history and history[0] < cutoff:
+            history.popleft()
+        if not history:
+            del self._history[user_id]
+            return None
+        return history
+
     async def check_rate_limit(self, user_id: str) -> bool:
         """
         レート制限チェック
         :param user_id: ユーザーID
         :return: リプライ可能ならTrue
         """
-        count = await self.db.get_rate_limit_count(user_id, hours=1)
-        
+        history = self._recent(user_id, time.time())
+        count = len(history) if history else 0
+
         if count >= self.max_per_hour:
             logger.warning(f"⏱️  レート制限超過: @{user_id} ({count}/{self.max_per_hour})")
             return False
-        
+
         logger.debug(f"✅ レート制限OK: @{user_id} ({count}/{self.max_per_hour})")
         return True
-    
+
     async def record_reply(self, user_id: str):
         """
         リプライを記録
         :param user_id: ユーザーID
         """
-        await self.db.record_reply(user_id)
+        history = self._history.get(user_id)
+        if history is None:
+            # 判定に必要なのは直近 max_per_hour 件だけなので、それより古いものは押し出される
+            history = self._history[user_id] = deque(maxlen=max(self.max_per_hour, 1))
+        history.append(time.time())
+        self._dirty = True
         logger.debug(f"📝 リプライ記録: @{user_id}")
+
+    def expire_idle_users(self) -> int:
+        """
+        ウィンドウ内にリプライのないユーザーを破棄
+        :return: 破棄したユーザー数
+        """
+        now = time.time()
+        before = len(self._history)
+        for user_id in list(self._history):
+            self._recent(user_id, now)
+        return before - len(self._history)
+
+    async def restore(self):
+        """起動時: SQLite のスナップショットからウィンドウ内の記録を復元"""
+        since = epoch_ms() - self.window * 1000
+        rows = await self.db.load_rate_limits(since)
+
+        self._history = {}
+        for user_id, replied_at in rows:
+            history = self._history.get(user_id)
+            if history is None:
+                history = self._history[user_id] = deque(maxlen=max(self.max_per_hour, 1))
+            history.append(replied_at / 1000)
+        self._dirty = False
+        logger.info(f"✅ レート制限を復元: {len(self._history)}人 ({len(rows)}件)")
+
+    async def snapshot(self):
+        """現在のウィンドウを SQLite に保存 (変更がなければ何もしない)"""
+        expired = self.expire_idle_users()
+        if not self._dirty and not expired:
+            return
+
+        rows = []
+        for user_id, history in self._history.items():
+            previous = 0
+            for replied_at in history:
+                # (user_id, replied_at) が主キーなので、同じミリ秒の記録は1ミリ秒ずらして残す
+                previous = max(int(replied_at * 1000), previous + 1)
+                rows.append((user_id, previous))
+        # 保存中に記録されたリプライは次回のスナップショットに回す
+        self._dirty = False
+        if not await self.db.save_rate_limits(rows):
+            self._dirty = True
+            return
+        logger.debug(f"レート制限スナップショット保存: {len(self._history)}人 ({len(rows)}件)")
+
+    def get_tracked_user_count(self) -> int:
+        """ウィンドウ内にリプライ記録のあるユーザー数"""
+        return len(self._history)
@@ -3,11 +3,15 @@
 メンション検出・キーワードフォローバック・Gemini返信
 """
 
+import asyncio
 import logging
+import time
+from collections import OrderedDict
 from misskey_client import MisskeyClient
 from gemini_client import GeminiClient
 from database import Database
 from rate_limiter import RateLimiter
+from keyword_matcher import KeywordMatcher
 from config import bot_config
 
 logger = logging.getLogger(__name__)
@@ -34,34 +38,128 @@ class ReplyManager:
         # キーワードフォローバック
         self.keyword_follow_enabled = bot_config.get("follow.keyword_follow_back.enabled", True)
         self.follow_keywords = bot_config.get("follow.keyword_follow_back.keywords", [])
+        self.follow_keyword_matcher = KeywordMatcher(self.follow_keywords)
         
-        # 最後に確認したメンションID
-        self.last_mention_id = None
+        # 処理中・処理済みメンション (ノートID → 処理済みなら True、処理中なら False) のLRU
+        # WebSocketと取りこぼし回収の重複防止。失敗したものは外し、次の回収で再試行する
+        self.dedup_size = bot_config.get("reply.recovery.dedup_size", 1000)
+        self.max_attempts = bot_config.get("reply.recovery.max_attempts", 3)
+        self._handled_note_ids = OrderedDict()
+        self._failed_attempts = {}
+        self._recover_lock = asyncio.Lock()
+        
+        # 回収で取得した通知 (通知ID → ノートID、通知ID順)
+        # 先頭から処理済みのぶんだけカーソルを進める (キューに残ったまま停止しても取りこぼさない)
+        self._unsaved_notifications = OrderedDict()
+        self._cursor_lock = asyncio.Lock()
     
-    async def check_mentions(self):
-        """メンション確認 (1分ごと)"""
-        if not self.reply_enabled:
+    def _mark_handled(self, note_id: str) -> bool:
+        """
+        メンションを処理中として記録
+        :return: 初めて見るメンションなら True、処理中・処理済みなら False
+        """
+        if not note_id:
+            return True
+        
+        if note_id in self._handled_note_ids:
+            self._handled_note_ids.move_to_end(note_id)
+            return False
+        
+        self._handled_note_ids[note_id] = False
+        if len(self._handled_note_ids) > self.dedup_size:
+            self._handled_note_ids.popitem(last=False)
+        return True
+    
+    def _finish_handled(self, note_id: str, succeeded: bool):
+        """
+        処理中のメンションを確定する
+        :param succeeded: 返信・フォローバックが完了 (または意図的にスキップ) したか
+            False なら LRU から外して次の回収で再試行する (max_attempts 回失敗したら諦める)
+        """
+        if not note_id:
             return
         
-        try:
-            # 未読メンション取得
-            mentions = await self.misskey.get_mentions(limit=10)
+        if not succeeded:
+            attempts = self._failed_attempts.get(note_id, 0) + 1
+            if attempts < self.max_attempts:
+                self._failed_attempts[note_id] = attempts
+                self._handled_note_ids.pop(note_id, None)
+                logger.warning(f"🔁 メンション処理失敗: 次の回収で再試行 ({note_id}, {attempts}/{self.max_attempts}回目)")
+                return
+            logger.error(f"❌ メンション処理を{attempts}回失敗したため諦めます: {note_id}")
+        
+        self._failed_attempts.pop(note_id, None)
+        if note_id in self._handled_note_ids:
+            self._handled_note_ids[note_id] = True
+    
+    async def _save_cursor(self):
+        """先頭から続けて処理済みになった通知のぶんだけ、通知カーソルを進めて保存"""
+        async with self._cursor_lock:
+            last_id = None
+            while self._unsaved_notifications:
+                notification_id, note_id = next(iter(self._unsaved_notifications.items()))
+                if note_id and self._handled_note_ids.get(note_id) is not True:
+                    break
+                self._unsaved_notifications.popitem(last=False)
+                last_id = notification_id
             
-            for mention in mentions:
-                mention_id = mention.get('id')
+            if last_id:
+                await self.db.set_state("last_notification_id", last_id)
+    
+    async def check_mentions(self, dispatch=None):
+        """
+        取りこぼしメンションの回収 (起動時・WebSocket再接続時・定期実行)
+        - 保存済みの通知カーソル (sinceId) 以降の通知をページングで全件取得
+        - 処理済みのものは LRU / 投稿履歴で除外
+        - カーソルは処理が終わった通知までしか進めない (処理待ち・失敗したものは次回も取得される)
+        :param dispatch: メンションの処理先 (省略時は handle_mention を直接呼ぶ)
+        """
+        if not self.reply_enabled:
+            return
+        
+        dispatch = dispatch or self.handle_mention
+        
+        async with self._recover_lock:
+            try:
+                # カーソルは読み取り専用接続で読むので、直前の保存をコミットしてから
+                await self.db.flush()
+                since_id = await self.db.get_state("last_notification_id")
+                notifications = await self.misskey.fetch_mention_notifications(since_id=since_id)
                 
-                # 既読スキップ
-                if self.last_mention_id and mention_id == self.last_mention_id:
-                    break
+                if not since_id:
+                    # 初回起動: 過去の通知には返信せず、カーソルだけ記録する
+                    if notifications:
+                        await self.db.set_state("last_notification_id", notifications[-1]['id'])
+                        logger.info("📌 通知カーソル初期化: 以降のメンションから回収対象")
+                    return
                 
-                await self.handle_mention(mention)
-            
-            # 最新メンションIDを記録
-            if mentions:
-                self.last_mention_id = mentions[0].get('id')
+                recovered = 0
+                # 取得し直した範囲で作り直す (前回の失敗分も含めて、カーソルより後ろが全部返ってくる)
+                self._unsaved_notifications.clear()
+                try:
+                    for notification in notifications:
+                        note = notification.get('note')
+                        note_id = note.get('id') if isinstance(note, dict) else None
+                        self._unsaved_notifications[notification['id']] = note_id
+                        
+                        if note_id and note_id not in self._handled_note_ids:
+                            if await self.db.has_replied(note_id):
+                                self._mark_handled(note_id)
+                                self._finish_handled(note_id, True)
+                            else:
+                                await dispatch(note)
+                                recovered += 1
+                finally:
+                    # 処理が終わった位置までカーソルを進める (残りは処理が終わるたびに進める)
+                    await self._save_cursor()
                 
-        except Exception as e:
-            logger.error(f"メンション確認エラー: {e}")
+                if recovered:
+                    logger.info(f"🔁 取りこぼしメンション回収: {recovered}件")
+                else:
+                    logger.debug("取りこぼしメンションなし")
+                    
+            except Exception as e:
+                logger.error(f"メンション確認エラー: {e}")
     
     async def handle_mention(self, mention: dict):
         """
@@ -74,6 +172,30 @@ class ReplyManager:
             logger.warning(f"⚠️ メンションデータが不正 (type={type(mention).__name__}): {mention}")
             return
         
+        # 重複防止 (WebSocket と取りこぼし回収の両方から届く場合がある)
+        note_id = mention.get('id')
+        if not self._mark_handled(note_id):
+            logger.debug(f"⏭️  処理済みメンションをスキップ: {note_id}")
+            return
+        
+        try:
+            succeeded = await self._process_mention(mention)
+        except asyncio.CancelledError:
+            # 停止による中断は失敗に数えない (カーソルは進めないので次回の回収で処理し直す)
+            self._handled_note_ids.pop(note_id, None)
+            raise
+        except Exception:
+            self._finish_handled(note_id, False)
+            await self._save_cursor()
+            raise
+        self._finish_handled(note_id, succeeded)
+        await self._save_cursor()
+    
+    async def _process_mention(self, mention: dict) -> bool:
+        """
+        メンション1件の処理本体
+        :return: 完了 (または意図的にスキップ) したら True、失敗して再試行が必要なら False
+        """
         user = mention.get('user') or {}
         user_id = user.get('id') if isinstance(user, dict) else None
         username = user.get('username') if isinstance(user, dict) else None
@@ -82,75 +204,83 @@ class ReplyManager:
         logger.info(f"📩 メンション受信: @{username} - {text[:50]}...")
         
         # キーワードフォローバック検出
-        is_follow_keyword = self.keyword_follow_enabled and any(kw in text for kw in self.follow_keywords)
+        is_follow_keyword = self.keyword_follow_enabled and self.follow_keyword_matcher.contains_any(text)
         
         if is_follow_keyword:
-            await self.handle_keyword_follow(user_id, username)
+            if not await self.handle_keyword_follow(user_id, username):
+                return False
             # キーワードフォローバックの場合はリプライをスキップ
             logger.info(f"⏸️  キーワードフォローバック完了: リプライスキップ (@{username})")
-            return
+            return True
         
         # 通常のリプライ処理
-        await self.handle_reply(mention)
+        return await self.handle_reply(mention)
     
-    async def handle_keyword_follow(self, user_id: str, username: str):
+    async def handle_keyword_follow(self, user_id: str, username: str) -> bool:
         """
         キーワードフォローバック処理
+        :return: 完了 (またはフォローバック不要) なら True、失敗したら False
         """
         try:
             # 既にフォロワーかチェック
-            is_follower = await self.db.is_follower(user_id)
+            is_follower = self.db.is_follower(user_id)
             if not is_follower:
                 logger.info(f"⏸️  フォロワーでないユーザー: @{username}")
-                return
+                return True
             
             # 既にフォローバック済みかチェック
-            already_following = await self.db.is_following_back(user_id)
+            already_following = self.db.is_following_back(user_id)
             if already_following:
                 logger.info(f"既にフォローバック済み: @{username}")
-                return
+                return True
             
             # フォローバック実行
             await self.misskey.follow_user(user_id)
             await self.db.set_following_back(user_id, True)
             logger.info(f"✅ キーワードフォローバック: @{username}")
+            return True
             
         except Exception as e:
             logger.error(f"キーワードフォローバックエラー (@{username}): {e}")
+            return False
     
-    async def handle_reply(self, mention: dict):
+    async def handle_reply(self, mention: dict) -> bool:
         """
         リプライ処理
         - 権限チェック (mutual_only)
         - レート制限チェック
         - Gemini返信生成
+        :return: 返信した (または権限・レート制限でスキップした) なら True、失敗したら False
         """
         user = mention.get('user') or {}
         user_id = user.get('id') if isinstance(user, dict) else None
         username = user.get('username') if isinstance(user, dict) else None
         text = mention.get('text') or ''
         mention_id = mention.get('id')
+        started = time.perf_counter()
+        sent = False
         
         try:
             # 権限チェック
             if not await self._check_reply_permission(user_id):
                 logger.info(f"⏸️  リプライスキップ (権限不足): @{username}")
-                return
+                return True
             
             # レート制限チェック
             if not await self.rate_limiter.check_rate_limit(user_id):
                 logger.info(f"⏸️  リプライスキップ (レート制限): @{username}")
-                return
+                return True
             
             # Gemini返信生成
             reply_text = await self.gemini.generate_reply(text, username)
             
             if reply_text is None:
                 logger.warning(f"⏸️  Gemini APIエラー: リプライスキップ (@{username})")
-                return
+                return False
             
             # Misskeyにリプライ投稿
             await self.misskey.send_note(reply_text, reply_id=mention_id)
+            sent = True
             
             # レート制限記録
             await self.rate_limiter.record_reply(user_id)
@@ -158,21 +288,22 @@ class ReplyManager:
             # データベースに記録
             await self.db.add_post(mention_id, "reply", reply_text)
             
-            logger.info(f"✅ リプライ完了: @{username}")
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logger.info(f"✅ リプライ完了: @{username} (⏱️ {elapsed_ms:.0f}ms)")
+            return True
             
         except Exception as e:
             logger.error(f"リプライエラー (@{username}): {e}")
+            # 投稿できた後のエラーで再試行すると二重に返信してしまう
+            return sent
     
     async def _check_reply_permission(self, user_id: str) -> bool:
         """
         リプライ権限チェック
-        - mutual_only: 相互フォローのみ
+        - mutual_only: 相互フォローのみ (メモリ上の索引で判定)
         """
         if not self.mutual_only:
             return True
         
         # フォロワーかつフォローバック済みか
-        is_follower = await self.db.is_follower(user_id)
-        is_following_back = await self.db.is_following_back(user_id)
-        
-        return is_follower and is_following_back
+        return self.db.is_mutual(user_id)
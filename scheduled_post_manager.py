@@ -13,15 +13,17 @@ from config import bot_config
 logger = logging.getLogger(__name__)
 
 class ScheduledPostManager:
-    def __init__(self, misskey: MisskeyClient, gemini: GeminiClient, db: Database):
+    def __init__(self, misskey: MisskeyClient, gemini: GeminiClient, db: Database, duplicate_checker=None):
         """
         :param misskey: Misskeyクライアント
         :param gemini: Geminiクライアント
         :param db: データベース
+        :param duplicate_checker: DuplicateCheckerインスタンス (オプション、指定時は最近使った文面を避ける)
         """
         self.misskey = misskey
         self.gemini = gemini
         self.db = db
+        self.duplicate_checker = duplicate_checker
     
     async def post_scheduled(self, time_key: str):
         """
@@ -39,8 +41,19 @@ class ScheduledPostManager:
                 logger.warning(f"定時投稿メッセージが未設定: {time_key}")
                 return
             
-            # ランダムに1つ選択
-            content = random.choice(messages)
+            # ランダムな順に、直近の投稿とほぼ同じでない最初のメッセージを選ぶ
+            content = None
+            candidates = random.sample(messages, len(messages))
+            for candidate in candidates:
+                if not self.duplicate_checker or await self.duplicate_checker.find_similar(candidate) is None:
+                    content = candidate
+                    break
+            
+            if content is None:
+                # すべて重複していても定時投稿は飛ばさず、いちばん長く使っていないメッセージにする
+                last_posted = await self.db.get_last_posted_times(f"scheduled_{time_key}")
+                content = min(candidates, key=lambda message: last_posted.get(message, 0))
+                logger.info(f"🔁 すべてのメッセージが最近の投稿と重複: 最も前に使ったメッセージを投稿 ({time_key})")
             
             # Misskeyに投稿
             response = await self.misskey.send_note(content)
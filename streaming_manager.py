@@ -13,17 +13,20 @@ from config import settings
 logger = logging.getLogger(__name__)
 
 class StreamingManager:
-    def __init__(self, misskey: MisskeyClient, reply_manager=None, follow_manager=None):
+    def __init__(self, misskey: MisskeyClient, reply_manager=None, follow_manager=None, mention_dispatcher=None):
         """
         :param misskey: Misskeyクライアント
         :param reply_manager: ReplyManagerインスタンス (オプション)
         :param follow_manager: FollowManagerインスタンス (オプション)
+        :param mention_dispatcher: MentionDispatcherインスタンス (オプション、指定時はメンションをキュー経由で処理)
         """
         self.misskey = misskey
         self.reply_manager = reply_manager
         self.follow_manager = follow_manager
+        self.mention_dispatcher = mention_dispatcher
         self.running = False
         self.stream_task = None
+        self.recovery_task = None
         self.ws = None
     
     async def start(self):
@@ -43,6 +46,9 @@ class StreamingManager:
         if self.ws:
             await self.ws.close()
         
+        if self.recovery_task and not self.recovery_task.done():
+            self.recovery_task.cancel()
+        
         if self.stream_task:
             self.stream_task.cancel()
             try:
@@ -62,7 +68,7 @@ class StreamingManager:
         ws_url_with_token = f"{ws_url}?i={settings.misskey_api_token}"
         
         retry_count = 0
-        max_retries = 5
+        max_retries = 5  # これを超えたらエラーログを出しつつ60秒間隔で再接続を続ける
         
         while self.running:
             try:
@@ -78,6 +84,9 @@ class StreamingManager:
                     
                     logger.info("✅ WebSocket接続成功")
                     
+                    # 起動時・再接続時: 切断中に届いたメンションを回収 (受信ループは止めない)
+                    self._start_mention_recovery()
+                    
                     # メッセージ受信ループ
                     async for message in websocket:
                         if not self.running:
@@ -99,15 +108,25 @@ class StreamingManager:
             # 再接続処理
             if self.running:
                 retry_count += 1
-                if retry_count > max_retries:
-                    logger.error(f"WebSocket再接続失敗 ({max_retries}回): 停止します")
-                    self.running = False
-                    break
+                if retry_count == max_retries + 1:
+                    logger.error(f"WebSocket再接続失敗 ({max_retries}回): 60秒間隔で再試行を続けます")
                 
                 wait_time = min(2 ** retry_count, 60)  # 指数バックオフ (最大60秒)
                 logger.info(f"WebSocket再接続待機: {wait_time}秒")
                 await asyncio.sleep(wait_time)
     
+    def _start_mention_recovery(self):
+        """取りこぼしメンション回収をバックグラウンドで開始"""
+        if not self.reply_manager:
+            return
+        
+        if self.recovery_task and not self.recovery_task.done():
+            return
+        
+        self.recovery_task = asyncio.create_task(
+            self.reply_manager.check_mentions(dispatch=self._dispatch_mention)
+        )
+    
     async def _subscribe_channels(self, websocket):
         """チャンネル購読"""
         # mainストリームに接続
@@ -152,26 +171,41 @@ class StreamingManager:
         
         # メンション通知
         if event_type == 'mention':
-            note = event_body
-            if self.reply_manager:
-                logger.info("🔔 メンション通知受信 (WebSocket)")
-                await self.reply_manager.handle_mention(note)
+            logger.info("🔔 メンション通知受信 (WebSocket)")
+            await self._dispatch_mention(event_body)
         
         # リプライ通知
         elif event_type == 'reply':
-            note = event_body
-            if self.reply_manager:
-                logger.info("🔔 リプライ通知受信 (WebSocket)")
-                await self.reply_manager.handle_mention(note)
+            logger.info("🔔 リプライ通知受信 (WebSocket)")
+            await self._dispatch_mention(event_body)
         
-        # フォロー通知
+        # フォロー通知 (body はユーザーオブジェクト)
         elif event_type == 'followed':
-            user = event_body.get('user', {})
+            user = event_body.get('user') or event_body
             if self.follow_manager:
                 logger.info(f"🔔 フォロー通知受信: @{user.get('username', 'unknown')}")
-                # フォロー同期を即座に実行
-                await self.follow_manager.check_and_sync_followers()
+                # 差分だけDBに反映し、全件同期はデバウンスして後でまとめて実行
+                await self.follow_manager.on_followed(user)
+        
+        # bot がフォローした / フォロー解除した
+        elif event_type == 'follow':
+            if self.follow_manager:
+                await self.follow_manager.on_follow(event_body)
+        
+        elif event_type == 'unfollow':
+            if self.follow_manager:
+                await self.follow_manager.on_unfollow(event_body)
         
         # その他のイベント
         else:
             logger.debug(f"未対応イベント: {event_type}")
+    
+    async def _dispatch_mention(self, note: dict):
+        """
+        メンションを処理へ回す
+        - ディスパッチャーがあればキューに積むだけで受信ループに戻る
+        """
+        if self.mention_dispatcher:
+            await self.mention_dispatcher.submit(note)
+        elif self.reply_manager:
+            await self.reply_manager.handle_mention(note)
@@ -0,0 +1,25 @@
+"""
+テスト共通設定
+- config.py は import 時に環境変数と config.yaml を読むので、ダミーの値を入れてからリポジトリ直下で読み込ませる
+- DB を使うテストは tmp_path に作る (本番の data/ には触れない)
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+os.environ.setdefault("MISSKEY_INSTANCE_URL", "https://misskey.example")
+os.environ.setdefault("MISSKEY_API_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    """テスト用データベースのパス"""
+    return str(tmp_path / "riina_bot.db")
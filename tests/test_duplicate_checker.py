@@ -0,0 +1,141 @@
+"""類似投稿チェック (全文検索インデックスで候補を絞る) を、全投稿との総当たりと突き合わせるテスト"""
+
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from database import Database, epoch_ms
+from duplicate_checker import DuplicateChecker, similarity, trigrams
+from scheduled_post_manager import ScheduledPostManager
+
+HIRAGANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+
+def random_text(rng: random.Random) -> str:
+    words = ["".join(rng.choice(HIRAGANA) for _ in range(rng.randint(4, 25))) for _ in range(rng.randint(1, 3))]
+    return " ".join(words)
+
+
+def edit(rng: random.Random, text: str) -> str:
+    """1〜2文字の置換・挿入・削除"""
+    chars = list(text)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        op = rng.random()
+        if op < 0.4:
+            chars[i] = rng.choice(HIRAGANA)
+        elif op < 0.7:
+            chars.insert(i, rng.choice(HIRAGANA))
+        elif len(chars) > 1:
+            del chars[i]
+    return "".join(chars)
+
+
+async def open_db(db_path: str) -> Database:
+    db = Database()
+    db.db_path = db_path
+    await db.connect()
+    return db
+
+
+def test_trigrams_and_similarity():
+    assert trigrams("あい うえお") == {"あいう", "いうえ", "うえお"}
+    assert trigrams("あい") == set()
+    assert similarity(trigrams("おはようございます"), trigrams("おはようございます")) == 1.0
+    assert similarity(trigrams("おはよう"), set()) == 0.0
+    assert similarity({"abc", "bcd"}, {"bcd", "cde"}) == 1 / 3
+
+
+def test_matches_brute_force(db_path):
+    async def run():
+        db = await open_db(db_path)
+        checker = DuplicateChecker(db)
+        rng = random.Random(5)
+        try:
+            posts = [random_text(rng) for _ in range(300)]
+            for i, content in enumerate(posts):
+                await db.add_post(f"n{i}", rng.choice(["random", "timeline", "scheduled_07:30"]), content)
+            await db.flush()
+
+            queries = [edit(rng, rng.choice(posts)) for _ in range(150)] + [random_text(rng) for _ in range(50)]
+            found = 0
+            for query in queries:
+                grams = trigrams(query)
+                best = max(similarity(grams, trigrams(post)) for post in posts)
+                match = await checker.find_similar(query)
+                if best >= checker.threshold:
+                    assert match is not None, query
+                    assert abs(match[0] - best) < 1e-9, query
+                    found += 1
+                else:
+                    assert match is None, query
+            # 編集が小さいので、ほとんどは重複として見つかるはず
+            assert found >= 100
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_ignores_replies_and_old_posts(db_path):
+    async def run():
+        db = await open_db(db_path)
+        checker = DuplicateChecker(db)
+        try:
+            old = "ずっと前に投稿したとても長い文面だよ〜"
+            await db.db.execute(
+                "INSERT INTO posts (note_id, post_type, content, posted_at) VALUES (?, ?, ?, ?)",
+                ("old", "random", old, epoch_ms(datetime.now() - timedelta(days=checker.days + 1)))
+            )
+            reply = "これはリプライで返した文面なんだよね〜"
+            await db.add_post("r1", "reply", reply)
+            recent = "今日は甲府盆地がとっても暑かったよ〜"
+            await db.add_post("p1", "random", recent)
+            await db.flush()
+
+            assert await checker.find_similar(reply) is None
+            assert await checker.find_similar(old) is None
+            assert await checker.is_duplicate(recent + "！", "random")
+
+            await checker.trim_index()
+            await db.flush()
+            async with db.db.execute("SELECT COUNT(*) FROM posts_fts") as cursor:
+                assert (await cursor.fetchone())[0] == 1
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+class FakeMisskey:
+    def __init__(self):
+        self.notes = []
+
+    async def send_note(self, content: str):
+        self.notes.append(content)
+        return {'createdNote': {'id': f"n{len(self.notes)}"}}
+
+
+def test_scheduled_post_falls_back_to_least_recent(db_path, monkeypatch):
+    async def run():
+        db = await open_db(db_path)
+        misskey = FakeMisskey()
+        messages = [f"おはよう〜 今朝のメッセージその{i}番だよっ" for i in range(4)]
+        manager = ScheduledPostManager(misskey, None, db, DuplicateChecker(db))
+        monkeypatch.setattr(
+            "scheduled_post_manager.bot_config.get",
+            lambda key, default=None: {"07:30": messages} if key == "posting.scheduled_posts.posts" else default
+        )
+        try:
+            # メッセージを使い切ったら、すべて類似扱いでも最も前に使ったものから順に投稿する
+            for _ in range(len(messages) * 3):
+                await manager.post_scheduled("07:30")
+                await db.flush()
+            assert len(misskey.notes) == len(messages) * 3
+            first_round = misskey.notes[:len(messages)]
+            assert sorted(first_round) == sorted(messages)
+            assert misskey.notes[len(messages):] == first_round * 2
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,261 @@
+"""フォロワー差分 (diff_followers) と同期 (FollowManager.reconcile) を、集合で求めた期待値と突き合わせるテスト"""
+
+import asyncio
+import random
+
+import pytest
+
+from database import Database
+from follow_manager import FollowManager
+from follower_diff import diff_followers
+
+
+async def iter_rows(rows):
+    for row in rows:
+        yield row
+
+
+async def collect_deltas(db_rows, api_rows, compare_mutual, chunk_size):
+    deltas = []
+    async for delta in diff_followers(iter_rows(db_rows), iter_rows(api_rows), compare_mutual, chunk_size):
+        deltas.append(delta)
+    return deltas
+
+
+def random_rows(rng: random.Random, population: int, size: int):
+    """(user_id, username, 相互フォローか) を user_id 順に"""
+    ids = rng.sample(range(population), size)
+    return sorted((f"u{i:05d}", f"name{i}", rng.random() < 0.5) for i in ids)
+
+
+def test_diff_matches_set_difference():
+    rng = random.Random(1234)
+    for _ in range(300):
+        db_rows = random_rows(rng, 200, rng.randint(0, 100))
+        api_rows = random_rows(rng, 200, rng.randint(0, 100))
+        compare_mutual = rng.random() < 0.7
+        chunk_size = rng.randint(1, 40)
+
+        deltas = asyncio.run(collect_deltas(db_rows, api_rows, compare_mutual, chunk_size))
+
+        db_map = {row[0]: row for row in db_rows}
+        api_map = {row[0]: row for row in api_rows}
+        merged = {key: [] for key in ('added', 'removed', 'removed_mutual', 'mutual_on', 'mutual_off')}
+        for delta in deltas:
+            assert sum(len(delta[key]) for key in ('added', 'removed', 'mutual_on', 'mutual_off')) > 0
+            for key in merged:
+                merged[key].extend(delta[key])
+
+        added = api_map.keys() - db_map.keys()
+        removed = db_map.keys() - api_map.keys()
+        assert sorted(merged['added']) == sorted((user_id, api_map[user_id][1]) for user_id in added)
+        assert sorted(merged['removed']) == sorted(removed)
+        assert sorted(merged['removed_mutual']) == sorted(user_id for user_id in removed if db_map[user_id][2])
+
+        if compare_mutual:
+            mutual_on = {user_id for user_id in added if api_map[user_id][2]} | {
+                user_id for user_id in api_map.keys() & db_map.keys()
+                if api_map[user_id][2] and not db_map[user_id][2]
+            }
+            mutual_off = {
+                user_id for user_id in api_map.keys() & db_map.keys()
+                if db_map[user_id][2] and not api_map[user_id][2]
+            }
+        else:
+            mutual_on, mutual_off = set(), set()
+        assert sorted(merged['mutual_on']) == sorted(mutual_on)
+        assert sorted(merged['mutual_off']) == sorted(mutual_off)
+
+
+class FakeMisskey:
+    def __init__(self):
+        self.unfollowed = []
+
+    async def unfollow_user(self, user_id: str):
+        self.unfollowed.append(user_id)
+
+
+async def pages(users, page_size: int = 37, fail_after: int = None):
+    """APIのページ (ユーザーのリスト, カーソル) を返す非同期イテレータ"""
+    for start in range(0, len(users), page_size):
+        await asyncio.sleep(0)
+        if fail_after is not None and start >= fail_after:
+            raise RuntimeError("API error")
+        yield users[start:start + page_size], None
+
+
+def random_users(rng: random.Random, population: int, size: int):
+    """API と同じく user_id 順ではないユーザー一覧"""
+    return [{'id': f"u{i:05d}", 'username': f"name{i}"} for i in rng.sample(range(population), size)]
+
+
+async def followers_table(db: Database):
+    async with db.db.execute("SELECT user_id, is_following_back FROM followers") as cursor:
+        rows = await cursor.fetchall()
+    return {row[0] for row in rows}, {row[0] for row in rows if row[1]}
+
+
+async def staging_rows(db: Database) -> int:
+    async with db.db.execute("SELECT COUNT(*) FROM follower_sync_staging") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+def test_reconcile_matches_api_lists(db_path):
+    async def run():
+        db = Database()
+        db.db_path = db_path
+        await db.connect()
+        misskey = FakeMisskey()
+        manager = FollowManager(misskey, db)
+        manager.sync_chunk_size = 50
+        rng = random.Random(99)
+        try:
+            mutual = set()
+            for _ in range(8):
+                followers = random_users(rng, 600, rng.randint(0, 300))
+                following = random_users(rng, 600, rng.randint(0, 300))
+                previous_mutual = mutual
+                await manager.reconcile(pages(followers), pages(following), unfollow_back=True)
+
+                follower_ids = {user['id'] for user in followers}
+                mutual = follower_ids & {user['id'] for user in following}
+                assert await followers_table(db) == (follower_ids, mutual)
+                assert (db.follower_ids, db.mutual_ids) == (follower_ids, mutual)
+                # 相互フォローだったのにフォロー解除したユーザーだけリムーブバック
+                assert set(misskey.unfollowed) == previous_mutual - follower_ids
+                misskey.unfollowed.clear()
+                assert await staging_rows(db) == 0
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_reconcile_failure_applies_nothing(db_path):
+    async def run():
+        db = Database()
+        db.db_path = db_path
+        await db.connect()
+        manager = FollowManager(FakeMisskey(), db)
+        rng = random.Random(7)
+        try:
+            followers = random_users(rng, 500, 200)
+            following = random_users(rng, 500, 200)
+            await manager.reconcile(pages(followers), pages(following), unfollow_back=False)
+            before = await followers_table(db)
+
+            with pytest.raises(RuntimeError):
+                await manager.reconcile(
+                    pages(random_users(rng, 500, 200)), pages(following, fail_after=100), unfollow_back=False
+                )
+            assert await followers_table(db) == before
+            assert await staging_rows(db) == 0
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_concurrent_reconciles_do_not_share_staging(db_path):
+    """bot と sync_followers.py のように、別々の接続から同時に同期しても結果が崩れない"""
+    async def run():
+        first, second = Database(), Database()
+        for db in (first, second):
+            db.db_path = db_path
+            await db.connect()
+        rng = random.Random(2024)
+        try:
+            for _ in range(3):
+                followers = random_users(rng, 2000, 800)
+                following = random_users(rng, 2000, 800)
+                await asyncio.gather(
+                    FollowManager(FakeMisskey(), first).reconcile(
+                        pages(followers), pages(following), unfollow_back=False
+                    ),
+                    FollowManager(FakeMisskey(), second).reconcile(
+                        pages(followers), pages(following), unfollow_back=False
+                    ),
+                )
+                follower_ids = {user['id'] for user in followers}
+                mutual = follower_ids & {user['id'] for user in following}
+                assert await followers_table(first) == (follower_ids, mutual)
+                assert await staging_rows(first) == 0
+        finally:
+            await second.close()
+            await first.close()
+
+    asyncio.run(run())
+
+
+def test_events_during_sync_schedule_another_reconcile():
+    """同期中・定期スイープ中に届いたイベントも、そのあとの同期で必ず拾う"""
+    async def run():
+        manager = FollowManager(FakeMisskey(), None)
+        manager.reconcile_debounce = 0.01
+        manager.reconcile_max_wait = 0.05
+        runs = []
+        sync_started = asyncio.Event()
+
+        async def fake_sync():
+            runs.append(asyncio.get_running_loop().time())
+            sync_started.set()
+            await asyncio.sleep(0.05)
+        manager._sync_followers = fake_sync
+
+        # デバウンス後の同期中にイベント → 終わったあとにもう1回
+        manager.schedule_reconcile()
+        await sync_started.wait()
+        manager.schedule_reconcile()
+        await manager._reconcile_task
+        assert len(runs) == 2
+
+        # 定期スイープ中のイベント → スイープ終了後に同期 (スキップしない)
+        runs.clear()
+        sync_started.clear()
+        sweep = asyncio.create_task(manager.check_and_sync_followers())
+        await sync_started.wait()
+        manager.schedule_reconcile()
+        await sweep
+        await manager._reconcile_task
+        assert len(runs) == 2
+
+        # イベントがなければ余分に同期しない
+        runs.clear()
+        manager.schedule_reconcile()
+        manager.schedule_reconcile()
+        await manager._reconcile_task
+        assert len(runs) == 1
+
+    asyncio.run(run())
+
+
+def test_sweep_repairs_mutual_state(db_path):
+    """ストリームの follow / unfollow を取りこぼしても、定期スイープで相互フォロー状態が直る"""
+    class RelationsMisskey(FakeMisskey):
+        def __init__(self, followers, following):
+            super().__init__()
+            self.relations = {'followers': followers, 'following': following}
+
+        def iter_relation_pages(self, kind):
+            return pages(self.relations[kind])
+
+    async def run():
+        db = Database()
+        db.db_path = db_path
+        await db.connect()
+        followers = [{'id': f"u{i}", 'username': f"name{i}"} for i in range(10)]
+        misskey = RelationsMisskey(followers, followers[:5])
+        manager = FollowManager(misskey, db)
+        try:
+            await manager.check_and_sync_followers()
+            assert db.mutual_ids == {f"u{i}" for i in range(5)}
+
+            # ストリームを取りこぼしたまま、API 上のフォロー中だけが変わった
+            misskey.relations['following'] = followers[3:8]
+            await manager.check_and_sync_followers()
+            assert db.mutual_ids == {f"u{i}" for i in range(3, 8)}
+            assert (await followers_table(db))[1] == {f"u{i}" for i in range(3, 8)}
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+"""KeywordMatcher を素朴な部分文字列検索と突き合わせるテスト"""
+
+import random
+
+from keyword_matcher import KeywordMatcher, normalize
+
+# 重なり・接頭辞・接尾辞が起きやすいよう、少ない文字種から作る (全角・大文字は正規化で揺れを吸収する)
+ALPHABET = "abAＢｃ死ねバカ"
+
+
+def naive_find_all(keywords, text):
+    """正規化したキーワードのうち、正規化したテキストに含まれるもの"""
+    text = normalize(text)
+    words = {normalize(keyword.strip()) for keyword in keywords if keyword and keyword.strip()}
+    return {word for word in words if word in text}
+
+
+def random_string(rng: random.Random, max_length: int) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def test_matches_naive_search():
+    rng = random.Random(20240601)
+    for _ in range(2000):
+        keywords = [random_string(rng, 4) for _ in range(rng.randint(0, 8))]
+        text = random_string(rng, 30)
+
+        matcher = KeywordMatcher(keywords)
+        expected = naive_find_all(keywords, text)
+
+        assert matcher.contains_any(text) == bool(expected), (keywords, text)
+        assert set(matcher.find_all(text)) == expected, (keywords, text)
+        assert len(matcher.find_all(text)) == len(expected)
+
+
+def test_keyword_count_ignores_blanks_and_duplicates():
+    matcher = KeywordMatcher(["バカ", "ﾊﾞｶ", "  ", "", "ABC", "abc"])
+    assert len(matcher) == 2
+
+
+def test_normalizes_width_and_case():
+    matcher = KeywordMatcher(["ＮＧワード"])
+    assert matcher.contains_any("これはngワードです")
+    assert matcher.find_all("NGワードとＮＧワード") == ["ngワード"]
+    assert not matcher.contains_any("ng ワード")
+
+
+def test_empty_matcher_and_text():
+    assert not KeywordMatcher().contains_any("なんでも")
+    assert KeywordMatcher(["a"]).find_all("") == []
@@ -0,0 +1,107 @@
+"""取りこぼしメンション回収: 通知カーソルは処理が終わった通知までしか進まないことのテスト"""
+
+import asyncio
+
+from database import Database
+from mention_dispatcher import MentionDispatcher
+from reply_manager import ReplyManager
+
+
+class FakeMisskey:
+    def __init__(self, count: int):
+        self.notifications = [
+            {'id': f"notif{i:03d}", 'note': {'id': f"note{i:03d}", 'user': {'id': f"user{i % 3}", 'username': "u"},
+                                              'text': "こんにちは"}}
+            for i in range(count)
+        ]
+        self.replies = []
+
+    async def fetch_mention_notifications(self, since_id=None):
+        return [n for n in self.notifications if since_id is None or n['id'] > since_id]
+
+    async def send_note(self, text, reply_id=None):
+        self.replies.append(reply_id)
+
+
+class FakeGemini:
+    def __init__(self):
+        self.failing = set()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def generate_reply(self, text, username):
+        await self.release.wait()
+        return None if self.failing else "返信"
+
+
+async def open_manager(db_path, misskey, gemini):
+    db = Database()
+    db.db_path = db_path
+    await db.connect()
+    manager = ReplyManager(misskey, gemini, db)
+    manager.mutual_only = False
+    return db, manager
+
+
+async def cursor(db: Database):
+    await db.flush()
+    return await db.get_state("last_notification_id")
+
+
+def test_cursor_waits_for_queued_mentions(db_path):
+    async def run():
+        misskey, gemini = FakeMisskey(6), FakeGemini()
+        db, manager = await open_manager(db_path, misskey, gemini)
+        await db.set_state("last_notification_id", "notif000", durable=True)
+
+        # 返信生成を止めたまま回収 → キューに積んだだけではカーソルは進まない
+        gemini.release.clear()
+        dispatcher = MentionDispatcher(manager)
+        await dispatcher.start()
+        await manager.check_mentions(dispatch=dispatcher.submit)
+        assert await cursor(db) == "notif000"
+
+        # 処理前に停止 (キューの中身は捨てられる) → 次回の回収で全部返信される
+        await dispatcher.stop(drain_timeout=0)
+        assert await cursor(db) == "notif000"
+        assert misskey.replies == []
+
+        gemini.release.set()
+        await manager.check_mentions()
+        assert sorted(misskey.replies) == [f"note{i:03d}" for i in range(1, 6)]
+        assert await cursor(db) == "notif005"
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_failed_mention_is_retried_then_given_up(db_path):
+    async def run():
+        misskey, gemini = FakeMisskey(4), FakeGemini()
+        db, manager = await open_manager(db_path, misskey, gemini)
+        await db.set_state("last_notification_id", "notif000", durable=True)
+
+        gemini.failing.add("all")
+        await manager.check_mentions()
+        assert misskey.replies == []
+        assert await cursor(db) == "notif000"
+
+        # 復旧したら次の回収で返信され、カーソルも進む
+        gemini.failing.clear()
+        await manager.check_mentions()
+        assert sorted(misskey.replies) == ["note001", "note002", "note003"]
+        assert await cursor(db) == "notif003"
+
+        # 失敗し続けるものは max_attempts 回で諦めてカーソルを進める
+        misskey.notifications.append(
+            {'id': "notif100", 'note': {'id': "note100", 'user': {'id': "user9"}, 'text': "やあ"}}
+        )
+        gemini.failing.add("all")
+        for _ in range(manager.max_attempts - 1):
+            await manager.check_mentions()
+            assert await cursor(db) == "notif003"
+        await manager.check_mentions()
+        assert await cursor(db) == "notif100"
+        await db.close()
+
+    asyncio.run(run())
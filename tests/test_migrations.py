@@ -0,0 +1,201 @@
+"""旧形式 (ISO 文字列のタイムスタンプ) のデータベースを最新スキーマまで移行するテスト"""
+
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import aiosqlite
+
+from migrations import SCHEMA_VERSION, get_schema_version, iso_to_epoch_ms, run_migrations
+
+POST_TYPES = ["random", "reply", "timeline", "scheduled_07:30", None]
+
+
+async def create_baseline(path: str, rng: random.Random) -> dict:
+    """スキーマ管理を入れる前の bot が作っていたデータベース (user_version 0)"""
+    async with aiosqlite.connect(path) as conn:
+        await conn.executescript("""
+            CREATE TABLE followers (
+                user_id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                followed_at TEXT NOT NULL,
+                is_following_back BOOLEAN DEFAULT 0
+            );
+            CREATE TABLE posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                note_id TEXT,
+                post_type TEXT,
+                content TEXT,
+                posted_at TEXT NOT NULL
+            );
+            CREATE TABLE reply_rate_limits (
+                user_id TEXT NOT NULL,
+                replied_at TEXT NOT NULL,
+                PRIMARY KEY (user_id, replied_at)
+            );
+        """)
+
+        start = datetime(2025, 1, 1, 9, 0, 0)
+        followers = [
+            (f"u{i}", f"name{i}", (start + timedelta(minutes=i)).isoformat(), rng.randint(0, 1))
+            for i in range(50)
+        ]
+        posts = [
+            (f"n{i}", rng.choice(POST_TYPES), f"投稿{i} " + "あいうえお"[i % 5] * 5,
+             (start + timedelta(hours=rng.randint(0, 2000), microseconds=rng.randint(0, 999999))).isoformat())
+            for i in range(300)
+        ]
+        rate_limits = [(f"u{i % 10}", (start + timedelta(seconds=i)).isoformat()) for i in range(40)]
+
+        await conn.executemany("INSERT INTO followers VALUES (?, ?, ?, ?)", followers)
+        await conn.executemany(
+            "INSERT INTO posts (note_id, post_type, content, posted_at) VALUES (?, ?, ?, ?)", posts
+        )
+        await conn.executemany("INSERT INTO reply_rate_limits VALUES (?, ?)", rate_limits)
+        await conn.commit()
+    return {'followers': followers, 'posts': posts, 'reply_rate_limits': rate_limits}
+
+
+async def fetch_counters(conn) -> dict:
+    async with conn.execute("SELECT name, row_count, first_at, last_at FROM stats_counters") as cursor:
+        return {row[0]: row[1:] for row in await cursor.fetchall() if row[1]}
+
+
+async def expected_counters(conn) -> dict:
+    """集計表に入っているべき値 (全件を数えて求める)"""
+    expected = {}
+    for table in ("followers", "reply_rate_limits"):
+        async with conn.execute(f"SELECT COUNT(*) FROM {table}") as cursor:
+            count = (await cursor.fetchone())[0]
+        if count:
+            expected[table] = (count, None, None)
+    async with conn.execute("SELECT COUNT(*), MIN(posted_at), MAX(posted_at) FROM posts") as cursor:
+        row = await cursor.fetchone()
+    if row[0]:
+        expected['posts'] = tuple(row)
+    async with conn.execute(
+        "SELECT 'posts:' || COALESCE(post_type, ''), COUNT(*), MIN(posted_at), MAX(posted_at) "
+        "FROM posts GROUP BY post_type"
+    ) as cursor:
+        for row in await cursor.fetchall():
+            expected[row[0]] = tuple(row[1:])
+    return expected
+
+
+def test_migrates_baseline_to_latest(db_path):
+    async def run():
+        rng = random.Random(42)
+        baseline = await create_baseline(db_path, rng)
+
+        async with aiosqlite.connect(db_path) as conn:
+            assert await get_schema_version(conn) == 0
+            assert await run_migrations(conn) == SCHEMA_VERSION
+            assert await get_schema_version(conn) == SCHEMA_VERSION
+            # 2回目は何もしない
+            assert await run_migrations(conn) == SCHEMA_VERSION
+
+            # タイムスタンプはエポックミリ秒の整数に変換され、行は失われない
+            async with conn.execute("SELECT user_id, followed_at, typeof(followed_at) FROM followers") as cursor:
+                rows = await cursor.fetchall()
+            assert {row[0]: row[1] for row in rows} == {
+                user_id: iso_to_epoch_ms(followed_at) for user_id, _, followed_at, _ in baseline['followers']
+            }
+            assert {row[2] for row in rows} == {"integer"}
+
+            async with conn.execute("SELECT note_id, posted_at, typeof(posted_at) FROM posts") as cursor:
+                rows = await cursor.fetchall()
+            assert {row[0]: row[1] for row in rows} == {
+                note_id: iso_to_epoch_ms(posted_at) for note_id, _, _, posted_at in baseline['posts']
+            }
+            assert {row[2] for row in rows} == {"integer"}
+
+            async with conn.execute("SELECT COUNT(*) FROM reply_rate_limits") as cursor:
+                assert (await cursor.fetchone())[0] == len(baseline['reply_rate_limits'])
+
+            # 集計表の初期値は実際の件数・最古・最新と一致
+            assert await fetch_counters(conn) == await expected_counters(conn)
+
+            # 全文検索インデックスにはリプライ以外の投稿だけが入る
+            async with conn.execute("SELECT COUNT(*) FROM posts_fts") as cursor:
+                indexed = (await cursor.fetchone())[0]
+            assert indexed == sum(1 for post in baseline['posts'] if post[1] != "reply")
+
+    asyncio.run(run())
+
+
+def test_counters_follow_inserts_and_deletes(db_path):
+    async def run():
+        rng = random.Random(7)
+        await create_baseline(db_path, rng)
+
+        async with aiosqlite.connect(db_path) as conn:
+            await run_migrations(conn)
+            for step in range(300):
+                action = rng.random()
+                if action < 0.4:
+                    await conn.execute(
+                        "INSERT INTO posts (note_id, post_type, content, posted_at) VALUES (?, ?, ?, ?)",
+                        (f"x{step}", rng.choice(POST_TYPES), "本文", rng.randint(1_700_000_000_000, 1_800_000_000_000))
+                    )
+                elif action < 0.7:
+                    # 最古・最新の行も消えるよう、ランダムな行か端の行を消す
+                    order = rng.choice(["RANDOM()", "posted_at", "posted_at DESC"])
+                    await conn.execute(f"DELETE FROM posts WHERE id = (SELECT id FROM posts ORDER BY {order} LIMIT 1)")
+                elif action < 0.8:
+                    await conn.execute(
+                        "INSERT OR IGNORE INTO followers (user_id, username, followed_at) VALUES (?, ?, ?)",
+                        (f"u{rng.randint(0, 80)}", "name", step)
+                    )
+                elif action < 0.9:
+                    await conn.execute("DELETE FROM followers WHERE user_id = ?", (f"u{rng.randint(0, 80)}",))
+                else:
+                    await conn.execute(
+                        "DELETE FROM reply_rate_limits WHERE rowid = (SELECT rowid FROM reply_rate_limits LIMIT 1)"
+                    )
+                if step % 25 == 0:
+                    assert await fetch_counters(conn) == await expected_counters(conn), step
+            await conn.commit()
+
+            # 全部消せば最古・最新も空になる
+            await conn.execute("DELETE FROM posts")
+            counters = await fetch_counters(conn)
+            assert not any(name == "posts" or name.startswith("posts:") for name in counters)
+            async with conn.execute("SELECT first_at, last_at FROM stats_counters WHERE name = 'posts'") as cursor:
+                assert await cursor.fetchone() == (None, None)
+
+    asyncio.run(run())
+
+
+def test_missing_search_index_is_created_on_connect(db_path):
+    """v6 の時点で trigram が使えず索引なしで進んだDBでも、次の接続で作成・登録される"""
+    from database import Database
+
+    async def run():
+        rng = random.Random(11)
+        baseline = await create_baseline(db_path, rng)
+        async with aiosqlite.connect(db_path) as conn:
+            await run_migrations(conn)
+            await conn.executescript("""
+                DROP TRIGGER posts_fts_insert;
+                DROP TRIGGER posts_fts_delete;
+                DROP TABLE posts_fts;
+            """)
+            await conn.commit()
+
+        db = Database()
+        db.db_path = db_path
+        await db.connect()
+        try:
+            assert db.post_index_available
+            async with db.db.execute("SELECT COUNT(*) FROM posts_fts") as cursor:
+                indexed = (await cursor.fetchone())[0]
+            assert indexed == sum(1 for post in baseline['posts'] if post[1] != "reply")
+
+            # 以降の投稿もトリガーで登録される
+            await db.add_post("new", "random", "新しい投稿だよ〜", durable=True)
+            async with db.db.execute("SELECT COUNT(*) FROM posts_fts") as cursor:
+                assert (await cursor.fetchone())[0] == indexed + 1
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+"""投稿履歴アーカイブ: 期限切れの行が posted_at と id の順序が食い違っても失われず、重複もしないことのテスト"""
+
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from database import Database, epoch_ms
+from database_maintenance import DatabaseMaintenance
+from post_archive import PostArchive
+
+
+async def insert_posts(db: Database, posted_at: list):
+    await db.db.executemany(
+        "INSERT INTO posts (note_id, post_type, content, posted_at) VALUES (?, ?, ?, ?)",
+        [(f"note{i}", "random", f"投稿{i}", at) for i, at in enumerate(posted_at)]
+    )
+    await db.db.commit()
+
+
+def test_out_of_order_rows_are_archived_before_delete(db_path, tmp_path):
+    async def run():
+        db = Database()
+        db.db_path = db_path
+        await db.connect()
+        maintenance = DatabaseMaintenance(db)
+        maintenance.archive = PostArchive(str(tmp_path / "archive"), codec="gzip")
+        maintenance.cleanup_batch_size = 7
+        try:
+            # 時計が戻ったなどで posted_at が id 順に並んでいない投稿
+            rng = random.Random(3)
+            now = datetime.now()
+            posted_at = [epoch_ms(now - timedelta(days=rng.randint(1, 60))) for _ in range(100)]
+            await insert_posts(db, posted_at)
+
+            # 保持期間を変えながら何度か掃除すると、id の小さい行が後から期限切れになる
+            for days in (50, 40, 30, 20, 0):
+                await maintenance.cleanup_old_records(days=days)
+
+            archived = list(maintenance.archive.iter_posts())
+            assert sorted(post['note_id'] for post in archived) == sorted(f"note{i}" for i in range(100))
+            async with db.db.execute("SELECT COUNT(*) FROM posts") as cursor:
+                assert (await cursor.fetchone())[0] == 0
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_crash_before_delete_does_not_duplicate(tmp_path):
+    archive = PostArchive(str(tmp_path / "archive"), codec="gzip")
+    at = epoch_ms(datetime(2025, 1, 15))
+    rows = [(i, f"note{i}", "random", f"投稿{i}", at + i) for i in range(1, 6)]
+
+    assert archive.append(rows[:3]) == 3
+    # DBから消す前に落ちた → 次回は同じ行と新しい行をまとめて取得する
+    assert archive.append(rows) == 2
+    assert [post['id'] for post in archive.iter_posts()] == [1, 2, 3, 4, 5]
@@ -0,0 +1,40 @@
+"""投稿バッファ: 期限切れを破棄した直後の残数で補充を判断することのテスト"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from database import Database, epoch_ms
+from post_buffer import PostBuffer
+
+
+def test_refill_counts_after_discarding_expired(db_path):
+    async def run():
+        db = Database()
+        db.db_path = db_path
+        await db.connect()
+        generated = []
+
+        async def generate():
+            generated.append(True)
+            return f"文面{len(generated)}"
+
+        buffer = PostBuffer(db)
+        buffer.register("random", generate)
+        spec = buffer._generators["random"]
+        try:
+            # 期限切れの文面だけで上限まで埋まっている (コミット済み)
+            expired_at = epoch_ms(datetime.now() - spec['max_age'] - timedelta(hours=1))
+            await db.db.executemany(
+                "INSERT INTO post_buffer (post_type, content, created_at) VALUES (?, ?, ?)",
+                [("random", f"古い{i}", expired_at) for i in range(spec['high'])]
+            )
+            await db.db.commit()
+
+            await buffer.refill()
+            assert len(generated) == spec['high']
+            await db.flush()
+            assert await db.count_buffered_posts("random") == spec['high']
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+"""コンテキストキャッシュ作成に失敗したときの再試行間隔のテスト"""
+
+import asyncio
+from types import SimpleNamespace
+
+from google.genai import errors
+
+from prompt_cache import PromptCacheManager
+
+
+class FakeCaches:
+    def __init__(self, error: Exception):
+        self.error = error
+        self.calls = 0
+
+    async def create(self, model, config):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return SimpleNamespace(name="cachedContents/test", expire_time=None)
+
+    async def delete(self, name):
+        pass
+
+
+def make_manager(error: Exception):
+    caches = FakeCaches(error)
+    client = SimpleNamespace(aio=SimpleNamespace(caches=caches))
+    manager = PromptCacheManager(client, "gemini-test")
+    manager.check_interval = 0
+    return manager, caches
+
+
+def test_too_small_prompt_is_not_retried_until_changed():
+    async def run():
+        too_small = errors.ClientError(400, {'error': {
+            'code': 400, 'status': 'INVALID_ARGUMENT',
+            'message': 'Cached content is too small. total_token_count=1200, min_total_token_count=4096',
+        }})
+        manager, caches = make_manager(too_small)
+        await manager._create_cache()
+        assert caches.calls == 1
+        assert not manager._should_create()
+
+        # プロンプトが変われば作り直しを試す
+        manager._prompt_hash = "changed"
+        assert manager._should_create()
+
+    asyncio.run(run())
+
+
+def test_other_errors_back_off_exponentially(monkeypatch):
+    async def run():
+        now = [1000.0]
+        monkeypatch.setattr("prompt_cache.time.monotonic", lambda: now[0])
+        manager, caches = make_manager(errors.ServerError(503, {'error': {'code': 503, 'message': 'unavailable'}}))
+        manager.check_interval = 300
+        manager.max_retry_interval = 2000
+
+        delays = []
+        for _ in range(5):
+            await manager._create_cache()
+            delays.append(manager._retry_at - now[0])
+            assert not manager._should_create()
+            now[0] = manager._retry_at
+            assert manager._should_create()
+        assert delays == [300, 600, 1200, 2000, 2000]
+
+        # 成功したら失敗回数はリセット
+        caches.error = None
+        await manager._create_cache()
+        assert manager.cache_name == "cachedContents/test"
+        assert manager._create_failures == 0
+
+    asyncio.run(run())
@@ -15,15 +15,19 @@ from ng_word_manager import get_ng_word_manager
 logger = logging.getLogger(__name__)
 
 class TimelinePostManager:
-    def __init__(self, misskey, gemini, db):
+    def __init__(self, misskey, gemini, db, post_buffer=None, duplicate_checker=None):
         """
         :param misskey: MisskeyClient インスタンス
         :param gemini: GeminiClient インスタンス
         :param db: Database インスタンス
+        :param post_buffer: PostBuffer インスタンス (オプション、指定時は事前生成した文面を使う)
+        :param duplicate_checker: DuplicateChecker インスタンス (オプション、指定時は類似投稿を作り直す)
         """
         self.misskey = misskey
         self.gemini = gemini
         self.db = db
+        self.post_buffer = post_buffer
+        self.duplicate_checker = duplicate_checker
         
         # NGWordManager を取得
         self.ng_word_manager = get_ng_word_manager()
@@ -39,15 +43,18 @@ class TimelinePostManager:
         self.night_start = bot_config.get("posting.night_mode.start_hour", 23)
         self.night_end = bot_config.get("posting.night_mode.end_hour", 5)
         
+        if self.post_buffer and self.enabled:
+            self.post_buffer.register("timeline", self.generate_timeline_post)
+        
         logger.info(f"📡 タイムライン連動投稿: {'有効' if self.enabled else '無効'}")
         if self.enabled:
             logger.info(f"📡 対象タイムライン: {self.source}")
             logger.info(f"📡 NGワード: {self.ng_word_manager.get_ng_word_count()}件")
     
     async def initialize(self):
-        """非同期初期化（外部NGワード読み込み）"""
-        await self.ng_word_manager.load_external_ng_words()
-        logger.info(f"📡 NGワード読み込み完了: {self.ng_word_manager.get_ng_word_count()}件")
+        """非同期初期化（外部NGワードはキャッシュで起動し、最新版はバックグラウンドで取得）"""
+        self.ng_word_manager.start_background_refresh()
+        logger.info(f"📡 NGワード読み込み完了: {self.ng_word_manager.get_ng_word_count()}件 (キャッシュ)")
     
     def _is_night_time(self) -> bool:
         """現在が夜間時間帯か判定"""
@@ -68,17 +75,12 @@ class TimelinePostManager:
         :return: ノートのリスト
         """
         try:
-            # Misskey.py 4.1.0 の正しいメソッドを使用
-            if self.source == "home":
-                notes = self.misskey.client.notes_timeline(limit=self.max_notes_fetch)
-            elif self.source == "local":
-                notes = self.misskey.client.notes_local_timeline(limit=self.max_notes_fetch)
-            elif self.source == "global":
-                notes = self.misskey.client.notes_global_timeline(limit=self.max_notes_fetch)
-            else:
+            if self.source not in ("home", "local", "global"):
                 logger.error(f"不正なタイムラインソース: {self.source}")
                 return []
             
+            notes = await self.misskey.get_timeline(self.source, limit=self.max_notes_fetch)
+            
             if not notes:
                 logger.warning(f"タイムライン取得結果が空: {self.source}")
                 return []
@@ -215,29 +217,11 @@ class TimelinePostManager:
 
 投稿内容のみを出力してください（説明や前置きは不要）:"""
 
-            # Gemini API 呼び出し
-            from google.genai import types
-            config = types.GenerateContentConfig(
-                system_instruction=self.gemini.character_prompt,
-                temperature=1.0,
-                max_output_tokens=1024
-            )
-            
-            response = self.gemini.client.models.generate_content(
-                model=self.gemini.model_name,
-                contents=prompt,
-                config=config
-            )
+            # 生成プロファイル (gemini.profiles.timeline) + キャラクタープロンプト
+            config = self.gemini.build_config("timeline")
             
-            content = response.text.strip()
-            
-            # 改行削除
-            if '\n' in content:
-                content = content.replace('\n', ' ').replace('  ', ' ')
-            
-            # 140文字制限
-            if len(content) > 140:
-                content = content[:140]
+            # ストリーミング生成 (140文字以内に整形済み)
+            content = await self.gemini.generate_text("timeline", prompt, config)
             
             logger.info(f"✅ タイムライン連動投稿生成成功 ({len(content)}文字): {content}")
             return content
@@ -247,6 +231,32 @@ class TimelinePostManager:
             logger.exception("詳細:")
             return None
     
+    async def generate_timeline_post(self) -> Optional[str]:
+        """
+        タイムライン取得 → キーワード抽出 → 投稿文生成
+        :return: 生成された投稿文 または None
+        """
+        # タイムライン取得
+        notes = await self.fetch_timeline_notes()
+        
+        if not notes:
+            logger.warning("タイムラインが空: 投稿をスキップ")
+            return None
+        
+        # キーワード抽出
+        keywords = self._extract_keywords(notes)
+        
+        if not keywords:
+            logger.warning("キーワードが抽出できませんでした")
+            return None
+        
+        # ランダムにキーワードを選択
+        keyword = random.choice(keywords)
+        logger.info(f"📝 選択されたキーワード: {keyword}")
+        
+        # 投稿文生成
+        return await self.generate_post_from_keyword(keyword)
+    
     async def post_timeline_based(self):
         """
         タイムライン連動投稿を実行
@@ -261,29 +271,26 @@ class TimelinePostManager:
             return
         
         try:
-            # タイムライン取得
-            notes = await self.fetch_timeline_notes()
-            
-            if not notes:
-                logger.warning("タイムラインが空: 投稿をスキップ")
-                return
-            
-            # キーワード抽出
-            keywords = self._extract_keywords(notes)
-            
-            if not keywords:
-                logger.warning("キーワードが抽出できませんでした")
-                return
-            
-            # ランダムにキーワードを選択
-            keyword = random.choice(keywords)
-            logger.info(f"📝 選択されたキーワード: {keyword}")
-            
-            # 投稿文生成
-            post_content = await self.generate_post_from_keyword(keyword)
-            
-            if not post_content:
-                logger.error("投稿文の生成に失敗しました")
+            # 直近の投稿とほぼ同じ文面なら、捨てて取り直す (最大 max_retries 回)
+            attempts = 1 + (self.duplicate_checker.max_retries if self.duplicate_checker else 0)
+            for _ in range(attempts):
+                # 事前生成バッファから取り出し (空ならその場で生成)
+                post_content = None
+                if self.post_buffer:
+                    post_content = await self.post_buffer.take("timeline")
+                if post_content is None:
+                    post_content = await self.generate_timeline_post()
+                
+                if not post_content:
+                    logger.error("投稿文の生成に失敗しました")
+                    return
+                
+                if not self.duplicate_checker or not await self.duplicate_checker.is_duplicate(
+                    post_content, "timeline"
+                ):
+                    break
+            else:
+                logger.warning("🔁 類似投稿が続いたためタイムライン連動投稿をスキップ")
                 return
             
             # 投稿実行